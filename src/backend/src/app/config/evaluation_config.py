@@ -0,0 +1,15 @@
+import os
+
+
+class EvaluationConfig:
+    """Configuration settings for the evaluation/benchmark endpoints."""
+    # Benchmark worker processes, each with its own model copy (1 runs in a single process)
+    BENCHMARK_WORKERS = int(os.getenv("EVAL_BENCHMARK_WORKERS", "1"))
+    # Per-subject benchmark results keyed by a content hash of model, adapter, data and settings
+    RESULT_STORE_DIR = os.getenv("EVAL_RESULT_STORE_DIR", "cache/benchmark_results")
+    # Processes scoring ROUGE/BLEU of streamed generation-eval predictions (0 scores in-process)
+    METRIC_WORKERS = int(os.getenv("EVAL_METRIC_WORKERS", str(max((os.cpu_count() or 2) // 2, 1))))
+    # Predictions per scoring task sent to a metric worker
+    METRIC_CHUNK_SIZE = int(os.getenv("EVAL_METRIC_CHUNK_SIZE", "64"))
+    # Arrow copies of benchmark subjects and their pre-tokenized few-shot prompts
+    DATASET_CACHE_DIR = os.getenv("EVAL_DATASET_CACHE_DIR", "cache/benchmark_datasets")
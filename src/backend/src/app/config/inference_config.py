@@ -0,0 +1,70 @@
+import os
+
+
+class InferenceConfig:
+    """Configuration settings for the chat/inference endpoints."""
+    # Default per-request deadline in seconds (0 disables it)
+    REQUEST_TIMEOUT = float(os.getenv("INFERENCE_REQUEST_TIMEOUT", "0"))
+    # How often a streaming request checks whether its client is still connected
+    DISCONNECT_POLL_INTERVAL = float(os.getenv("INFERENCE_DISCONNECT_POLL_INTERVAL", "0.5"))
+    # Exact-match cache for deterministic (greedy) chat responses; size 0 disables it
+    RESPONSE_CACHE_SIZE = int(os.getenv("INFERENCE_RESPONSE_CACHE_SIZE", "1024"))
+    RESPONSE_CACHE_TTL = float(os.getenv("INFERENCE_RESPONSE_CACHE_TTL", "3600"))  # seconds
+    # Number of distinct models/adapters kept loaded at once (0 means unbounded)
+    MODEL_POOL_SIZE = int(os.getenv("INFERENCE_MODEL_POOL_SIZE", "2"))
+    # Offline /v1/chat/batch jobs
+    BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "16"))
+    BATCH_CHECKPOINT_INTERVAL = int(os.getenv("INFERENCE_BATCH_CHECKPOINT_INTERVAL", "10"))  # batches
+    BATCH_UPLOAD_DIR = os.getenv("INFERENCE_BATCH_UPLOAD_DIR", "uploads/batch")
+    # Admission control: concurrent generations per model and bounded wait queues per lane.
+    # vllm/sglang batch admitted requests together, so the limit is their real concurrency. The
+    # huggingface engine still runs generate calls on a model one at a time (LlamaFactory's
+    # MAX_CONCURRENT semaphore, default 1); there the limit only bounds the requests in flight,
+    # generating or waiting on the engine, and MAX_CONCURRENT must be raised to run them in parallel
+    ADMISSION_MAX_CONCURRENT = int(os.getenv("INFERENCE_MAX_CONCURRENT", "4"))
+    ADMISSION_INTERACTIVE_QUEUE = int(os.getenv("INFERENCE_INTERACTIVE_QUEUE", "16"))
+    ADMISSION_BULK_QUEUE = int(os.getenv("INFERENCE_BULK_QUEUE", "64"))
+    ADMISSION_MAX_WAIT = float(os.getenv("INFERENCE_MAX_QUEUE_WAIT", "30"))  # seconds before a 503
+    # Meta-device initialisation + memory-mapped safetensors when loading models
+    FAST_LOAD = os.getenv("INFERENCE_FAST_LOAD", "true").lower() == "true"
+    # Inference worker processes behind the API (0 runs inference in the API process)
+    WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+    WORKER_HEALTH_INTERVAL = float(os.getenv("INFERENCE_WORKER_HEALTH_INTERVAL", "10"))  # seconds
+    WORKER_HASH_REPLICAS = int(os.getenv("INFERENCE_WORKER_HASH_REPLICAS", "64"))
+    # Session -> worker affinity entries: dropped after the TTL (seconds) or beyond the cap (LRU)
+    WORKER_SESSION_TTL = float(os.getenv("INFERENCE_WORKER_SESSION_TTL", "1800"))
+    WORKER_MAX_SESSIONS = int(os.getenv("INFERENCE_WORKER_MAX_SESSIONS", "10000"))
+    # LoRA serving: "merged" merges every adapter into its own copy at load (LlamaFactory
+    # default); opt-in "auto" serves cold adapters unmerged on a shared base and merges hot ones
+    LORA_MODE = os.getenv("INFERENCE_LORA_MODE", "merged").lower()
+    LORA_RATE_WINDOW = float(os.getenv("INFERENCE_LORA_RATE_WINDOW", "60"))  # seconds
+    LORA_HOT_RATE = float(os.getenv("INFERENCE_LORA_HOT_RATE", "0.5"))  # requests/s to merge
+    LORA_COOL_RATE = float(os.getenv("INFERENCE_LORA_COOL_RATE", "0.1"))  # requests/s to unmerge
+    # Opt-in torch.compile decode (ChatRequest.compile): static KV cache lengths are rounded up
+    # to these buckets so each bucket compiles once; kernels are cached on disk across restarts
+    COMPILE_MODE = os.getenv("INFERENCE_COMPILE_MODE", "default")
+    COMPILE_BUCKETS = os.getenv("INFERENCE_COMPILE_BUCKETS", "256,512,1024,2048,4096")
+    COMPILE_WARMUP_BUCKETS = os.getenv("INFERENCE_COMPILE_WARMUP_BUCKETS", "1024")
+    COMPILE_WARMUP_TOKENS = int(os.getenv("INFERENCE_COMPILE_WARMUP_TOKENS", "32"))
+    COMPILE_CACHE_DIR = os.getenv("INFERENCE_COMPILE_CACHE_DIR", "cache/compile")
+    # Quantized KV cache (ChatRequest.kv_cache): recent tokens kept in full precision, and how
+    # many more concurrent generations a model with a quantized cache is admitted. The cache is
+    # huggingface-only, so the extra requests run in parallel only up to MAX_CONCURRENT (see above)
+    KV_CACHE_RESIDUAL_LENGTH = int(os.getenv("INFERENCE_KV_CACHE_RESIDUAL_LENGTH", "128"))
+    KV_CACHE_CONCURRENCY_FACTOR = float(os.getenv("INFERENCE_KV_CACHE_CONCURRENCY_FACTOR", "2"))
+    # Dynamic int8 serving tier (ChatRequest.quantize); models listed here are always served
+    # quantized, and converted variants are cached on disk so repeat loads skip conversion
+    QUANTIZE_MODELS = [m for m in os.getenv("INFERENCE_QUANTIZE_MODELS", "").split(",") if m]
+    QUANTIZE_CACHE_DIR = os.getenv("INFERENCE_QUANTIZE_CACHE_DIR", "cache/quantized")
+    # Startup preload: YAML/JSON list of ChatRequest model fields to load and warm up before
+    # the readiness probe reports ready; each model runs one short generation per prompt length
+    PRELOAD_CONFIG = os.getenv("INFERENCE_PRELOAD_CONFIG")
+    WARMUP_LENGTHS = os.getenv("INFERENCE_WARMUP_LENGTHS", "32,256,1024")
+    WARMUP_NEW_TOKENS = int(os.getenv("INFERENCE_WARMUP_NEW_TOKENS", "8"))
+    # Upper bound on ``n`` (samples per prompt) of /v1/chat/completions
+    COMPLETIONS_MAX_N = int(os.getenv("INFERENCE_COMPLETIONS_MAX_N", "16"))
+    # infer_backend="auto": the first request per model calibrates every installed engine
+    # (unless disabled) and the fastest is remembered per model and device in this file
+    ENGINE_AUTO_CALIBRATE = os.getenv("INFERENCE_ENGINE_AUTO_CALIBRATE", "true").lower() == "true"
+    ENGINE_CALIBRATION_PATH = os.getenv("INFERENCE_ENGINE_CALIBRATION_PATH", "cache/engine_calibration.json")
+    ENGINE_CALIBRATION_TOKENS = int(os.getenv("INFERENCE_ENGINE_CALIBRATION_TOKENS", "32"))
@@ -42,14 +42,24 @@ class TrainingEvaluateRequest(EvaluateBaseRequest):
     preprocessing_num_workers: Optional[int] = 16
     per_device_eval_batch_size: Optional[int] = 8
     predict_with_generate: Optional[bool] = True
+    dynamic_batching: Optional[bool] = True  # length-sorted generation with slots refilled as rows finish
+    resume: Optional[bool] = True  # continue from predictions already streamed to output_dir
     max_new_tokens: Optional[int] = 512
     top_p: Optional[float] = 0.7
     temperature: Optional[float] = 0.95
 
 # Benchmark evaluation specific request
+class BenchmarkTask(BaseModel):
+    task: str
+    n_shot: Optional[int] = None  # default: the request's n_shot
+    lang: Optional[str] = None  # default: the request's lang
+
 class BenchmarkEvaluateRequest(EvaluateBaseRequest):
     evaluation_type: Literal["benchmark"] = "benchmark"
-    task: str
+    task: Optional[str] = None
+    tasks: Optional[List[BenchmarkTask]] = None  # several tasks in one job, the model loaded once
+    adapter_name_or_path: Optional[str] = None
+    finetuning_type: Optional[str] = None
     task_dir: str = "evaluation"
     save_dir: Optional[str] = None
     template: str = "fewshot"
@@ -59,6 +69,21 @@ class BenchmarkEvaluateRequest(EvaluateBaseRequest):
     lang: Optional[str] = "en"
     batch_size: Optional[int] = 4
     seed: Optional[int] = 42
+    num_workers: Optional[int] = None  # benchmark processes sharing the subjects (default EVAL_BENCHMARK_WORKERS)
+    reuse_prefix: Optional[bool] = False  # one few-shot set per subject, its prefix KV computed once
+    force_refresh: Optional[bool] = False  # ignore stored per-subject results and re-evaluate
+    scoring: Optional[Literal["letter", "continuation"]] = "letter"  # choice-letter logits or choice-text log-likelihood
+    sort_by_length: Optional[bool] = True  # batch prompts of similar length together
+    compare_baseline: Optional[bool] = False  # also score the default way and report agreement/speedup
+    cache_prompts: Optional[bool] = True  # reuse pre-tokenized few-shot prompts from the Arrow cache
+    # Early stopping: score a stratified random sample until the confidence interval decides
+    early_stop: Optional[bool] = False
+    early_stop_threshold: Optional[float] = None  # accuracy (%) the model must beat
+    early_stop_baseline: Optional[str] = None  # result_key of a stored full run to compare against instead
+    early_stop_ci_width: Optional[float] = None  # or stop once the interval is this narrow (% points)
+    early_stop_confidence: Optional[float] = 0.95
+    early_stop_chunk: Optional[int] = 256  # questions scored between interval checks
+    early_stop_min_items: Optional[int] = 100
 
 # Define the evaluation response model
 class EvaluateResponse(BaseModel):
@@ -107,6 +132,7 @@ async def _run_benchmark_task(job_id: str, params: dict):
             job_status[job_id]["message"] = result.get("message", "Benchmark completed successfully")
             if "metrics" in result:
                 job_status[job_id]["metrics"] = result["metrics"]
+            job_status[job_id]["cached"] = result.get("cached", False)
         else:
             job_status[job_id]["status"] = "COMPLETED"
             job_status[job_id]["message"] = "Benchmark completed successfully"
@@ -227,18 +253,22 @@ async def handle_benchmark_evaluation(request: dict, background_tasks: Backgroun
     # Extract required fields for benchmark evaluation
     model_name = request.get("model_name_or_path")
     task = request.get("task")
+    tasks = [{k: v for k, v in dict(spec).items() if v is not None} for spec in request.get("tasks") or []]
     
-    if not task:
+    if not task and not tasks:
         raise HTTPException(status_code=400, detail="Benchmark task is required")
     
     # Prepare parameters
     full_params = {
         "model_name_or_path": model_name,
-        "task": task,
+        "task": task or tasks[0]["task"],
         "task_dir": request.get("task_dir", "evaluation"),
         "template": request.get("template", "fewshot"),
         # "evaluation_type": "benchmark"
     }
+    if tasks:
+        full_params["tasks"] = tasks
+        task = "+".join(dict.fromkeys(spec["task"] for spec in tasks))
     
     # Add save directory if specified, otherwise generate one
     if request.get("save_dir"):
@@ -258,7 +288,10 @@ async def handle_benchmark_evaluation(request: dict, background_tasks: Backgroun
         os.environ["HUGGING_FACE_HUB_TOKEN"] = ''
     
     # Add advanced benchmark parameters
-    advanced_params = ["n_shot", "lang", "batch_size", "seed", "trust_remote_code"]
+    advanced_params = ["n_shot", "lang", "batch_size", "seed", "trust_remote_code", "num_workers", "reuse_prefix",
+                       "force_refresh", "adapter_name_or_path", "finetuning_type", "scoring", "sort_by_length",
+                       "compare_baseline", "cache_prompts", "early_stop", "early_stop_threshold", "early_stop_baseline",
+                       "early_stop_ci_width", "early_stop_confidence", "early_stop_chunk", "early_stop_min_items"]
     for param in advanced_params:
         if param in request:
             full_params[param] = request[param]
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+from app.services.inference.warmup import readiness
+
+router = APIRouter(
+    prefix="/v1/health",
+    tags=["Health"],
+    responses={404: {"description": "Not found health route"}},
+)
+
+@router.get("/live", status_code=status.HTTP_200_OK)
+async def get_liveness():
+    """Liveness probe: the process is up and serving HTTP."""
+    return {"status": "alive"}
+
+@router.get("/ready", status_code=status.HTTP_200_OK)
+async def get_readiness():
+    """
+    Readiness probe: 200 once the configured models are preloaded and warmed up,
+    503 while warming up or after a failed preload, so load balancers only route
+    to a warm server.
+    """
+    if not readiness.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=readiness.stats())
+    return readiness.stats()
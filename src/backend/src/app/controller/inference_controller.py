@@ -8,7 +8,7 @@
 #     "input": "hj"
 # }
 import asyncio
-from fastapi import HTTPException, status, APIRouter, BackgroundTasks, Depends, Request
+from fastapi import HTTPException, status, APIRouter, BackgroundTasks, Depends, Request, Response, UploadFile, File
 import time
 import os
 from pydantic import BaseModel, Field
@@ -21,6 +21,25 @@ import uuid
 
 from llamafactory.chat.chat_model import ChatModel
 from fastapi.responses import StreamingResponse
+from app.services.inference.streaming import GenerationControl, stream_chat
+from app.services.inference.response_cache import is_deterministic, response_cache
+from app.services.inference.model_pool import MODEL_ARG_KEYS, model_pool, normalize_model_args
+from app.services.inference.batch_inference import run_batch_inference as run_batch_inference_job
+from app.services.inference.batching import generate_batch
+from app.services.inference.completions import (
+    StopFilter, completion_chunk, completion_id, completion_response, split_system, usage
+)
+from app.services.inference.admission import AdmissionRejected, AdmissionTicket, admission_controller
+from app.services.inference.metrics import RequestTimer
+from app.services.inference.workers import worker_router
+from app.services.inference.benchmark import (
+    benchmark_kv_cache, benchmark_lora_merge, benchmark_quantized, benchmark_speculative
+)
+from app.services.inference.speculative import check_draft_compatible
+from app.services.inference.engine_selection import engine_selector
+from app.services.inference.kv_cache import admission_capacity_factor
+from app.config.inference_config import InferenceConfig
+from starlette.background import BackgroundTask
 
 router = APIRouter()
 
@@ -32,82 +51,640 @@ class ChatRequest(BaseModel):
     adapter_name_or_path: Optional[str] = None
     template: Optional[str] = None
     finetuning_type: Optional[str] = None
-    infer_backend: Literal["huggingface", "vllm"]  # extend as needed
+    infer_backend: Literal["huggingface", "vllm", "sglang", "auto"]  # auto: calibrated fastest installed engine
     input: str
     session_id: Optional[str] = None  # <-- add session_id for tracking
+    max_new_tokens: Optional[int] = None  # hard cap on generated tokens
+    timeout: Optional[float] = None  # per-request deadline in seconds
+
+    # Sampling overrides; greedy requests (do_sample=False or temperature=0) are cacheable
+    do_sample: Optional[bool] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    top_k: Optional[int] = None
+    repetition_penalty: Optional[float] = None
+    use_cache: bool = True  # set False to bypass the response cache
+    priority: Literal["interactive", "bulk"] = "interactive"  # admission lane
+    timing: bool = False  # add an X-Timing header with the latency breakdown
+    compile: bool = False  # serve from a torch.compile'd static-shape decode (warmed up at load)
+    draft_model_name_or_path: Optional[str] = None  # small same-tokenizer model for speculative decoding
+    kv_cache: Optional[Literal["int8"]] = None  # quantized KV cache for long sessions (pooled per model)
+    quantize: Optional[Literal["int8"]] = None  # dynamic int8 Linear layers (CPU serving tier)
 
 class ChatResponse(BaseModel):
     response: str
     session_id: str  # <-- include session_id in the response
+    finish_reason: Optional[str] = None
+    cached: bool = False
 
-@router.post("/chat/notstream", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+SAMPLING_FIELDS = ["do_sample", "temperature", "top_p", "top_k", "repetition_penalty", "max_new_tokens"]
+
+def _model_args(request: ChatRequest) -> Dict[str, Any]:
+    try:
+        return normalize_model_args({key: getattr(request, key, None) for key in MODEL_ARG_KEYS},
+                                    draft=bool(getattr(request, "draft_model_name_or_path", None)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    obj_chat_model = ChatModel({
-        "model_name_or_path": request.model_name_or_path,
-        "adapter_name_or_path": request.adapter_name_or_path,
+def _draft_args(request: ChatRequest) -> Optional[Dict[str, Any]]:
+    """Pool arguments of the speculative decoding draft model, None when the request has none."""
+    if not request.draft_model_name_or_path:
+        return None
+    if _model_args(request)["infer_backend"] != "huggingface":
+        raise HTTPException(status_code=400, detail="draft_model_name_or_path requires the huggingface backend")
+    return {
+        "model_name_or_path": request.draft_model_name_or_path,
         "template": request.template,
-        "finetuning_type": request.finetuning_type,
-        "infer_backend": request.infer_backend
-    })
+        "infer_backend": "huggingface"
+    }
+
+def _generation_kwargs(request: ChatRequest) -> Dict[str, Any]:
+    return {k: getattr(request, k) for k in SAMPLING_FIELDS if getattr(request, k, None) is not None}
+
+def _response_cache_key(request: ChatRequest, messages: List[Dict[str, str]],
+                        gen_kwargs: Dict[str, Any]) -> Optional[str]:
+    """Cache key for deterministic requests, None when the response must not be cached."""
+    if not (request.use_cache and response_cache.enabled and is_deterministic(gen_kwargs)):
+        return None
+    return response_cache.make_key(_model_args(request), messages, gen_kwargs)
+
+async def _admit(model_args: Dict[str, Any], lane: str, bounded: bool = True) -> AdmissionTicket:
+    """Wait for a generation slot, turning admission rejections into 429/503 responses."""
+    try:
+        return await admission_controller.admit(model_pool.make_key(model_args), lane=lane, bounded=bounded,
+                                                capacity_factor=admission_capacity_factor(model_args))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected chat request ({e.status_code}): {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
+
+async def _open_stream(model_args: Dict[str, Any], messages: List[Dict[str, str]], control: GenerationControl,
+                       http_request: Request, session_id: str, gen_kwargs: Dict[str, Any],
+                       draft_args: Optional[Dict[str, Any]] = None):
+    """Return the token stream from a worker process, or from the in-process model pool."""
+    if worker_router.enabled:
+        return worker_router.stream_chat(model_args, model_pool.make_key(model_args), messages, control,
+                                         request=http_request, session_id=session_id, draft_args=draft_args,
+                                         **gen_kwargs)
+    obj_chat_model = await model_pool.acquire(model_args)
+    draft_model = None
+    if draft_args is not None:
+        draft_model = await model_pool.acquire(draft_args)
+        try:
+            check_draft_compatible(obj_chat_model, draft_model)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return stream_chat(obj_chat_model, messages, control, request=http_request, draft_model=draft_model,
+                       **gen_kwargs)
+
+@router.post("/chat/notstream", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest, http_request: Request, response: Response):
 
     session_id = request.session_id or str(uuid.uuid4())
     # Retrieve or initialize chat history
     history = chat_histories.setdefault(session_id, [])
-    # Add current user message
-    history.append({"role": "user", "content": request.input})
-
-    output = await obj_chat_model.achat(
-        messages=history,
-        system=None,
-        tools=None,
-        images=None,
-        videos=None,
-        audios=None
-    )
+    # Current user message is only committed to the history once the request is served
+    user_msg = {"role": "user", "content": request.input}
+    messages = history + [user_msg]
+    gen_kwargs = _generation_kwargs(request)
+    model_args = _model_args(request)
+    draft_args = _draft_args(request)
+    timer = RequestTimer(request.model_name_or_path, request.adapter_name_or_path, "chat",
+                         draft=request.draft_model_name_or_path)
+    control = GenerationControl(timeout=request.timeout, max_new_tokens=request.max_new_tokens)
 
-    # Add assistant response to history
-    try:
-        assistant_msg = output.choices[0].message.content
-    except Exception:
-        assistant_msg = str(output)
+    async def generate() -> Dict[str, Any]:
+        ticket = await _admit(model_args, request.priority)
+        timer.record("queue_wait", ticket.wait_time)
+        try:
+            acquire_start = time.perf_counter()
+            stream = await _open_stream(model_args, messages, control, http_request, session_id, gen_kwargs,
+                                        draft_args)
+            timer.record("model_acquire", time.perf_counter() - acquire_start)
+            text = "".join([chunk async for chunk in stream])
+        finally:
+            ticket.release()
+        # Responses cut short by a disconnect or deadline are never shared
+        return {"response": text, "finish_reason": control.finish_reason, "cacheable": control.stop_reason is None}
+
+    cache_key = _response_cache_key(request, messages, gen_kwargs)
+    if cache_key is not None:
+        result, cached = await response_cache.get_or_generate(cache_key, generate)
+    else:
+        result, cached = await generate(), False
+        result.pop("cacheable")
+    assistant_msg = result["response"]
+    timer.finish(None if cached else control, cached=cached)
+    if request.timing:
+        response.headers["X-Timing"] = timer.header()
+
+    # Add the exchange to history
+    history.append(user_msg)
     history.append({"role": "assistant", "content": assistant_msg})
 
-    return ChatResponse(response=assistant_msg, session_id=session_id)
+    return ChatResponse(response=assistant_msg, session_id=session_id,
+                        finish_reason=result["finish_reason"], cached=cached)
 
 @router.post("/chat")
-async def chat_stream_endpoint(request: ChatRequest):
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
     session_id = request.session_id or str(uuid.uuid4())
     history = chat_histories.setdefault(session_id, [])
-    history.append({"role": "user", "content": request.input})
+    user_msg = {"role": "user", "content": request.input}
+    messages = history + [user_msg]
+    gen_kwargs = _generation_kwargs(request)
+    model_args = _model_args(request)
+    draft_args = _draft_args(request)
+    timer = RequestTimer(request.model_name_or_path, request.adapter_name_or_path, "chat_stream",
+                         draft=request.draft_model_name_or_path)
+    headers = {
+        "X-Session-ID": session_id,
+        "Access-Control-Expose-Headers": "X-Session-ID, X-Cache, X-Timing"
+    }
+
+    cache_key = _response_cache_key(request, messages, gen_kwargs)
+    if cache_key is not None:
+        cached = await response_cache.lookup(cache_key)
+        if cached is not None:
+            history.append(user_msg)
+            timer.finish(cached=True)
+            if request.timing:
+                headers["X-Timing"] = timer.header()
+            return StreamingResponse(iter([cached["response"]]), media_type="text/plain",
+                                     headers={**headers, "X-Cache": "HIT"})
+        # Become the leader so identical concurrent requests wait for this generation
+        response_cache.begin(cache_key)
+
+    ticket = None
+    try:
+        # Rejected requests fail fast with 429/503 before any model work happens
+        ticket = await _admit(model_args, request.priority)
+        timer.record("queue_wait", ticket.wait_time)
+        acquire_start = time.perf_counter()
+        control = GenerationControl(timeout=request.timeout, max_new_tokens=request.max_new_tokens)
+        stream = await _open_stream(model_args, messages, control, http_request, session_id, gen_kwargs,
+                                    draft_args)
+        timer.record("model_acquire", time.perf_counter() - acquire_start)
+    except BaseException:
+        if ticket is not None:
+            ticket.release()
+        if cache_key is not None:
+            response_cache.abort(cache_key)
+        raise
+    history.append(user_msg)
+    if request.timing:
+        # Generation has not started yet, so only queue wait and model acquisition are known here
+        headers["X-Timing"] = timer.header()
 
-    obj_chat_model = ChatModel({
-        "model_name_or_path": request.model_name_or_path,
-        "adapter_name_or_path": request.adapter_name_or_path,
-        "template": request.template,
-        "finetuning_type": request.finetuning_type,
-        "infer_backend": request.infer_backend,
-        "low_cpu_mem_usage": False
-    })
     async def token_generator():
-        async for chunk in obj_chat_model.astream_chat(
-            messages=history,
-            system=None,
-            tools=None,
-            images=None,
-            videos=None,
-            audios=None
-        ):
-            yield chunk
+        chunks = []
+        finished = False
+        try:
+            # Stops the engine when the client disconnects or the deadline passes
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+            finished = control.stop_reason is None
+        finally:
+            ticket.release()
+            timer.finish(control)
+            if cache_key is not None:
+                if finished:
+                    response_cache.complete(cache_key, {"response": "".join(chunks),
+                                                        "finish_reason": control.finish_reason})
+                else:
+                    response_cache.abort(cache_key)
         # Optionally, collect the full assistant response and add to history here
 
     # Return session_id in a header for streaming (since body is stream)
     return StreamingResponse(
         token_generator(),
         media_type="text/plain",
-        headers={
-            "X-Session-ID": session_id,
-            "Access-Control-Expose-Headers": "X-Session-ID"
-        }
+        headers={**headers, "X-Cache": "MISS"},
+        # Also frees the slot if the body is never iterated (release is idempotent)
+        background=BackgroundTask(ticket.release)
     )
 
+class ChatCompletionMessage(BaseModel):
+    role: Literal["system", "user", "assistant"]
+    content: str
+
+class ChatCompletionRequest(BaseModel):
+    """OpenAI chat completions payload; ``model`` is the model_name_or_path."""
+    model_name_or_path: str = Field(alias="model")
+    adapter_name_or_path: Optional[str] = None
+    template: Optional[str] = None
+    finetuning_type: Optional[str] = None
+    infer_backend: Literal["huggingface", "vllm", "sglang", "auto"] = "huggingface"
+    kv_cache: Optional[Literal["int8"]] = None
+    quantize: Optional[Literal["int8"]] = None
+    messages: List[ChatCompletionMessage]
+    n: int = Field(1, ge=1, le=InferenceConfig.COMPLETIONS_MAX_N)  # samples per prompt, sharing one prefill
+    max_tokens: Optional[int] = None
+    stop: Optional[Union[str, List[str]]] = None
+    stream: bool = False
+    timeout: Optional[float] = None
+    priority: Literal["interactive", "bulk"] = "interactive"
+
+    do_sample: Optional[bool] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    top_k: Optional[int] = None
+    repetition_penalty: Optional[float] = None
+
+    class Config:
+        populate_by_name = True
+
+async def _completion_events(request_id: str, model: str, stream, control: GenerationControl,
+                             stop_filter: StopFilter, ticket: AdmissionTicket, timer: RequestTimer):
+    """Re-emit a single-sequence token stream as ``chat.completion.chunk`` events."""
+    try:
+        yield completion_chunk(request_id, model, role="assistant", content="")
+        async for chunk in stream:
+            text = stop_filter.feed(chunk)
+            if text:
+                yield completion_chunk(request_id, model, content=text)
+            if stop_filter.stopped:
+                # Ends the generation too; finish_reason becomes "stop"
+                control.cancel("stop")
+                break
+        text = stop_filter.flush()
+        if text:
+            yield completion_chunk(request_id, model, content=text)
+        yield completion_chunk(request_id, model, finish_reason=control.finish_reason)
+        yield completion_chunk(request_id, model, usage=usage([{
+            "prompt_tokens": control.prompt_tokens or 0, "completion_tokens": control.tokens,
+        }]))
+        yield "data: [DONE]\n\n"
+    finally:
+        ticket.release()
+        timer.finish(control)
+
+def _batched_completion_events(request_id: str, model: str, results: List[Dict[str, Any]]):
+    """Stream already generated ``n`` samples, one content event per choice."""
+    yield completion_chunk(request_id, model, role="assistant", content="")
+    for index, result in enumerate(results):
+        yield completion_chunk(request_id, model, index=index, content=result["response"])
+        yield completion_chunk(request_id, model, index=index, finish_reason=result["finish_reason"])
+    yield completion_chunk(request_id, model, usage=usage(results))
+    yield "data: [DONE]\n\n"
+
+@router.post("/v1/chat/completions")
+async def chat_completions_endpoint(request: ChatCompletionRequest, http_request: Request):
+    """
+    OpenAI-compatible chat completions with ``n`` samples, ``max_tokens``, ``stop`` and ``stream``.
+
+    The ``n`` samples of a prompt are decoded in one batched generate call that
+    prefills the prompt once. A single streamed sample uses the token stream; ``n > 1``
+    with ``stream`` emits each sample once the batch finishes. Both run on the worker
+    processes when enabled and stop on ``timeout`` or client disconnect.
+    """
+    system, messages = split_system([message.model_dump() for message in request.messages])
+    if not messages:
+        raise HTTPException(status_code=400, detail="messages needs at least one user message")
+    model_args = _model_args(request)
+    stop = [request.stop] if isinstance(request.stop, str) else request.stop
+    gen_kwargs = _generation_kwargs(request)
+    if request.max_tokens is not None:
+        gen_kwargs["max_new_tokens"] = request.max_tokens
+    if system is not None:
+        gen_kwargs["system"] = system
+    request_id = completion_id()
+    model = request.model_name_or_path
+    timer = RequestTimer(model, request.adapter_name_or_path, "chat_completions")
+
+    ticket = await _admit(model_args, request.priority)
+    timer.record("queue_wait", ticket.wait_time)
+    if request.stream and request.n == 1:
+        try:
+            acquire_start = time.perf_counter()
+            control = GenerationControl(timeout=request.timeout, max_new_tokens=request.max_tokens)
+            stream = await _open_stream(model_args, messages, control, http_request, request_id, gen_kwargs)
+            timer.record("model_acquire", time.perf_counter() - acquire_start)
+        except BaseException:
+            ticket.release()
+            raise
+        return StreamingResponse(
+            _completion_events(request_id, model, stream, control, StopFilter(stop), ticket, timer),
+            media_type="text/event-stream",
+            background=BackgroundTask(ticket.release)
+        )
+
+    control = GenerationControl(timeout=request.timeout, max_new_tokens=request.max_tokens)
+    try:
+        if worker_router.enabled:
+            # The worker acquires the model itself, so acquisition is part of generate here
+            generate_start = time.perf_counter()
+            results = await worker_router.generate_batch(model_args, model_pool.make_key(model_args), [messages],
+                                                         control, request=http_request, stop=stop,
+                                                         num_return_sequences=request.n, **gen_kwargs)
+        else:
+            acquire_start = time.perf_counter()
+            chat_model = await model_pool.acquire(model_args)
+            timer.record("model_acquire", time.perf_counter() - acquire_start)
+            generate_start = time.perf_counter()
+            results = await generate_batch(chat_model, [messages], control=control, request=http_request, stop=stop,
+                                           num_return_sequences=request.n, **gen_kwargs)
+        timer.record("generate", time.perf_counter() - generate_start)
+    finally:
+        ticket.release()
+    timer.finish()
+
+    if request.stream:
+        return StreamingResponse(_batched_completion_events(request_id, model, results),
+                                 media_type="text/event-stream")
+    return completion_response(request_id, model, results)
+
+@router.get("/v1/chat/cache")
+async def get_response_cache_stats():
+    """Return hit/miss/coalescing counters of the chat response cache."""
+    return response_cache.stats()
+
+@router.delete("/v1/chat/cache")
+async def clear_response_cache():
+    """Drop every cached chat response."""
+    response_cache.clear()
+    return {"status": "cleared"}
+
+
+
+class BatchChatRequest(BaseModel):
+    model_name_or_path: str
+    adapter_name_or_path: Optional[str] = None
+    template: Optional[str] = None
+    finetuning_type: Optional[str] = None
+    infer_backend: Literal["huggingface", "vllm", "sglang", "auto"] = "huggingface"
+    input_path: str  # local JSONL with {"input": ...} or {"messages": [...]} per line
+    kv_cache: Optional[Literal["int8"]] = None  # quantized KV cache so larger batches fit
+    quantize: Optional[Literal["int8"]] = None  # dynamic int8 Linear layers (CPU serving tier)
+    output_path: Optional[str] = None
+    batch_size: Optional[int] = None
+    checkpoint_interval: Optional[int] = None  # batches between checkpoints
+    resume: bool = True
+
+    do_sample: Optional[bool] = None
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    top_k: Optional[int] = None
+    repetition_penalty: Optional[float] = None
+    max_new_tokens: Optional[int] = None
+
+class BatchChatResponse(BaseModel):
+    job_id: str
+    status: str
+    output_path: str
+
+async def _run_batch_task(job_id: str, params: dict):
+    """Background task to run batch inference and update job status."""
+    def on_progress(completed: int, total: int):
+        job_status[job_id]["progress"] = completed / total if total else 1.0
+        job_status[job_id]["message"] = f"Generated {completed}/{total} prompts"
+
+    try:
+        job_status[job_id]["status"] = "RUNNING"
+        job_status[job_id]["message"] = "Batch inference in progress"
+
+        result = await run_batch_inference_job(job_id, params, on_progress=on_progress)
+
+        job_status[job_id]["status"] = result.get("status", "COMPLETED").upper()
+        job_status[job_id]["message"] = result.get("message", "Batch inference completed")
+        if "metrics" in result:
+            job_status[job_id]["metrics"] = result["metrics"]
+        job_status[job_id]["progress"] = 1.0
+        logger.info(f"Batch job {job_id} completed successfully")
+
+    except Exception as e:
+        logger.error(f"Error in batch job {job_id}: {str(e)}", exc_info=True)
+        job_status[job_id]["status"] = "FAILED"
+        job_status[job_id]["message"] = f"Error: {str(e)}"
+
+@router.post("/v1/chat/batch", response_model=BatchChatResponse)
+async def chat_batch_endpoint(request: BatchChatRequest, background_tasks: BackgroundTasks):
+    """Schedule offline batched generation over a JSONL file; poll progress via the status route."""
+    if not os.path.isfile(request.input_path):
+        raise HTTPException(status_code=400, detail=f"Input file not found: {request.input_path}")
+
+    output_path = request.output_path or f"{os.path.splitext(request.input_path)[0]}.results.jsonl"
+    params = {
+        "model_args": _model_args(request),
+        "input_path": request.input_path,
+        "output_path": output_path,
+        "batch_size": request.batch_size,
+        "checkpoint_interval": request.checkpoint_interval,
+        "resume": request.resume,
+        "generation_kwargs": _generation_kwargs(request),
+    }
+    job_id = f"batch-{int(time.time())}-{uuid.uuid4().hex[:6]}"
+    job_status[job_id] = {
+        "status": "PENDING",
+        "progress": 0.0,
+        "message": "Batch inference job queued",
+        "parameters": params
+    }
+    background_tasks.add_task(_run_batch_task, job_id, params)
+
+    logger.info(f"Batch job {job_id} scheduled for background execution")
+    return {"job_id": job_id, "status": "PENDING", "output_path": output_path}
+
+@router.post("/v1/chat/batch/upload")
+async def upload_batch_input(file: UploadFile = File(...)):
+    """Store an uploaded JSONL file on the server and return the path to pass as ``input_path``."""
+    os.makedirs(InferenceConfig.BATCH_UPLOAD_DIR, exist_ok=True)
+    input_path = os.path.join(InferenceConfig.BATCH_UPLOAD_DIR, f"{uuid.uuid4().hex}.jsonl")
+    with open(input_path, "wb") as f:
+        while chunk := await file.read(1 << 20):
+            f.write(chunk)
+    return {"input_path": input_path, "filename": file.filename}
+
+@router.get("/v1/chat/batch/{job_id}/status")
+async def get_batch_status(job_id: str):
+    """Get the status and progress of a batch inference job."""
+    if job_id not in job_status:
+        raise HTTPException(status_code=404, detail=f"Batch job {job_id} not found")
+    return {"job_id": job_id, **job_status[job_id]}
+
+@router.get("/v1/chat/admission")
+async def get_admission_stats():
+    """Report per-model active generations, queue depth per lane, rejections and wait times."""
+    return admission_controller.stats()
+
+@router.get("/v1/chat/models")
+async def get_model_pool_stats():
+    """List the models currently loaded in the inference pool (per worker in multi-process mode)."""
+    if worker_router.enabled:
+        return worker_router.stats()
+    return model_pool.stats()
+
+class LoraBenchmarkRequest(BaseModel):
+    model_name_or_path: str
+    adapter_name_or_path: str
+    template: Optional[str] = None
+    prompt: Optional[str] = None
+    max_new_tokens: int = 64
+    runs: int = 3
+
+async def _run_inference_benchmark_task(job_id: str, benchmark: Any, params: dict):
+    """Background task to run an inference benchmark and store its report as the job metrics."""
+    try:
+        job_status[job_id]["status"] = "RUNNING"
+        job_status[job_id]["message"] = "Benchmark in progress"
+
+        if asyncio.iscoroutinefunction(benchmark):
+            metrics = await benchmark(**params)
+        else:
+            metrics = await asyncio.to_thread(benchmark, **params)
+
+        job_status[job_id]["status"] = "COMPLETED"
+        job_status[job_id]["message"] = "Benchmark completed"
+        job_status[job_id]["metrics"] = metrics
+        job_status[job_id]["progress"] = 1.0
+        logger.info(f"Benchmark job {job_id} completed successfully")
+
+    except Exception as e:
+        logger.error(f"Error in benchmark job {job_id}: {str(e)}", exc_info=True)
+        job_status[job_id]["status"] = "FAILED"
+        job_status[job_id]["message"] = f"Error: {str(e)}"
+
+def _schedule_benchmark(kind: str, benchmark: Any, params: dict, background_tasks: BackgroundTasks) -> Dict[str, str]:
+    job_id = f"benchmark-{kind}-{int(time.time())}-{uuid.uuid4().hex[:6]}"
+    job_status[job_id] = {
+        "status": "PENDING",
+        "progress": 0.0,
+        "message": f"{kind} benchmark queued",
+        "parameters": params
+    }
+    background_tasks.add_task(_run_inference_benchmark_task, job_id, benchmark, params)
+    return {"job_id": job_id, "status": "PENDING"}
+
+@router.post("/v1/chat/benchmark/lora")
+async def benchmark_lora_merge_endpoint(request: LoraBenchmarkRequest, background_tasks: BackgroundTasks):
+    """Compare merged vs unmerged (PEFT) decode throughput of a LoRA adapter."""
+    params = {
+        "model_args": {
+            "model_name_or_path": request.model_name_or_path,
+            "adapter_name_or_path": request.adapter_name_or_path,
+            "template": request.template,
+            "finetuning_type": "lora",
+        },
+        "prompt": request.prompt,
+        "max_new_tokens": request.max_new_tokens,
+        "runs": request.runs,
+    }
+    return _schedule_benchmark("lora", benchmark_lora_merge, params, background_tasks)
+
+class SpeculativeBenchmarkRequest(BaseModel):
+    model_name_or_path: str
+    adapter_name_or_path: Optional[str] = None
+    draft_model_name_or_path: str
+    template: Optional[str] = None
+    prompt: Optional[str] = None
+    max_new_tokens: int = 64
+    runs: int = 3
+
+@router.post("/v1/chat/benchmark/speculative")
+async def benchmark_speculative_endpoint(request: SpeculativeBenchmarkRequest, background_tasks: BackgroundTasks):
+    """Compare greedy decode throughput with and without a draft model and report its acceptance rate."""
+    params = {
+        "model_args": {
+            "model_name_or_path": request.model_name_or_path,
+            "adapter_name_or_path": request.adapter_name_or_path,
+            "template": request.template,
+        },
+        "draft_model_name_or_path": request.draft_model_name_or_path,
+        "prompt": request.prompt,
+        "max_new_tokens": request.max_new_tokens,
+        "runs": request.runs,
+    }
+    return _schedule_benchmark("speculative", benchmark_speculative, params, background_tasks)
+
+class KVCacheBenchmarkRequest(BaseModel):
+    model_name_or_path: str
+    adapter_name_or_path: Optional[str] = None
+    template: Optional[str] = None
+    finetuning_type: Optional[str] = None
+    reference_path: str  # text, JSONL or JSON reference set for the perplexity comparison
+    kv_cache: Literal["int8"] = "int8"
+    chunk_size: int = 64
+    max_tokens: int = 2048
+
+@router.post("/v1/chat/benchmark/kv-cache")
+async def benchmark_kv_cache_endpoint(request: KVCacheBenchmarkRequest, background_tasks: BackgroundTasks):
+    """Report perplexity delta and memory per token of a quantized KV cache."""
+    if not os.path.isfile(request.reference_path):
+        raise HTTPException(status_code=400, detail=f"Reference file not found: {request.reference_path}")
+    params = {
+        "model_args": {
+            "model_name_or_path": request.model_name_or_path,
+            "adapter_name_or_path": request.adapter_name_or_path,
+            "template": request.template,
+            "finetuning_type": request.finetuning_type,
+        },
+        "reference_path": request.reference_path,
+        "kv_cache": request.kv_cache,
+        "chunk_size": request.chunk_size,
+        "max_tokens": request.max_tokens,
+    }
+    return _schedule_benchmark("kv-cache", benchmark_kv_cache, params, background_tasks)
+
+class QuantizedBenchmarkRequest(BaseModel):
+    model_name_or_path: str
+    adapter_name_or_path: Optional[str] = None
+    template: Optional[str] = None
+    finetuning_type: Optional[str] = None
+    quantize: Literal["int8"] = "int8"
+    prompts: Optional[List[str]] = None  # defaults to a small built-in prompt set
+    max_new_tokens: int = 32
+
+@router.post("/v1/chat/benchmark/quantized")
+async def benchmark_quantized_endpoint(request: QuantizedBenchmarkRequest, background_tasks: BackgroundTasks):
+    """Compare accuracy and speed of the dynamic int8 serving tier against bf16."""
+    params = {
+        "model_args": {
+            "model_name_or_path": request.model_name_or_path,
+            "adapter_name_or_path": request.adapter_name_or_path,
+            "template": request.template,
+            "finetuning_type": request.finetuning_type,
+        },
+        "quantize": request.quantize,
+        "prompts": request.prompts,
+        "max_new_tokens": request.max_new_tokens,
+    }
+    return _schedule_benchmark("quantized", benchmark_quantized, params, background_tasks)
+
+class EngineCalibrationRequest(BaseModel):
+    model_name_or_path: str
+    adapter_name_or_path: Optional[str] = None
+    template: Optional[str] = None
+    finetuning_type: Optional[str] = None
+    engines: Optional[List[Literal["huggingface", "vllm", "sglang"]]] = None  # defaults to every installed engine
+    prompts: Optional[List[str]] = None
+    max_new_tokens: int = InferenceConfig.ENGINE_CALIBRATION_TOKENS
+    runs: int = 2
+
+@router.get("/v1/chat/engines")
+async def get_engine_stats():
+    """Installed engines, the fallback order on this device and stored calibrations."""
+    return engine_selector.stats()
+
+@router.post("/v1/chat/engines/calibrate")
+async def calibrate_engines_endpoint(request: EngineCalibrationRequest, background_tasks: BackgroundTasks):
+    """Measure each installed engine on the model; the fastest serves its ``infer_backend="auto"`` requests."""
+    params = {
+        "model_args": {
+            "model_name_or_path": request.model_name_or_path,
+            "adapter_name_or_path": request.adapter_name_or_path,
+            "template": request.template,
+            "finetuning_type": request.finetuning_type,
+        },
+        "engines": request.engines,
+        "prompts": request.prompts,
+        "max_new_tokens": request.max_new_tokens,
+        "runs": request.runs,
+    }
+    return _schedule_benchmark("engines", engine_selector.calibrate, params, background_tasks)
+
+@router.get("/v1/chat/benchmark/{job_id}/status")
+async def get_benchmark_status(job_id: str):
+    """Get the status and report of an inference benchmark job."""
+    if job_id not in job_status:
+        raise HTTPException(status_code=404, detail=f"Benchmark job {job_id} not found")
+    return {"job_id": job_id, **job_status[job_id]}
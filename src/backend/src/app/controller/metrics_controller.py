@@ -0,0 +1,33 @@
+from fastapi import APIRouter, status
+from fastapi.responses import PlainTextResponse
+from app.services.inference.metrics import inference_metrics
+from app.services.inference.admission import admission_controller
+
+router = APIRouter(
+    prefix="/v1/metrics",
+    tags=["Metrics"],
+    responses={404: {"description": "Not found metrics route"}},
+)
+
+def _update_admission_gauges():
+    """Copy the current admission queue state into gauges before rendering."""
+    for model_key, stats in admission_controller.stats().items():
+        inference_metrics.set_gauge("inference_active_generations", stats["active"], model_key=model_key)
+        for lane, depth in stats["queued"].items():
+            inference_metrics.set_gauge("inference_queue_depth", depth, model_key=model_key, lane=lane)
+        inference_metrics.set_gauge("inference_rejected_total", stats["rejected"], model_key=model_key)
+
+@router.get("", response_class=PlainTextResponse, status_code=status.HTTP_200_OK)
+async def get_metrics():
+    """
+    Inference latency histograms (queue wait, model acquisition, prefill, TTFT,
+    inter-token latency, tokens/sec) per model/adapter in Prometheus text format.
+    """
+    _update_admission_gauges()
+    return inference_metrics.render_prometheus()
+
+@router.get("/summary", status_code=status.HTTP_200_OK)
+async def get_metrics_summary():
+    """Same metrics as JSON with approximate p50/p95/p99 per histogram."""
+    _update_admission_gauges()
+    return inference_metrics.snapshot()
@@ -103,6 +103,15 @@ def auto_configure_dataset_for_stage(datasets: List[str], stage: str) -> dict:
     return dataset_overrides
 
 
+def _checkpoint_eval_callback(job_id: str):
+    """Append sidecar checkpoint scores to the job's metrics timeline as they arrive."""
+    def on_result(record: dict):
+        metrics = job_status[job_id].setdefault("metrics", {})
+        metrics.setdefault("checkpoint_evals", []).append(record)
+        logger.info(f"Job {job_id}: checkpoint step {record['step']} scored {record.get('score')}")
+    return on_result
+
+
 async def _run_training_task(job_id: str, params: dict):
     """Background task to run training and update job status."""
     try:
@@ -110,12 +119,14 @@ async def _run_training_task(job_id: str, params: dict):
         job_status[job_id]["message"] = "Training in progress"
         
         # Run the actual training
-        result = await run_training_job(job_id, params)
+        result = await run_training_job(job_id, params, on_checkpoint_eval=_checkpoint_eval_callback(job_id))
         
         # Update job status based on result
         if result and isinstance(result, dict):
             job_status[job_id]["status"] = result.get("status", "COMPLETED").upper()
             job_status[job_id]["message"] = result.get("message", "Training completed")
+            if "metrics" in result:
+                job_status[job_id]["metrics"] = result["metrics"]
         else:
             job_status[job_id]["status"] = "COMPLETED"
             job_status[job_id]["message"] = "Training completed successfully"
@@ -228,7 +239,8 @@ async def train_model(request: TrainRequest, background_tasks: BackgroundTasks):
                 "finetuning_type", "token",
                 # Custom dataset configuration fields (used by process_datasets but not LLaMA-Factory)
                 "custom_column_mapping", "prompt_column", "query_column", 
-                "chosen_column", "rejected_column", "response_column", "train_method"
+                "chosen_column", "rejected_column", "response_column", "train_method",
+                "checkpoint_eval"
             ]
             advanced_params = {k: v for k, v in request_dict.items() 
                             if k not in excluded_fields}
@@ -251,6 +263,16 @@ async def train_model(request: TrainRequest, background_tasks: BackgroundTasks):
         # Add detailed dataset information
         if dataset_details:
             full_params["dataset_details"] = dataset_details
+
+        if request.checkpoint_eval is not None:
+            checkpoint_eval = request.checkpoint_eval.dict(exclude_none=True)
+            if not checkpoint_eval.get("task") and not checkpoint_eval.get("eval_dataset"):
+                raise HTTPException(status_code=400, detail="checkpoint_eval needs a `task` or an `eval_dataset`")
+            if checkpoint_eval.get("eval_dataset"):
+                eval_datasets, _, eval_details = process_datasets([checkpoint_eval["eval_dataset"]], "sft")
+                checkpoint_eval["eval_dataset"] = ','.join(eval_datasets)
+                checkpoint_eval["dataset_details"] = eval_details
+            full_params["checkpoint_eval"] = checkpoint_eval
         
         # Handle PPO stage specific requirements
         if validated_stage == "ppo":
@@ -282,6 +304,8 @@ async def train_model(request: TrainRequest, background_tasks: BackgroundTasks):
         logger.info(f"Job {job_id} scheduled for background execution")
         return {"job_id": job_id, "status": "PENDING"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         logger.error("Error handling training request:\n" + traceback.format_exc())
@@ -5,6 +5,24 @@ class TrainResponse(BaseModel):
     job_id: str
     status: str
 
+class CheckpointEvalConfig(BaseModel):
+    """Sidecar evaluation of each checkpoint while training runs; set ``task`` or ``eval_dataset``."""
+    task: Optional[str] = None  # benchmark task, e.g. "mmlu-custom-small_test"
+    task_dir: Optional[str] = "evaluation"
+    n_shot: Optional[int] = 5
+    lang: Optional[str] = "en"
+    eval_dataset: Optional[str] = None  # generation eval (ROUGE/BLEU) on this dataset instead
+    max_samples: Optional[int] = None
+    max_new_tokens: Optional[int] = 512
+    template: Optional[str] = None  # default "fewshot" for benchmarks, the training template otherwise
+    batch_size: Optional[int] = None
+    metric: Optional[str] = None  # score used to rank checkpoints (default "Average" or "eval_rouge-l")
+    greater_is_better: Optional[bool] = True
+    keep_best_k: Optional[int] = None  # delete evaluated checkpoints outside the best k
+    device: Optional[str] = None  # CUDA_VISIBLE_DEVICES of the sidecar process
+    nice: Optional[int] = 10  # CPU priority increment of the sidecar process
+    poll_interval: Optional[float] = 30
+
 class TrainRequest(BaseModel):
     # Basic parameters (always required)
     model_name: str
@@ -60,6 +78,9 @@ class TrainRequest(BaseModel):
     # Additional parameters can be passed without validation
     additional_params: Optional[Dict[str, Any]] = None
 
+    # Evaluate checkpoints in a sidecar process as they are saved
+    checkpoint_eval: Optional[CheckpointEvalConfig] = None
+
     # Advanced dataset configuration fields
     dataset_auto_config: Optional[bool] = None
     dataset_ranking_override: Optional[str] = None
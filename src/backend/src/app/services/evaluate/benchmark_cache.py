@@ -0,0 +1,74 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Any, Callable, Dict, Union
+
+from datasets import Dataset, DatasetDict, load_from_disk
+
+from app.config.evaluation_config import EvaluationConfig
+from app.services.evaluate.result_store import benchmark_result_store
+
+logger = logging.getLogger(__name__)
+
+
+def tokenizer_digest(tokenizer: Any) -> str:
+    """Content digest of a tokenizer: vocabulary and special tokens, not its path."""
+    identity = {
+        "vocab": sorted(tokenizer.get_vocab().items()),
+        "special": tokenizer.all_special_tokens,
+        "class": type(tokenizer).__name__,
+    }
+    return hashlib.sha256(json.dumps(identity).encode("utf-8")).hexdigest()
+
+
+class BenchmarkCache:
+    """Arrow copies of benchmark subjects and of their rendered, tokenized prompts.
+
+    ``load_dataset`` on a task's dataset script resolves and runs the script for
+    every subject, and each run re-renders and re-tokenizes every few-shot prompt.
+    Here a subject is saved once with ``save_to_disk`` under a digest of the task
+    directory, and its prompts under a key of everything that decides them
+    (tokenizer, template, lang, n_shot, seed, few-shot mode). Later runs open both
+    with ``load_from_disk``, which memory-maps the Arrow files.
+    """
+
+    def __init__(self, root: str = EvaluationConfig.DATASET_CACHE_DIR):
+        self.root = root
+
+    @staticmethod
+    def _materialise(path: str, build: Callable[[], Union[Dataset, DatasetDict]]) -> Union[Dataset, DatasetDict]:
+        if not os.path.isdir(path):
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            build().save_to_disk(tmp_path)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # Another worker published the same entry first
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        return load_from_disk(path)
+
+    def task_key(self, task_dir: str, task: str) -> str:
+        task_name = task.split("_")[0]
+        digest = benchmark_result_store.tree_digest(os.path.join(task_dir, task_name))
+        return f"{task_name}-{hashlib.sha256(digest.encode('utf-8')).hexdigest()[:16]}"
+
+    def subject(self, task_key: str, subject: str, load: Callable[[], DatasetDict]) -> DatasetDict:
+        """The subject's splits, built with ``load`` on first use."""
+        path = os.path.join(self.root, "data", task_key, subject)
+        if not os.path.isdir(path):
+            logger.info(f"Caching benchmark subject {subject} of {task_key} as Arrow")
+        return self._materialise(path, load)
+
+    @staticmethod
+    def prompt_key(identity: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+    def prompts(self, prompt_key: str, subject: str, build: Callable[[], Dict[str, list]]) -> Dataset:
+        """The subject's tokenized prompts (one row per question), built from ``build``'s columns on first use."""
+        path = os.path.join(self.root, "prompts", prompt_key, subject)
+        return self._materialise(path, lambda: Dataset.from_dict(build()))
+
+
+benchmark_cache = BenchmarkCache()
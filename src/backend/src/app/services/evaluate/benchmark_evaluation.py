@@ -1,36 +1,297 @@
 import asyncio
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import time
 import logging as logger
 import os
-import random
-from typing import Dict, Any
-from llamafactory.eval.evaluator import run_eval, Evaluator
-from app import EVAL_DIR
+from typing import Dict, Any, List, Optional, Tuple
+from datasets import load_dataset
+from app.config.evaluation_config import EvaluationConfig
+from app.services.evaluate.benchmark_cache import benchmark_cache
+from app.services.evaluate.benchmark_evaluator import (
+    BenchmarkEvaluator, load_categories, merge_units, prefill_stats, save_benchmark_results, scoring_report,
+    subject_result
+)
+from app.services.evaluate.result_store import benchmark_result_store
+from app.services.evaluate.sequential_evaluation import EARLY_STOP_KEYS, run_sequential_benchmark
+
+# Keys of a benchmark job that are ours, not LlamaFactory evaluation arguments
+RUNNER_KEYS = ("num_workers", "reuse_prefix", "force_refresh", "scoring", "sort_by_length",
+               "compare_baseline", "cache_prompts") + EARLY_STOP_KEYS
+# Runner keys passed on to BenchmarkEvaluator
+EVALUATOR_KEYS = ("reuse_prefix", "scoring", "sort_by_length", "compare_baseline", "cache_prompts")
+
+
+def _question_counts(params: Dict[str, Any], subjects: List[str]) -> Dict[str, int]:
+    """Number of evaluation questions per subject (datasets only, no model)."""
+    task, split = params["task"].split("_")[:2]
+    task_dir = params.get("task_dir", "evaluation")
+    task_key = benchmark_cache.task_key(task_dir, params["task"])
+    counts = {}
+    for subject in subjects:
+        dataset = benchmark_cache.subject(task_key, subject, lambda: load_dataset(
+            path=os.path.join(task_dir, task),
+            name=subject,
+            trust_remote_code=params.get("trust_remote_code", True),
+        ))
+        counts[subject] = len(dataset[split])
+    return counts
+
+
+def plan_shards(counts: Dict[str, int], num_workers: int) -> List[List[Dict[str, Any]]]:
+    """Split subjects into (subject, start, end) units and balance them over workers.
+
+    Subjects larger than an even share are cut into question ranges, so a task with
+    a single big subject still spreads over every worker; units are then assigned
+    largest first to the least loaded worker.
+    """
+    share = max(-(-sum(counts.values()) // num_workers), 1)
+    units = []
+    for subject, count in counts.items():
+        for start in range(0, count, share):
+            units.append({"subject": subject, "start": start, "end": min(start + share, count)})
+
+    shards: List[List[Dict[str, Any]]] = [[] for _ in range(num_workers)]
+    loads = [0] * num_workers
+    for unit in sorted(units, key=lambda u: u["end"] - u["start"], reverse=True):
+        worker = loads.index(min(loads))
+        shards[worker].append(unit)
+        loads[worker] += unit["end"] - unit["start"]
+    return [shard for shard in shards if shard]
+
+
+class BenchmarkSession:
+    """Model copies shared by the tasks of one benchmark job.
+
+    The serial evaluator, or the worker pool whose processes each load one model
+    copy, is created by the first task that needs evaluating and reused by the
+    following ones, which only switch task, n_shot and lang.
+    """
+
+    def __init__(self, num_workers: int, evaluator_kwargs: Optional[Dict[str, Any]] = None):
+        self.num_workers = num_workers
+        self.evaluator_kwargs = evaluator_kwargs or {}
+        self._evaluator: Optional[BenchmarkEvaluator] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def evaluator(self, args: Dict[str, Any]) -> BenchmarkEvaluator:
+        if self._evaluator is None:
+            self._evaluator = BenchmarkEvaluator(args, **self.evaluator_kwargs)
+        self._evaluator.set_task(args["task"], args.get("n_shot"), args.get("lang"))
+        return self._evaluator
+
+    def pool(self, args: Dict[str, Any]) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: CUDA cannot be re-initialised in a forked child
+            context = multiprocessing.get_context("spawn")
+            num_threads = max((os.cpu_count() or 1) // self.num_workers, 1)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.num_workers, mp_context=context, initializer=_init_worker,
+                initargs=(args, self.evaluator_kwargs, context.Value("i", 0), num_threads),
+            )
+        return self._pool
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self._evaluator = None
+
+
+# The model copy of a pool worker process, loaded once by _init_worker
+_worker_evaluator: Optional[BenchmarkEvaluator] = None
+
+
+def _init_worker(args: Dict[str, Any], evaluator_kwargs: Dict[str, Any], counter: Any, num_threads: int) -> None:
+    """Worker process: pick a device (or a share of the CPU threads) and load the model copy.
+
+    CUDA is already initialised by the time this runs (importing LlamaFactory probes
+    it), so ``CUDA_VISIBLE_DEVICES`` cannot pin the worker; the model is loaded onto
+    its device explicitly instead of with ``device_map="auto"``.
+    """
+    global _worker_evaluator
+    import torch
+
+    with counter.get_lock():
+        worker_index = counter.value
+        counter.value += 1
+    device = None
+    if torch.cuda.is_available() and torch.cuda.device_count() > 1:
+        device_index = worker_index % torch.cuda.device_count()
+        torch.cuda.set_device(device_index)
+        device = f"cuda:{device_index}"
+    elif num_threads:
+        torch.set_num_threads(num_threads)
+    _worker_evaluator = BenchmarkEvaluator(args, device=device, **evaluator_kwargs)
+
+
+def _evaluate_shard(args: Dict[str, Any], units: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Worker process: evaluate the assigned units of ``args``' task with the worker's model copy."""
+    _worker_evaluator.set_task(args["task"], args.get("n_shot"), args.get("lang"))
+    return [_worker_evaluator.eval_unit(unit["subject"], unit["start"], unit["end"]) for unit in units]
+
+
+def run_sharded_units(args: Dict[str, Any], subjects: List[str], num_workers: int,
+                      evaluator_kwargs: Optional[Dict[str, Any]] = None,
+                      session: Optional[BenchmarkSession] = None) -> Tuple[List[Dict[str, Any]], List[List[str]]]:
+    """
+    Evaluate subjects over a process pool.
+
+    Each worker loads its own model copy (safetensors shards are memory-mapped, so
+    the page cache holds the weights once); on CPU the cores are divided between the
+    workers, with several GPUs each worker gets its own device. Merged with
+    :func:`merge_units`, the units give the same results as a serial run.
+
+    Args:
+        args: LlamaFactory evaluation arguments (without ``save_dir``)
+        subjects: Subjects to evaluate
+        num_workers: Number of worker processes
+        evaluator_kwargs: :class:`BenchmarkEvaluator` options (``reuse_prefix``, ``scoring``, ...)
+        session: Pool to reuse across tasks; by default one is created for this call
+
+    Returns:
+        The evaluated units and the shard plan
+    """
+    owned = session is None
+    session = session or BenchmarkSession(num_workers, evaluator_kwargs)
+    shards = plan_shards(_question_counts(args, subjects), num_workers)
+    logger.info(f"Running benchmark {args['task']} on {len(shards)} worker processes "
+                f"({sum(len(shard) for shard in shards)} units)")
+    try:
+        pool = session.pool(args)
+        futures = [pool.submit(_evaluate_shard, args, shard) for shard in shards]
+        units = [unit for future in futures for unit in future.result()]
+    finally:
+        if owned:
+            session.close()
+    plan = [[f"{u['subject']}[{u['start']}:{u['end']}]" for u in shard] for shard in shards]
+    return units, plan
+
+
+def evaluate_subjects(args: Dict[str, Any], subjects: List[str], num_workers: int,
+                      evaluator_kwargs: Optional[Dict[str, Any]] = None,
+                      session: Optional[BenchmarkSession] = None) -> Tuple[Dict[str, Dict[str, Any]], Optional[List[List[str]]]]:
+    """Evaluate whole subjects, serially or sharded; returns one joined unit per subject and the shard plan."""
+    if not subjects:
+        return {}, None
+    plan = None
+    if num_workers > 1:
+        units, plan = run_sharded_units(args, subjects, num_workers, evaluator_kwargs, session)
+    else:
+        evaluator = session.evaluator(args) if session else BenchmarkEvaluator(args, **(evaluator_kwargs or {}))
+        units = [evaluator.eval_unit(subject) for subject in subjects]
+    by_subject: Dict[str, List[Dict[str, Any]]] = {}
+    for unit in units:
+        by_subject.setdefault(unit["subject"], []).append(unit)
+    return {subject: subject_result(parts) for subject, parts in by_subject.items()}, plan
+
+
+def _run_benchmark(params: Dict[str, Any], session: Optional[BenchmarkSession] = None) -> Dict[str, Any]:
+    """Evaluate the subjects missing from the result store, then merge and save all of them."""
+    num_workers = params.get("num_workers") or EvaluationConfig.BENCHMARK_WORKERS
+    evaluator_kwargs = {k: params[k] for k in EVALUATOR_KEYS if params.get(k) is not None}
+    save_dir = params.get("save_dir")
+    if save_dir is not None and os.path.exists(save_dir):
+        raise ValueError("`save_dir` already exists, use another one.")
+    # Workers never write save_dir, only the merged result does; unset options keep LlamaFactory defaults
+    args = {k: v for k, v in params.items() if k not in RUNNER_KEYS and k != "save_dir" and v is not None}
+
+    categorys = load_categories(args.get("task_dir", "evaluation"), args["task"])
+    if params.get("early_stop"):
+        # A sample is not a per-subject result, so the result store is bypassed
+        summary = run_sequential_benchmark(args, categorys, params, evaluator_kwargs, save_dir,
+                                           evaluator=session.evaluator(args) if session else None)
+        summary["cached"] = False
+        return summary
+
+    key = benchmark_result_store.make_key(args, bool(params.get("reuse_prefix")), params.get("scoring") or "letter")
+    cached = {} if params.get("force_refresh") else benchmark_result_store.get_many(key, list(categorys))
+    missing = [subject for subject in categorys if subject not in cached]
+    if cached:
+        logger.info(f"Reusing stored results for {len(cached)}/{len(categorys)} subjects of {args['task']}")
+
+    evaluated, plan = evaluate_subjects(args, missing, num_workers, evaluator_kwargs, session)
+    for subject, result in evaluated.items():
+        benchmark_result_store.put(key, subject, result)
+
+    units = list(cached.values()) + list(evaluated.values())
+    category_corrects, results = merge_units(categorys, units)
+    summary = save_benchmark_results(save_dir, category_corrects, results)
+    summary.update(prefill_stats(list(evaluated.values())))
+    summary.update({
+        "cached": not missing,
+        "cached_subjects": sorted(cached),
+        "evaluated_subjects": missing,
+        "result_key": key,
+    })
+    if evaluated:
+        summary["scoring"] = scoring_report(list(evaluated.values()), params.get("scoring") or "letter",
+                                            args.get("batch_size", 4))
+    if plan is not None:
+        summary["shards"] = plan
+    return summary
+
+
+def _run_benchmark_tasks(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run several benchmark tasks of one model back-to-back, loading the model once.
+
+    Each entry of ``params["tasks"]`` (``task`` plus optional ``n_shot``/``lang``)
+    overrides the job's settings; all tasks share one :class:`BenchmarkSession`, and
+    each keeps its own result-store key, ``save_dir`` subdirectory and timing.
+    """
+    save_dir = params.get("save_dir")
+    if save_dir is not None and os.path.exists(save_dir):
+        raise ValueError("`save_dir` already exists, use another one.")
+    base = {k: v for k, v in params.items() if k not in ("tasks", "save_dir")}
+    num_workers = params.get("num_workers") or EvaluationConfig.BENCHMARK_WORKERS
+    session = BenchmarkSession(num_workers, {k: params[k] for k in EVALUATOR_KEYS if params.get(k) is not None})
+
+    results = []
+    start = time.perf_counter()
+    try:
+        for spec in params["tasks"]:
+            task_params = {**base, **{k: v for k, v in spec.items() if v is not None}}
+            label = f"{task_params['task']}_{task_params.get('n_shot', 5)}shot_{task_params.get('lang', 'en')}"
+            if save_dir is not None:
+                task_params["save_dir"] = os.path.join(save_dir, label)
+            task_start = time.perf_counter()
+            summary = _run_benchmark(task_params, session)
+            results.append({"task": task_params["task"], "n_shot": task_params.get("n_shot"),
+                            "lang": task_params.get("lang"), "seconds": time.perf_counter() - task_start,
+                            **summary})
+            logger.info(f"Benchmark task {label} done in {results[-1]['seconds']:.1f}s")
+    finally:
+        session.close()
+    return {"tasks": results, "cached": all(result["cached"] for result in results),
+            "seconds": time.perf_counter() - start}
 
 
 async def simulate_benchmark(job_id: str, params: Dict[str, Any]):
     """
     Simulate a benchmark evaluation process.
-    
+
     Args:
         job_id: The unique identifier for this evaluation job
         params: Dictionary of parameters for the evaluation
-    
+
     Returns:
         Dictionary with evaluation results
     """
-    logger.info(f"Starting benchmark for model: {params.get('model_name_or_path')} on task: {params.get('task')}")
-    
     # Extract key parameters
     model_name = params.get('model_name_or_path')
-    task = params.get('task')
-    
-    obj_eval = Evaluator(params)
-    obj_eval.eval()
-    
+    task = params.get('task') or ", ".join(spec["task"] for spec in params.get("tasks") or [])
+    logger.info(f"Starting benchmark for model: {model_name} on task: {task}")
+
+    start = time.perf_counter()
+    metrics = await asyncio.to_thread(_run_benchmark_tasks if params.get("tasks") else _run_benchmark, params)
+    metrics["wall_time"] = time.perf_counter() - start
+
     # Return the benchmark results
     return {
         "status": "COMPLETED",
-        "message": f"Benchmark completed for {model_name} on {task}",
-    }
\ No newline at end of file
+        "message": f"Benchmark {'loaded from the result store' if metrics['cached'] else 'completed'} "
+                   f"for {model_name} on {task}",
+        "metrics": metrics,
+        "cached": metrics["cached"],
+    }
@@ -0,0 +1,421 @@
+import copy
+import json
+import logging
+import os
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from datasets import load_dataset
+from llamafactory.data import get_template_and_fix_tokenizer
+from llamafactory.eval.evaluator import Evaluator
+from llamafactory.eval.template import get_eval_template
+from llamafactory.extras.constants import CHOICES, SUBJECTS
+from llamafactory.hparams import get_eval_args
+from llamafactory.model import load_model, load_tokenizer
+from transformers.cache_utils import DynamicCache
+from transformers.utils import cached_file
+
+from app.services.evaluate.benchmark_cache import benchmark_cache, tokenizer_digest
+
+logger = logging.getLogger(__name__)
+
+SCORING_MODES = ("letter", "continuation")
+# How Evaluator.eval batches: dataset order, batch_size 4; the reference for compare_baseline
+BASELINE_BATCH_SIZE = 4
+
+
+def load_categories(task_dir: str, task: str, cache_dir: Optional[str] = None,
+                    token: Optional[str] = None) -> Dict[str, Dict[str, str]]:
+    """The task's ``mapping.json``: subject -> {"name", "category"}."""
+    mapping = cached_file(
+        path_or_repo_id=os.path.join(task_dir, task.split("_")[0]),
+        filename="mapping.json",
+        cache_dir=cache_dir,
+        token=token,
+    )
+    with open(mapping, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def support_seed(seed: int, subject: str, index: Optional[int] = None) -> int:
+    """Seed of the few-shot examples of one question (or of a whole subject), independent of evaluation order."""
+    key = subject if index is None else f"{subject}:{index}"
+    return (seed + zlib.crc32(key.encode("utf-8"))) % (2 ** 32)
+
+
+def common_prefix_length(sequences: List[List[int]]) -> int:
+    """Number of leading tokens shared by every sequence."""
+    first = sequences[0]
+    length = min(len(seq) for seq in sequences)
+    for seq in sequences[1:]:
+        length = next((i for i in range(length) if seq[i] != first[i]), length)
+    return length
+
+
+class BenchmarkEvaluator(Evaluator):
+    """LlamaFactory's MMLU-style evaluator split into (subject, question range) units.
+
+    Unlike ``Evaluator.eval``, whose few-shot examples depend on how many questions
+    were formatted before (global RNG), each question's support set is drawn with
+    :func:`support_seed`, so any split of the work over processes gives the same
+    predictions as a serial run.
+
+    With ``reuse_prefix`` every question of a subject gets the same few-shot
+    examples, so all prompts of a unit share one few-shot prefix: its KV cache is
+    computed once and each batch only prefills the question itself.
+
+    ``scoring="letter"`` compares the next-token logits of the choice letters (as
+    LlamaFactory does); ``"continuation"`` sums the log-likelihood of each choice's
+    full text after the prompt. Both score every question in a single forward pass
+    and batch length-sorted prompts, so padding stays small at large batch sizes.
+
+    Subjects are read from the Arrow :data:`benchmark_cache`; with ``cache_prompts``
+    the rendered, tokenized prompts of a subject are cached there too, so later runs
+    with the same tokenizer and settings skip prompt construction.
+
+    ``device`` places the whole model on one device instead of LlamaFactory's
+    ``device_map="auto"``, which would spread every copy over all visible GPUs.
+    """
+
+    def __init__(self, args: Dict[str, Any], reuse_prefix: bool = False, scoring: str = "letter",
+                 sort_by_length: bool = True, compare_baseline: bool = False, cache_prompts: bool = True,
+                 device: Optional[str] = None):
+        if scoring not in SCORING_MODES:
+            raise ValueError(f"Unsupported scoring {scoring!r}, expected one of {SCORING_MODES}")
+        if device is None:
+            super().__init__(args)
+        else:
+            # Evaluator.__init__, with get_eval_args' device_map="auto" replaced before the model loads
+            self.model_args, self.data_args, self.eval_args, finetuning_args = get_eval_args(args)
+            self.model_args.device_map = {"": device}
+            self.tokenizer = load_tokenizer(self.model_args)["tokenizer"]
+            self.tokenizer.padding_side = "right"
+            self.template = get_template_and_fix_tokenizer(self.tokenizer, self.data_args)
+            self.model = load_model(self.tokenizer, self.model_args, finetuning_args)
+            self.eval_template = get_eval_template(self.eval_args.lang)
+            self.choice_inputs = [self.tokenizer.encode(ch, add_special_tokens=False)[-1] for ch in CHOICES]
+        self.reuse_prefix = reuse_prefix
+        self.scoring = scoring
+        self.sort_by_length = sort_by_length
+        self.compare_baseline = compare_baseline
+        self.cache_prompts = cache_prompts
+        self.categorys = load_categories(self.eval_args.task_dir, self.eval_args.task,
+                                         self.model_args.cache_dir, self.model_args.hf_hub_token)
+        self._datasets: Dict[str, Any] = {}
+        self._prompts: Dict[str, Any] = {}
+        self._task_key: Optional[str] = None
+        self._prompt_key: Optional[str] = None
+
+    @property
+    def eval_split(self) -> str:
+        return self.eval_args.task.split("_")[1]
+
+    def set_task(self, task: str, n_shot: Optional[int] = None, lang: Optional[str] = None) -> None:
+        """Switch to another task (and n_shot/lang) keeping the loaded model."""
+        n_shot = self.eval_args.n_shot if n_shot is None else n_shot
+        lang = lang or self.eval_args.lang
+        if (task, n_shot, lang) == (self.eval_args.task, self.eval_args.n_shot, self.eval_args.lang):
+            return
+        self.eval_args.task, self.eval_args.n_shot, self.eval_args.lang = task, n_shot, lang
+        self.eval_template = get_eval_template(lang)
+        self.categorys = load_categories(self.eval_args.task_dir, task, self.model_args.cache_dir,
+                                         self.model_args.hf_hub_token)
+        self._datasets, self._prompts = {}, {}
+        self._task_key, self._prompt_key = None, None
+
+    @property
+    def task_key(self) -> str:
+        if self._task_key is None:
+            self._task_key = benchmark_cache.task_key(self.eval_args.task_dir, self.eval_args.task)
+        return self._task_key
+
+    @property
+    def prompt_key(self) -> str:
+        """Cache key of the rendered prompts: everything that changes their tokens."""
+        if self._prompt_key is None:
+            self._prompt_key = benchmark_cache.prompt_key({
+                "task": self.task_key,
+                "split": self.eval_split,
+                "tokenizer": tokenizer_digest(self.tokenizer),
+                "template": self.data_args.template,
+                "lang": self.eval_args.lang,
+                "n_shot": self.eval_args.n_shot,
+                "seed": self.eval_args.seed,
+                "reuse_prefix": self.reuse_prefix,
+            })
+        return self._prompt_key
+
+    def load_subject(self, subject: str) -> Any:
+        if subject not in self._datasets:
+            self._datasets[subject] = benchmark_cache.subject(self.task_key, subject, lambda: load_dataset(
+                path=os.path.join(self.eval_args.task_dir, self.eval_args.task.split("_")[0]),
+                name=subject,
+                cache_dir=self.model_args.cache_dir,
+                download_mode=self.eval_args.download_mode,
+                token=self.model_args.hf_hub_token,
+                trust_remote_code=self.model_args.trust_remote_code,
+            ))
+        return self._datasets[subject]
+
+    def subject_prompts(self, subject: str) -> Any:
+        """Memory-mapped ``input_ids``/``label``/``choices`` of every question of a subject."""
+        if subject not in self._prompts:
+            def build() -> Dict[str, list]:
+                rows = [self.render_question(subject, index)
+                        for index in range(len(self.load_subject(subject)[self.eval_split]))]
+                return {"input_ids": [row[0] for row in rows], "label": [row[1] for row in rows],
+                        "choices": [row[2] for row in rows]}
+
+            self._prompts[subject] = benchmark_cache.prompts(self.prompt_key, subject, build)
+        return self._prompts[subject]
+
+    def format_question(self, subject: str, index: int) -> Tuple[List[int], str, List[str]]:
+        """Prompt token ids, gold answer letter and choice texts of one question."""
+        if not self.cache_prompts:
+            return self.render_question(subject, index)
+        row = self.subject_prompts(subject)[index]
+        return row["input_ids"], row["label"], row["choices"]
+
+    def render_question(self, subject: str, index: int) -> Tuple[List[int], str, List[str]]:
+        """Render and tokenize one question with its few-shot examples (uncached)."""
+        dataset = self.load_subject(subject)
+        train = dataset["train"]
+        seed = support_seed(self.eval_args.seed, subject, None if self.reuse_prefix else index)
+        support_set = train.shuffle(seed=seed).select(
+            range(min(self.eval_args.n_shot, len(train)))
+        )
+        target_data = dataset[self.eval_split][index]
+        messages = self.eval_template.format_example(
+            target_data=target_data,
+            support_set=support_set,
+            subject_name=self.categorys[subject]["name"],
+        )
+        input_ids, _ = self.template.encode_oneturn(tokenizer=self.tokenizer, messages=messages)
+        return input_ids, messages[-1]["content"], [target_data[ch] for ch in CHOICES if ch in target_data]
+
+    def _batches(self, sequences: List[List[int]], batch_size: int, sort: bool) -> List[List[int]]:
+        """Index batches over ``sequences``; longest first when sorting, so each batch pads little."""
+        order = list(range(len(sequences)))
+        if sort:
+            order.sort(key=lambda i: len(sequences[i]), reverse=True)
+        return [order[i: i + batch_size] for i in range(0, len(order), batch_size)]
+
+    def _pad(self, sequences: List[List[int]]) -> Dict[str, torch.Tensor]:
+        batch = [{"input_ids": ids, "attention_mask": [1] * len(ids)} for ids in sequences]
+        return self.tokenizer.pad(batch, return_attention_mask=True, return_tensors="pt").to(self.model.device)
+
+    def predict(self, inputs: List[List[int]], batch_size: Optional[int] = None,
+                sort: Optional[bool] = None) -> List[str]:
+        outputs: List[Optional[str]] = [None] * len(inputs)
+        sort = self.sort_by_length if sort is None else sort
+        for indices in self._batches(inputs, batch_size or self.eval_args.batch_size, sort):
+            preds = self.batch_inference(self._pad([inputs[i] for i in indices]))
+            for i, pred in zip(indices, preds):
+                outputs[i] = pred
+        return outputs
+
+    @torch.inference_mode()
+    def predict_continuation(self, inputs: List[List[int]], choices: List[List[str]]) -> List[str]:
+        """Pick the choice whose text has the highest summed log-likelihood after the prompt.
+
+        Every (question, choice) pair is one sequence; the pairs are length-sorted
+        and scored in batches of ``batch_size`` sequences, one forward pass each.
+        """
+        pairs, sequences = [], []
+        for question, (input_ids, texts) in enumerate(zip(inputs, choices)):
+            for choice, text in enumerate(texts):
+                continuation = self.tokenizer.encode(text, add_special_tokens=False)
+                pairs.append((question, choice, len(continuation)))
+                sequences.append(input_ids + continuation)
+
+        scores = np.full((len(inputs), len(CHOICES)), -np.inf)
+        for indices in self._batches(sequences, self.eval_args.batch_size, self.sort_by_length):
+            logits = self.model(**self._pad([sequences[i] for i in indices])).logits
+            log_probs = torch.log_softmax(logits.float(), dim=-1)
+            for row, i in enumerate(indices):
+                question, choice, length = pairs[i]
+                end = len(sequences[i])
+                targets = torch.tensor(sequences[i][end - length:], device=log_probs.device)
+                # Logits at position t predict token t + 1
+                token_log_probs = log_probs[row, end - length - 1: end - 1].gather(-1, targets.unsqueeze(-1))
+                scores[question, choice] = token_log_probs.sum().item()
+        return [chr(ord("A") + int(np.argmax(row))) for row in scores]
+
+    def _choices(self, logits: torch.Tensor, lengths: torch.Tensor) -> List[str]:
+        """Same answer-letter selection as ``Evaluator.batch_inference``."""
+        word_probs = torch.stack([logits[i, lengths[i] - 1] for i in range(len(lengths))], dim=0)
+        choice_probs = torch.nn.functional.softmax(word_probs[:, self.choice_inputs], dim=-1).detach()
+        return [chr(ord("A") + offset.item()) for offset in torch.argmax(choice_probs, dim=-1)]
+
+    @torch.inference_mode()
+    def predict_with_prefix(self, inputs: List[List[int]]) -> Tuple[List[str], int]:
+        """Predict with the shared few-shot prefix prefilled once.
+
+        Returns:
+            The predictions and the number of prefill tokens that were skipped
+        """
+        # Keep at least one token per question after the prefix to read its logits from
+        prefix_length = min(common_prefix_length(inputs), min(len(ids) for ids in inputs) - 1)
+        if prefix_length <= 0:
+            return self.predict(inputs), 0
+
+        device = self.model.device
+        prefix_cache = self.model(
+            input_ids=torch.tensor([inputs[0][:prefix_length]], device=device),
+            past_key_values=DynamicCache(), use_cache=True,
+        ).past_key_values
+        outputs: List[Optional[str]] = [None] * len(inputs)
+        for indices in self._batches(inputs, self.eval_args.batch_size, self.sort_by_length):
+            batch_input = self._pad([inputs[i][prefix_length:] for i in indices])
+            cache = copy.deepcopy(prefix_cache)
+            cache.batch_repeat_interleave(len(indices))
+            prefix_mask = torch.ones(len(indices), prefix_length, dtype=batch_input["attention_mask"].dtype,
+                                     device=device)
+            logits = self.model(
+                input_ids=batch_input["input_ids"],
+                attention_mask=torch.cat([prefix_mask, batch_input["attention_mask"]], dim=-1),
+                past_key_values=cache, use_cache=True,
+            ).logits
+            preds = self._choices(logits, torch.sum(batch_input["attention_mask"], dim=-1))
+            for i, pred in zip(indices, preds):
+                outputs[i] = pred
+        return outputs, prefix_length * (len(inputs) - 1)
+
+    def eval_unit(self, subject: str, start: int = 0, end: Optional[int] = None) -> Dict[str, Any]:
+        """Predict questions ``[start, end)`` of a subject.
+
+        Returns:
+            Dict with ``subject``, ``start``, predicted ``outputs``, gold ``labels``,
+            ``prefill_tokens``, ``prefill_tokens_saved`` and scoring ``seconds`` (plus
+            ``baseline_outputs``/``baseline_seconds`` with ``compare_baseline``)
+        """
+        end = len(self.load_subject(subject)[self.eval_split]) if end is None else end
+        return {**self.eval_questions(subject, list(range(start, end))), "start": start}
+
+    def eval_questions(self, subject: str, indices: List[int]) -> Dict[str, Any]:
+        """Predict the given questions of a subject; same fields as :meth:`eval_unit` without ``start``."""
+        inputs, labels, choices = [], [], []
+        for index in indices:
+            input_ids, label, texts = self.format_question(subject, index)
+            inputs.append(input_ids)
+            labels.append(label)
+            choices.append(texts)
+
+        start_time = time.perf_counter()
+        saved = 0
+        if self.scoring == "continuation":
+            outputs = self.predict_continuation(inputs, choices)
+        elif self.reuse_prefix and len(inputs) > 1:
+            outputs, saved = self.predict_with_prefix(inputs)
+        else:
+            outputs = self.predict(inputs)
+        unit = {"subject": subject, "outputs": outputs, "labels": labels,
+                "prefill_tokens": sum(len(ids) for ids in inputs), "prefill_tokens_saved": saved,
+                "seconds": time.perf_counter() - start_time}
+        if self.compare_baseline:
+            start_time = time.perf_counter()
+            unit["baseline_outputs"] = self.predict(inputs, batch_size=BASELINE_BATCH_SIZE, sort=False)
+            unit["baseline_seconds"] = time.perf_counter() - start_time
+        return unit
+
+    def eval(self, subjects: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Serial run over all (or the given) subjects; saves like ``Evaluator.eval``."""
+        units = [self.eval_unit(subject) for subject in (subjects or list(self.categorys))]
+        category_corrects, results = merge_units(self.categorys, units)
+        summary = save_benchmark_results(self.eval_args.save_dir, category_corrects, results)
+        summary.update(prefill_stats(units))
+        return summary
+
+
+def merge_units(categorys: Dict[str, Dict[str, str]],
+                units: List[Dict[str, Any]]) -> Tuple[Dict[str, np.ndarray], Dict[str, Dict[str, str]]]:
+    """Combine unit results into LlamaFactory's per-category corrects and per-subject outputs."""
+    by_subject: Dict[str, List[Dict[str, Any]]] = {}
+    for unit in units:
+        by_subject.setdefault(unit["subject"], []).append(unit)
+
+    category_corrects = {subj: np.array([], dtype="bool") for subj in SUBJECTS}
+    results = {}
+    for subject in categorys:  # mapping order, as in a serial run
+        if subject not in by_subject:
+            continue
+        parts = sorted(by_subject[subject], key=lambda unit: unit["start"])
+        outputs = [output for unit in parts for output in unit["outputs"]]
+        labels = [label for unit in parts for label in unit["labels"]]
+        corrects = np.array(outputs) == np.array(labels)
+        category_name = categorys[subject]["category"]
+        category_corrects[category_name] = np.concatenate([category_corrects[category_name], corrects], axis=0)
+        category_corrects["Average"] = np.concatenate([category_corrects["Average"], corrects], axis=0)
+        results[subject] = {str(i): outputs[i] for i in range(len(outputs))}
+    return category_corrects, results
+
+
+def subject_result(units: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Join the units of one subject into a single unit covering all its questions."""
+    parts = sorted(units, key=lambda unit: unit["start"])
+    result = {
+        "subject": parts[0]["subject"],
+        "start": 0,
+        "outputs": [output for unit in parts for output in unit["outputs"]],
+        "labels": [label for unit in parts for label in unit["labels"]],
+        "prefill_tokens": sum(unit.get("prefill_tokens", 0) for unit in parts),
+        "prefill_tokens_saved": sum(unit.get("prefill_tokens_saved", 0) for unit in parts),
+        "seconds": sum(unit.get("seconds", 0.0) for unit in parts),
+    }
+    if all("baseline_outputs" in unit for unit in parts):
+        result["baseline_outputs"] = [output for unit in parts for output in unit["baseline_outputs"]]
+        result["baseline_seconds"] = sum(unit["baseline_seconds"] for unit in parts)
+    return result
+
+
+def prefill_stats(units: List[Dict[str, Any]]) -> Dict[str, Any]:
+    total = sum(unit.get("prefill_tokens", 0) for unit in units)
+    saved = sum(unit.get("prefill_tokens_saved", 0) for unit in units)
+    return {"prefill_tokens": total, "prefill_tokens_saved": saved,
+            "prefill_saved_ratio": saved / total if total else 0.0}
+
+
+def scoring_report(units: List[Dict[str, Any]], scoring: str, batch_size: int) -> Dict[str, Any]:
+    """Throughput of the scoring mode and, when measured, its agreement with the baseline scoring."""
+    outputs = [output for unit in units for output in unit["outputs"]]
+    labels = [label for unit in units for label in unit["labels"]]
+    seconds = sum(unit.get("seconds", 0.0) for unit in units)
+    report = {
+        "scoring": scoring,
+        "batch_size": batch_size,
+        "questions": len(outputs),
+        "questions_per_second": len(outputs) / seconds if seconds else None,
+        "accuracy": float(np.mean(np.array(outputs) == np.array(labels))) if outputs else None,
+    }
+    if units and all("baseline_outputs" in unit for unit in units):
+        baseline = [output for unit in units for output in unit["baseline_outputs"]]
+        baseline_seconds = sum(unit["baseline_seconds"] for unit in units)
+        report["baseline"] = {
+            "scoring": "letter",
+            "batch_size": BASELINE_BATCH_SIZE,
+            "questions_per_second": len(baseline) / baseline_seconds if baseline_seconds else None,
+            "accuracy": float(np.mean(np.array(baseline) == np.array(labels))),
+        }
+        report["agreement"] = float(np.mean(np.array(outputs) == np.array(baseline)))
+        if baseline_seconds and seconds:
+            report["speedup"] = baseline_seconds / seconds
+    return report
+
+
+def save_benchmark_results(save_dir: Optional[str], category_corrects: Dict[str, np.ndarray],
+                           results: Dict[str, Dict[str, str]]) -> Dict[str, Any]:
+    """Write ``results.json``/``results.log`` in ``Evaluator._save_results`` format and return the scores."""
+    scores = {name: 100 * float(np.mean(corrects)) for name, corrects in category_corrects.items() if len(corrects)}
+    score_info = "\n".join(f"{name:>15}: {score:.2f}" for name, score in scores.items())
+    logger.info(f"Benchmark scores:\n{score_info}")
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=False)
+        with open(os.path.join(save_dir, "results.json"), "w", encoding="utf-8", newline="\n") as f:
+            json.dump(results, f, indent=2)
+
+        with open(os.path.join(save_dir, "results.log"), "w", encoding="utf-8", newline="\n") as f:
+            f.write(score_info)
+    return {"scores": scores, "num_questions": int(len(category_corrects["Average"]))}
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import torch
+from llamafactory.data import get_dataset, get_template_and_fix_tokenizer
+from llamafactory.extras.constants import IGNORE_INDEX
+from llamafactory.hparams import get_train_args, read_args
+from llamafactory.model import load_model, load_tokenizer
+from transformers import (
+    LogitsProcessorList, RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper, TopKLogitsWarper,
+    TopPLogitsWarper
+)
+from transformers.cache_utils import DynamicCache
+
+from app.services.evaluate.prediction_stream import PredictionStream
+from app.services.evaluate.result_store import benchmark_result_store
+from app.services.inference.batching import left_pad
+from app.services.train.supervised_fine_tuning.supervised_fine_tuning import _run_training
+
+logger = logging.getLogger(__name__)
+
+
+def _left_pad_to(tensor: torch.Tensor, length: int, dim: int, value: int = 0) -> torch.Tensor:
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_full(shape, value), tensor], dim=dim)
+
+
+def _logits_processor(gen_kwargs: Dict[str, Any]) -> LogitsProcessorList:
+    """The subset of ``generate``'s processors LlamaFactory's generating arguments switch on."""
+    processors = LogitsProcessorList()
+    repetition_penalty = gen_kwargs.get("repetition_penalty") or 1.0
+    if repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+    if gen_kwargs.get("do_sample"):
+        temperature = gen_kwargs.get("temperature") or 1.0
+        if temperature != 1.0:
+            processors.append(TemperatureLogitsWarper(temperature))
+        if gen_kwargs.get("top_k"):
+            processors.append(TopKLogitsWarper(gen_kwargs["top_k"]))
+        top_p = gen_kwargs.get("top_p")
+        if top_p is not None and top_p < 1.0:
+            processors.append(TopPLogitsWarper(top_p))
+    return processors
+
+
+class RefillingGenerator:
+    """Generate for many prompts with ``batch_size`` decode slots that are refilled as rows finish.
+
+    Prompts are admitted longest first, so rows prefilled together need little
+    padding. A row that hits EOS or ``max_new_tokens`` leaves the batch at once
+    (its KV cache rows are dropped) and queued prompts take the free slots, so a
+    batch no longer decodes as long as its slowest member. :meth:`stream` yields
+    each response as its row finishes.
+    """
+
+    def __init__(self, model: Any, tokenizer: Any, batch_size: int, gen_kwargs: Dict[str, Any],
+                 refill_threshold: Optional[int] = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        # Prefill newcomers together once a quarter of the slots is free, not one by one
+        self.refill_threshold = refill_threshold or max(batch_size // 4, 1)
+        self.max_new_tokens = gen_kwargs.get("max_new_tokens") or 512
+        self.do_sample = bool(gen_kwargs.get("do_sample"))
+        eos = gen_kwargs.get("eos_token_id", tokenizer.eos_token_id)
+        self.eos_token_ids = set(eos if isinstance(eos, list) else [eos])
+        self.pad_token_id = tokenizer.pad_token_id
+        self.processors = _logits_processor(gen_kwargs)
+        self.stats: Dict[str, Any] = {}
+
+    def _forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, position_ids: torch.Tensor,
+                 cache: DynamicCache) -> torch.Tensor:
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                             past_key_values=cache, use_cache=True)
+        return outputs.logits[:, -1, :]
+
+    @staticmethod
+    def _merge(cache: DynamicCache, new_cache: DynamicCache) -> None:
+        """Append ``new_cache``'s rows to ``cache``, left-padding the shorter one along the sequence."""
+        length = max(cache.get_seq_length(), new_cache.get_seq_length())
+        for layer in range(len(cache.key_cache)):
+            cache.key_cache[layer] = torch.cat([_left_pad_to(cache.key_cache[layer], length, 2),
+                                                _left_pad_to(new_cache.key_cache[layer], length, 2)])
+            cache.value_cache[layer] = torch.cat([_left_pad_to(cache.value_cache[layer], length, 2),
+                                                  _left_pad_to(new_cache.value_cache[layer], length, 2)])
+
+    @staticmethod
+    def _trim(cache: DynamicCache, columns: int) -> None:
+        """Drop leading sequence positions that are padding for every remaining row."""
+        for layer in range(len(cache.key_cache)):
+            cache.key_cache[layer] = cache.key_cache[layer][:, :, columns:, :]
+            cache.value_cache[layer] = cache.value_cache[layer][:, :, columns:, :]
+
+    def generate(self, prompts: Sequence[List[int]]) -> Tuple[List[List[int]], Dict[str, Any]]:
+        """Generated token ids in the order of ``prompts``, and the decode statistics."""
+        outputs: List[Optional[List[int]]] = [None] * len(prompts)
+        for index, response_ids in self.stream(prompts):
+            outputs[index] = response_ids
+        return outputs, self.stats
+
+    @torch.inference_mode()
+    def stream(self, prompts: Sequence[List[int]], skip: Collection[int] = ()) -> Iterator[Tuple[int, List[int]]]:
+        """
+        Yield ``(index, response_ids)`` for every prompt not in ``skip``, in completion order.
+
+        ``prompts`` may be a lazy sequence; each prompt is read when measured and when
+        admitted. Afterwards ``stats`` holds ``decode_steps``, ``generated_tokens`` and
+        ``slot_utilization``.
+        """
+        device = self.model.device
+        queue = sorted((i for i in range(len(prompts)) if i not in skip), key=lambda i: len(prompts[i]), reverse=True)
+        rows: List[int] = []  # prompt index of each active row
+        generated: List[List[int]] = []
+        cache, input_ids, attention_mask, next_logits = None, None, None, None
+        steps, busy_slots, generated_tokens = 0, 0, 0
+
+        while queue or rows:
+            free = self.batch_size - len(rows)
+            if queue and (not rows or free >= self.refill_threshold):
+                admitted, queue = queue[:free], queue[free:]
+                batch = left_pad([prompts[i] for i in admitted], self.pad_token_id, device)
+                position_ids = (batch["attention_mask"].cumsum(-1) - 1).clamp(min=0)
+                new_cache = DynamicCache()
+                logits = self._forward(batch["input_ids"], batch["attention_mask"], position_ids, new_cache)
+                if rows:
+                    length = max(input_ids.shape[-1], batch["input_ids"].shape[-1])
+                    self._merge(cache, new_cache)
+                    input_ids = torch.cat([_left_pad_to(input_ids, length, 1, self.pad_token_id),
+                                           _left_pad_to(batch["input_ids"], length, 1, self.pad_token_id)])
+                    attention_mask = torch.cat([_left_pad_to(attention_mask, length, 1),
+                                                _left_pad_to(batch["attention_mask"], length, 1)])
+                    next_logits = torch.cat([next_logits, logits])
+                else:
+                    cache, input_ids, attention_mask, next_logits = (new_cache, batch["input_ids"],
+                                                                     batch["attention_mask"], logits)
+                rows += admitted
+                generated += [[] for _ in admitted]
+
+            scores = self.processors(input_ids, next_logits.float())
+            if self.do_sample:
+                tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                tokens = torch.argmax(scores, dim=-1)
+            steps += 1
+            busy_slots += len(rows)
+
+            finished = set()
+            for row, token_id in enumerate(tokens.tolist()):
+                generated[row].append(token_id)
+                if token_id in self.eos_token_ids or len(generated[row]) >= self.max_new_tokens:
+                    finished.add(row)
+            input_ids = torch.cat([input_ids, tokens[:, None]], dim=-1)
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones(len(rows), 1)], dim=-1)
+
+            if finished:
+                for row in sorted(finished):
+                    generated_tokens += len(generated[row])
+                    yield rows[row], generated[row]
+                keep = [row for row in range(len(rows)) if row not in finished]
+                rows = [rows[row] for row in keep]
+                generated = [generated[row] for row in keep]
+                if not rows:
+                    cache = None
+                    continue
+                index = torch.tensor(keep, device=device)
+                cache.batch_select_indices(index)
+                input_ids, attention_mask, tokens = input_ids[index], attention_mask[index], tokens[index]
+                padding = int((attention_mask.cumsum(-1) == 0).sum(-1).min())
+                if padding:
+                    self._trim(cache, padding)
+                    input_ids, attention_mask = input_ids[:, padding:], attention_mask[:, padding:]
+
+            position_ids = attention_mask.sum(-1, keepdim=True) - 1
+            next_logits = self._forward(tokens[:, None], attention_mask, position_ids, cache)
+
+        self.stats = {
+            "decode_steps": steps,
+            "generated_tokens": generated_tokens,
+            "slot_utilization": busy_slots / (steps * self.batch_size) if steps else 0.0,
+        }
+
+
+class _Column(Sequence):
+    """One column of a ``datasets.Dataset`` read row by row instead of materialised."""
+
+    def __init__(self, dataset: Any, column: str):
+        self.dataset = dataset
+        self.column = column
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: int) -> List[int]:
+        return self.dataset[index][self.column]
+
+
+def _fingerprint(model_args: Any, dataset: Any, gen_kwargs: Dict[str, Any], skip_special_tokens: bool) -> str:
+    """Digest of what decides the predictions of a dataset, so a resumed run only reuses its own."""
+    identity = {
+        "model": benchmark_result_store.model_digest(model_args.model_name_or_path),
+        "adapters": [benchmark_result_store.model_digest(path) for path in model_args.adapter_name_or_path or []],
+        # The fingerprint of the tokenized dataset covers data files, template, cutoff_len and max_samples
+        "dataset": getattr(dataset, "_fingerprint", None),
+        "samples": len(dataset),
+        "generation": gen_kwargs,
+        "skip_special_tokens": skip_special_tokens,
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _evaluate_dataset(generator: RefillingGenerator, tokenizer: Any, dataset: Any, path: str,
+                      skip_special_tokens: bool, resume: bool, fingerprint: Optional[str] = None) -> Dict[str, Any]:
+    """Stream one dataset's predictions to ``path`` and return its metrics."""
+    stream = PredictionStream(path, resume=resume, fingerprint=fingerprint)
+    start = time.perf_counter()
+    generated = 0
+    try:
+        for index, prediction in generator.stream(_Column(dataset, "input_ids"), skip=stream.done):
+            example = dataset[index]
+            label = [token for token in example["labels"] if token != IGNORE_INDEX]
+            record = {
+                "index": index,
+                "prompt": tokenizer.decode(example["input_ids"], skip_special_tokens=skip_special_tokens),
+                "predict": tokenizer.decode(prediction, skip_special_tokens=skip_special_tokens),
+                "label": tokenizer.decode(label, skip_special_tokens=skip_special_tokens),
+            }
+            # Metrics always compare the texts without special tokens, as ComputeSimilarity does
+            stream.add(record, tokenizer.decode(prediction, skip_special_tokens=True),
+                       tokenizer.decode(label, skip_special_tokens=True))
+            generated += 1
+        stream.finalize()
+    finally:
+        stream.close()
+    runtime = time.perf_counter() - start
+
+    stats = generator.stats if generated else {}
+    return {
+        **stream.metrics(),
+        "runtime": runtime,
+        "samples_per_second": generated / runtime if runtime else 0.0,
+        "tokens_per_second": stats.get("generated_tokens", 0) / runtime if runtime else 0.0,
+        "resumed_samples": stream.resumed,
+        **stats,
+    }
+
+
+def run_generation_evaluation(args: Dict[str, Any], resume: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    SFT evaluation with ``predict_with_generate``, decoded by :class:`RefillingGenerator`.
+
+    Replaces ``trainer.evaluate`` of LlamaFactory's SFT workflow: same dataset
+    preprocessing, generating arguments and ROUGE/BLEU metrics, with
+    ``per_device_eval_batch_size`` decode slots. Predictions are streamed through a
+    :class:`PredictionStream` (scored in worker processes, resumable) and end up in
+    ``generated_predictions.jsonl`` (``generated_predictions_<name>.jsonl`` per eval
+    dataset) in dataset order; metrics go to ``eval_results.json``.
+
+    Args:
+        args: LlamaFactory training arguments (``do_eval`` and ``predict_with_generate`` set)
+        resume: Continue from the predictions a crashed run already wrote to ``output_dir``
+
+    Returns:
+        The ``eval_``-prefixed metrics (None when it fell back to the trainer)
+    """
+    model_args, data_args, training_args, finetuning_args, generating_args = get_train_args(read_args(args))
+    tokenizer_module = load_tokenizer(model_args)
+    if tokenizer_module["processor"] is not None:
+        # Image/video/audio inputs go through the multimodal plugin, which only the trainer path applies
+        logger.info("Multimodal model, evaluating with the LlamaFactory trainer instead")
+        _run_training(args)
+        return None
+    tokenizer = tokenizer_module["tokenizer"]
+    template = get_template_and_fix_tokenizer(tokenizer, data_args)
+    dataset_module = get_dataset(template, model_args, data_args, training_args, stage="sft", **tokenizer_module)
+    model = load_model(tokenizer, model_args, finetuning_args, is_trainable=False)
+    model.eval()
+
+    gen_kwargs = generating_args.to_dict(obey_generation_config=True)
+    gen_kwargs["eos_token_id"] = [tokenizer.eos_token_id] + tokenizer.additional_special_tokens_ids
+    generator = RefillingGenerator(model, tokenizer, training_args.per_device_eval_batch_size, gen_kwargs)
+
+    eval_dataset = dataset_module["eval_dataset"]
+    datasets = eval_dataset if isinstance(eval_dataset, dict) else {None: eval_dataset}
+    metrics = {}
+    for name, dataset in datasets.items():
+        prefix = f"eval_{name}_" if name else "eval_"
+        path = os.path.join(training_args.output_dir,
+                            f"generated_predictions_{name}.jsonl" if name else "generated_predictions.jsonl")
+        fingerprint = _fingerprint(model_args, dataset, gen_kwargs, generating_args.skip_special_tokens)
+        dataset_metrics = _evaluate_dataset(generator, tokenizer, dataset, path,
+                                            generating_args.skip_special_tokens, resume, fingerprint)
+        metrics.update({f"{prefix}{key}": value for key, value in dataset_metrics.items()})
+        logger.info(f"Generation eval{' on ' + name if name else ''}: {len(dataset)} samples "
+                    f"({dataset_metrics['resumed_samples']} resumed) in {dataset_metrics['runtime']:.1f}s")
+
+    os.makedirs(training_args.output_dir, exist_ok=True)
+    with open(os.path.join(training_args.output_dir, "eval_results.json"), "w", encoding="utf-8") as f:
+        json.dump(metrics, f, indent=4, sort_keys=True)
+    return metrics
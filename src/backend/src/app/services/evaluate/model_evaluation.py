@@ -1,10 +1,12 @@
 import asyncio
+import functools
 import logging as logger
 import os
 import time
 import random
 from typing import Dict, Any, Optional
 from ..train.supervised_fine_tuning.supervised_fine_tuning import _prepare_training_arguments, _clean_training_args, run_training_job
+from .generation_evaluation import run_generation_evaluation
 
 # temporray, use the training style but adaption first.
 async def _run_evaluate(job_id: str, train_args: Dict[str, Any]):
@@ -13,6 +15,12 @@ async def _run_evaluate(job_id: str, train_args: Dict[str, Any]):
     # train_args["predict_with_generate"] = True
     # # train_args["predict_with_generate"] = False
 
+    # SFT generation eval decodes with refilled, length-sorted batches instead of trainer.evaluate
+    dynamic_batching = train_args.pop("dynamic_batching", True)
+    resume = train_args.pop("resume", True)
+    if dynamic_batching and train_args.get("predict_with_generate") and train_args.get("stage", "sft") == "sft":
+        runner = functools.partial(run_generation_evaluation, resume=resume)
+        return await run_training_job(job_id, train_args, runner=runner)
     return await run_training_job(job_id, train_args)
 
 
@@ -43,15 +51,18 @@ async def simulate_evaluation(job_id: str, params: Dict[str, Any]) -> Dict[str,
     logger.info(f"Datasets: {datasets}")
     
     # Simulate work with progress updates
-    await _run_evaluate(job_id, params)
+    result = await _run_evaluate(job_id, params)
  
     # Return results
-    return {
+    response = {
         "status": "COMPLETED",
         "message": f"Evaluation of {model_name} completed successfully",
         "job_id": job_id,
         "completion_time": time.time()
     }
+    if result.get("metrics"):
+        response["metrics"] = result["metrics"]
+    return response
 
 # For future implementation: real evaluation function
 async def evaluate_model(job_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
@@ -0,0 +1,172 @@
+import json
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import jieba
+from nltk.translate.bleu_score import SmoothingFunction, sentence_bleu
+from rouge_chinese import Rouge
+
+from app.config.evaluation_config import EvaluationConfig
+
+logger = logging.getLogger(__name__)
+
+METRIC_KEYS = ("rouge-1", "rouge-2", "rouge-l", "bleu-4")
+
+
+def score_pair(predict: str, label: str) -> Dict[str, float]:
+    """ROUGE/BLEU of one prediction, computed like LlamaFactory's ``ComputeSimilarity``."""
+    hypothesis = list(jieba.cut(predict))
+    reference = list(jieba.cut(label))
+    if len(" ".join(hypothesis).split()) == 0 or len(" ".join(reference).split()) == 0:
+        result = {"rouge-1": {"f": 0.0}, "rouge-2": {"f": 0.0}, "rouge-l": {"f": 0.0}}
+    else:
+        result = Rouge().get_scores(" ".join(hypothesis), " ".join(reference))[0]
+    scores = {key: round(value["f"] * 100, 4) for key, value in result.items()}
+    bleu = sentence_bleu([list(label)], list(predict), smoothing_function=SmoothingFunction().method3)
+    scores["bleu-4"] = round(bleu * 100, 4)
+    return scores
+
+
+def _score_chunk(chunk: List[Tuple[Dict[str, Any], str, str]]) -> List[Dict[str, Any]]:
+    """Metric worker: attach ``scores`` to each record from its (predict, label) texts."""
+    return [{**record, "scores": score_pair(predict, label)} for record, predict, label in chunk]
+
+
+class PredictionStream:
+    """Scored predictions appended to a JSONL file as they are produced, resumable after a crash.
+
+    Records are scored in chunks on a process pool and written (with their
+    ``index`` and ``scores``) as soon as their chunk is done; only the in-flight
+    chunks are held in memory. Metric sums are kept as running totals.
+
+    On open, the complete lines of an earlier run's ``<path>.partial`` are kept (a
+    torn last line is cut off), counted, and their indices reported in ``done``
+    so the caller skips them. The partial file is only trusted when its
+    ``<path>.partial.meta`` sidecar holds the same ``fingerprint`` (a digest of the
+    model, adapter, dataset and generation arguments); otherwise it is discarded.
+    :meth:`finalize` writes ``path`` in dataset order from the recorded line offsets
+    and removes the partial file.
+    """
+
+    def __init__(self, path: str, resume: bool = True, fingerprint: Optional[str] = None,
+                 num_workers: int = EvaluationConfig.METRIC_WORKERS,
+                 chunk_size: int = EvaluationConfig.METRIC_CHUNK_SIZE):
+        self.path = path
+        self.partial_path = f"{path}.partial"
+        self.meta_path = f"{self.partial_path}.meta"
+        self.chunk_size = chunk_size
+        self.offsets: Dict[int, int] = {}
+        self.sums = dict.fromkeys(METRIC_KEYS, 0.0)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if resume and self._read_fingerprint() != fingerprint and os.path.exists(self.partial_path):
+            logger.warning(f"Discarding {self.partial_path}: written for other model, data or generation arguments")
+            resume = False
+        if resume:
+            self._load()
+        elif os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint}, f)
+        self.resumed = len(self.offsets)
+        if self.resumed:
+            logger.info(f"Resuming {path}: {self.resumed} predictions already written")
+
+        self._file = open(self.partial_path, "ab")
+        self._buffer: List[Tuple[Dict[str, Any], str, str]] = []
+        self._pending: Deque[Future] = deque()
+        self._max_pending = 2 * max(num_workers, 1)
+        # spawn: the parent holds a CUDA context that must not leak into forked children
+        self._pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")) \
+            if num_workers > 0 else None
+
+    def _read_fingerprint(self) -> Optional[str]:
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                return json.load(f).get("fingerprint")
+        except (OSError, ValueError):
+            return None
+
+    def _load(self) -> None:
+        if not os.path.isfile(self.partial_path):
+            return
+        valid = 0
+        with open(self.partial_path, "rb") as f:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    self._count(json.loads(line), offset)
+                except (ValueError, KeyError):
+                    break
+                valid = f.tell()
+        with open(self.partial_path, "r+b") as f:
+            f.truncate(valid)
+
+    def _count(self, record: Dict[str, Any], offset: int) -> None:
+        scores = record["scores"]
+        for key in METRIC_KEYS:
+            self.sums[key] += scores[key]
+        self.offsets[record["index"]] = offset
+
+    @property
+    def done(self) -> Set[int]:
+        return set(self.offsets)
+
+    def add(self, record: Dict[str, Any], predict: str, label: str) -> None:
+        """Queue a record (with ``index``) and the texts its metrics are computed on."""
+        self._buffer.append((record, predict, label))
+        if len(self._buffer) >= self.chunk_size:
+            self._submit()
+
+    def _submit(self) -> None:
+        if not self._buffer:
+            return
+        chunk, self._buffer = self._buffer, []
+        if self._pool is None:
+            self._write(_score_chunk(chunk))
+            return
+        self._pending.append(self._pool.submit(_score_chunk, chunk))
+        self._drain(self._max_pending)
+
+    def _drain(self, limit: int) -> None:
+        """Write finished chunks in submission order, waiting while more than ``limit`` are in flight."""
+        while self._pending and (len(self._pending) > limit or self._pending[0].done()):
+            self._write(self._pending.popleft().result())
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        for record in records:
+            offset = self._file.tell()
+            self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            self._count(record, offset)
+        self._file.flush()
+
+    def metrics(self) -> Dict[str, float]:
+        count = len(self.offsets)
+        return {key: total / count if count else 0.0 for key, total in self.sums.items()}
+
+    def close(self) -> None:
+        """Score and write everything queued, then release the file and the pool (idempotent)."""
+        if self._file.closed:
+            return
+        try:
+            self._submit()
+            self._drain(0)
+        finally:
+            self._file.close()
+            if self._pool is not None:
+                self._pool.shutdown()
+
+    def finalize(self) -> None:
+        self.close()
+        with open(self.partial_path, "rb") as src, open(self.path, "wb") as dst:
+            for index in sorted(self.offsets):
+                src.seek(self.offsets[index])
+                dst.write(src.readline())
+        os.remove(self.partial_path)
+        os.remove(self.meta_path)
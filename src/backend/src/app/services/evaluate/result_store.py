@@ -0,0 +1,130 @@
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.config.evaluation_config import EvaluationConfig
+
+logger = logging.getLogger(__name__)
+
+# Bump when a change to the evaluator alters predictions, so older results are not reused
+EVALUATOR_VERSION = 1
+# Files of a model or adapter directory that decide its predictions: weights, configs and
+# tokenizer. Trainer state saved with checkpoints (optimizer.pt, scheduler.pt, rng_state*.pth,
+# trainer_state.json, training_args.bin) is left out, so it is never hashed
+MODEL_FILE_PATTERNS = ("*.safetensors", "*.bin", "*.json", "*.model", "*.tiktoken", "*.txt", "*.py")
+TRAINER_STATE_FILES = ("trainer_state.json", "training_args.bin")
+
+
+class BenchmarkResultStore:
+    """Per-subject benchmark results keyed by a content hash of everything that decides them.
+
+    The key covers the model and adapter weights, the task data, template, n_shot,
+    lang, seed, few-shot mode and scoring mode. File digests are memoised by (path, size, mtime),
+    so unchanged multi-GB checkpoints are only hashed once.
+    """
+
+    def __init__(self, root: str = EvaluationConfig.RESULT_STORE_DIR):
+        self.root = root
+        self._digest_index_path = os.path.join(root, "file_digests.json")
+        self._digests: Optional[Dict[str, str]] = None
+        self._lock = Lock()
+
+    def _file_digest(self, path: str) -> str:
+        stat = os.stat(path)
+        memo_key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        with self._lock:
+            if self._digests is None:
+                self._digests = self._read_json(self._digest_index_path) or {}
+            if memo_key in self._digests:
+                return self._digests[memo_key]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self._lock:
+            self._digests[memo_key] = digest.hexdigest()
+            self._write_json(self._digest_index_path, self._digests)
+        return self._digests[memo_key]
+
+    def tree_digest(self, path: Optional[str], patterns: Optional[Sequence[str]] = None,
+                    exclude: Sequence[str] = ()) -> Optional[str]:
+        """Digest of every file under a local directory (or one file); hub ids hash as their name.
+
+        With ``patterns`` only matching file names are hashed; names in ``exclude`` never are.
+        """
+        if not path:
+            return None
+        if not os.path.exists(path):
+            return f"hub:{path}"
+        files = [path] if os.path.isfile(path) else sorted(
+            os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+            if name not in exclude and (patterns is None or any(fnmatch.fnmatch(name, p) for p in patterns))
+        )
+        digest = hashlib.sha256()
+        for file in files:
+            digest.update(os.path.relpath(file, path).encode("utf-8"))
+            digest.update(self._file_digest(file).encode("utf-8"))
+        return digest.hexdigest()
+
+    def model_digest(self, path: Optional[str]) -> Optional[str]:
+        """Digest of the weight, config and tokenizer files of a model or adapter (checkpoint) directory."""
+        return self.tree_digest(path, MODEL_FILE_PATTERNS, exclude=TRAINER_STATE_FILES)
+
+    def make_key(self, params: Dict[str, Any], reuse_prefix: bool = False, scoring: str = "letter") -> str:
+        task = params["task"]
+        identity = {
+            "version": EVALUATOR_VERSION,
+            "model": self.model_digest(params["model_name_or_path"]),
+            "adapter": self.model_digest(params.get("adapter_name_or_path")),
+            "finetuning_type": params.get("finetuning_type"),
+            "task": task,
+            "data": self.tree_digest(os.path.join(params.get("task_dir", "evaluation"), task.split("_")[0])),
+            "template": params.get("template"),
+            "n_shot": params.get("n_shot"),
+            "lang": params.get("lang"),
+            "seed": params.get("seed"),
+            "reuse_prefix": reuse_prefix,
+            "scoring": scoring,
+        }
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, key: str, subject: str) -> str:
+        return os.path.join(self.root, key, f"{subject}.json")
+
+    def get(self, key: str, subject: str) -> Optional[Dict[str, Any]]:
+        return self._read_json(self._path(key, subject))
+
+    def get_many(self, key: str, subjects: List[str]) -> Dict[str, Dict[str, Any]]:
+        found = {subject: self.get(key, subject) for subject in subjects}
+        return {subject: result for subject, result in found.items() if result is not None}
+
+    def put(self, key: str, subject: str, result: Dict[str, Any]) -> None:
+        os.makedirs(os.path.join(self.root, key), exist_ok=True)
+        self._write_json(self._path(key, subject), result)
+
+    @staticmethod
+    def _read_json(path: str) -> Optional[Dict[str, Any]]:
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable benchmark result {path}: {str(e)}")
+            return None
+
+    @staticmethod
+    def _write_json(path: str, data: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+benchmark_result_store = BenchmarkResultStore()
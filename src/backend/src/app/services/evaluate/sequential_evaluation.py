@@ -0,0 +1,203 @@
+import json
+import logging
+import math
+import os
+import random
+import time
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.evaluate.benchmark_evaluator import BenchmarkEvaluator
+from app.services.evaluate.result_store import benchmark_result_store
+
+logger = logging.getLogger(__name__)
+
+# Keys of a benchmark job that configure the early-stopping mode
+EARLY_STOP_KEYS = ("early_stop", "early_stop_threshold", "early_stop_baseline", "early_stop_ci_width",
+                   "early_stop_confidence", "early_stop_chunk", "early_stop_min_items")
+
+
+def stratified_order(counts: Dict[str, int], seed: int) -> List[Tuple[str, int]]:
+    """Every (subject, index) in random order, interleaved so each prefix is stratified by subject.
+
+    Questions of a subject are shuffled and the j-th one gets the key
+    ``(j + offset) / count``; sorting all keys keeps every subject's count in any
+    prefix within ``max(1, subjects - 1)`` questions of its proportional share.
+    """
+    rng = random.Random(seed)
+    keyed = []
+    for subject, count in counts.items():
+        order = list(range(count))
+        rng.shuffle(order)
+        offset = rng.random()
+        keyed += [((j + offset) / count, subject, index) for j, index in enumerate(order)]
+    keyed.sort()
+    return [(subject, index) for _, subject, index in keyed]
+
+
+class StratifiedEstimate:
+    """Running stratified accuracy (in %) with a normal-approximation confidence interval.
+
+    Subjects are strata weighted by their size, so the estimate targets the
+    question-averaged ``Average`` score of a full run. A stratum's variance uses the
+    smoothed rate ``(k + 1) / (n + 2)``, so early all-right or all-wrong strata do
+    not give a zero-width interval, and a finite population correction, so a fully
+    evaluated stratum adds none. Strata not sampled yet count with the pooled rate
+    and maximal variance.
+
+    The interval is checked after every chunk, and stopping at the first check that
+    clears the boundary would inflate the error rate far above ``1 - confidence``.
+    With ``looks`` planned checks the error budget is Bonferroni-split over them, so
+    the interval holds at ``confidence`` simultaneously across all of them.
+    """
+
+    def __init__(self, counts: Dict[str, int], confidence: float = 0.95, looks: int = 1):
+        self.counts = {subject: count for subject, count in counts.items() if count}
+        self.total = sum(self.counts.values())
+        self.confidence = confidence
+        self.looks = max(looks, 1)
+        self.z = NormalDist().inv_cdf(1 - (1 - confidence) / (2 * self.looks))
+        self.correct = dict.fromkeys(self.counts, 0)
+        self.seen = dict.fromkeys(self.counts, 0)
+
+    def update(self, subject: str, correct: bool) -> None:
+        self.seen[subject] += 1
+        self.correct[subject] += int(correct)
+
+    @property
+    def used(self) -> int:
+        return sum(self.seen.values())
+
+    def interval(self) -> Tuple[float, float, float]:
+        """Estimate, lower and upper bound, in percent."""
+        used = self.used
+        pooled = sum(self.correct.values()) / used if used else 0.5
+        estimate, variance = 0.0, 0.0
+        for subject, population in self.counts.items():
+            weight = population / self.total
+            n = self.seen[subject]
+            if n == 0:
+                estimate += weight * pooled
+                variance += weight ** 2 * 0.25
+                continue
+            smoothed = (self.correct[subject] + 1) / (n + 2)
+            correction = (population - n) / (population - 1) if population > 1 else 0.0
+            estimate += weight * self.correct[subject] / n
+            variance += weight ** 2 * smoothed * (1 - smoothed) / n * correction
+        half_width = self.z * variance ** 0.5
+        return 100 * estimate, 100 * max(estimate - half_width, 0.0), 100 * min(estimate + half_width, 1.0)
+
+
+def baseline_accuracy(result_key: str, subjects: List[str]) -> float:
+    """Question-averaged accuracy (in %) of a stored full run, the decision boundary against a baseline."""
+    stored = benchmark_result_store.get_many(result_key, subjects)
+    missing = [subject for subject in subjects if subject not in stored]
+    if missing:
+        raise ValueError(f"Baseline {result_key} has no stored results for {len(missing)} subjects, e.g. {missing[0]}")
+    correct = sum(output == label for result in stored.values()
+                  for output, label in zip(result["outputs"], result["labels"]))
+    total = sum(len(result["labels"]) for result in stored.values())
+    return 100 * correct / total if total else 0.0
+
+
+def run_sequential_benchmark(args: Dict[str, Any], categorys: Dict[str, Dict[str, str]], params: Dict[str, Any],
+                             evaluator_kwargs: Optional[Dict[str, Any]] = None,
+                             save_dir: Optional[str] = None,
+                             evaluator: Optional[BenchmarkEvaluator] = None) -> Dict[str, Any]:
+    """
+    Evaluate a benchmark on a stratified random sample that grows until the answer is clear.
+
+    Questions are scored in chunks of ``early_stop_chunk`` (one batched pass per chunk,
+    across subjects) in :func:`stratified_order`. After ``early_stop_min_items``, the
+    run stops as soon as the confidence interval lies entirely above or below the
+    decision boundary (``early_stop_threshold``, or the accuracy of the stored run
+    ``early_stop_baseline``), or is narrower than ``early_stop_ci_width`` points.
+    The interval is widened for the number of planned checks (see
+    :class:`StratifiedEstimate`), so the decision keeps its stated confidence.
+
+    Args:
+        args: LlamaFactory evaluation arguments (without ``save_dir``)
+        categorys: The task's subject mapping
+        params: The benchmark job, read for the ``early_stop_*`` settings
+        evaluator_kwargs: :class:`BenchmarkEvaluator` options
+        save_dir: Where to write the sampled predictions and the report
+        evaluator: An already loaded evaluator set to the task (multi-task jobs)
+
+    Returns:
+        Summary with the ``scores`` estimate and an ``early_stop`` report (interval,
+        decision, stop reason, items used versus total)
+    """
+    boundary = params.get("early_stop_threshold")
+    if params.get("early_stop_baseline"):
+        boundary = baseline_accuracy(params["early_stop_baseline"], list(categorys))
+    target_width = params.get("early_stop_ci_width")
+    if boundary is None and target_width is None:
+        raise ValueError("early_stop needs early_stop_threshold, early_stop_baseline or early_stop_ci_width")
+    chunk_size = params.get("early_stop_chunk") or 256
+    min_items = params.get("early_stop_min_items") or 100
+
+    # The prefix shared per subject does not apply to chunks mixing subjects
+    if evaluator is None:
+        evaluator = BenchmarkEvaluator(args, **{**(evaluator_kwargs or {}), "reuse_prefix": False})
+    counts = {subject: len(evaluator.load_subject(subject)[evaluator.eval_split]) for subject in categorys}
+    order = stratified_order(counts, args.get("seed", 42))
+    # Every chunk after min_items is a look at the interval
+    looks = math.ceil(len(order) / chunk_size) - max(math.ceil(min_items / chunk_size) - 1, 0)
+    estimate = StratifiedEstimate(counts, params.get("early_stop_confidence") or 0.95, looks)
+
+    start_time = time.perf_counter()
+    predictions: Dict[str, Dict[str, str]] = {}
+    reason, decision = "exhausted", None
+    for start in range(0, len(order), chunk_size):
+        chunk = order[start: start + chunk_size]
+        questions = [evaluator.format_question(subject, index) for subject, index in chunk]
+        inputs = [input_ids for input_ids, _, _ in questions]
+        if evaluator.scoring == "continuation":
+            outputs = evaluator.predict_continuation(inputs, [texts for _, _, texts in questions])
+        else:
+            outputs = evaluator.predict(inputs)
+        for (subject, index), (_, label, _), output in zip(chunk, questions, outputs):
+            estimate.update(subject, output == label)
+            predictions.setdefault(subject, {})[str(index)] = output
+
+        if estimate.used < min_items:
+            continue
+        value, low, high = estimate.interval()
+        if boundary is not None and (low > boundary or high < boundary):
+            reason, decision = "decided", "above" if low > boundary else "below"
+            break
+        if target_width is not None and high - low <= target_width:
+            reason = "ci_width"
+            break
+
+    value, low, high = estimate.interval()
+    if decision is None and boundary is not None:
+        decision = "above" if low > boundary else "below" if high < boundary else "undecided"
+    report = {
+        "estimate": value,
+        "ci_low": low,
+        "ci_high": high,
+        "confidence": estimate.confidence,
+        # Simultaneous over all planned looks (Bonferroni), so valid under the early stop
+        "looks_planned": estimate.looks,
+        "z": estimate.z,
+        "boundary": boundary,
+        "decision": decision,
+        "stopped": reason,
+        "items_used": estimate.used,
+        "items_total": estimate.total,
+        "fraction_used": estimate.used / estimate.total if estimate.total else 0.0,
+        "seconds": time.perf_counter() - start_time,
+        "per_subject": {subject: {"used": estimate.seen[subject], "total": count}
+                        for subject, count in estimate.counts.items()},
+    }
+    logger.info(f"Early-stopped benchmark {args['task']}: {value:.2f} [{low:.2f}, {high:.2f}] after "
+                f"{estimate.used}/{estimate.total} questions ({reason})")
+
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=False)
+        with open(os.path.join(save_dir, "results.json"), "w", encoding="utf-8", newline="\n") as f:
+            json.dump(predictions, f, indent=2)
+        with open(os.path.join(save_dir, "early_stop.json"), "w", encoding="utf-8", newline="\n") as f:
+            json.dump(report, f, indent=2)
+    return {"scores": {"Average": value}, "num_questions": estimate.used, "early_stop": report}
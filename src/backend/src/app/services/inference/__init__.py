@@ -0,0 +1 @@
+# Inference service module initialization
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from app.config.inference_config import InferenceConfig
+
+logger = logging.getLogger(__name__)
+
+# Lanes in priority order: a free slot always goes to the first non-empty lane
+LANES = ("interactive", "bulk")
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status and Retry-After hint."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """A granted generation slot. ``release`` is idempotent so every exit path can call it."""
+
+    def __init__(self, admission: "ModelAdmission", wait_time: float):
+        self.admission = admission
+        self.wait_time = wait_time
+        self._start = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.admission.release(time.monotonic() - self._start)
+
+
+class ModelAdmission:
+    """Concurrency limit with bounded, prioritised wait queues for a single model."""
+
+    def __init__(self, max_concurrent: int, queue_limits: Dict[str, int]):
+        self.max_concurrent = max_concurrent
+        self.queue_limits = queue_limits
+        self.active = 0
+        self.queues: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self.service_time = 1.0  # EWMA of how long a slot is held, for Retry-After estimates
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def queued(self, lane: Optional[str] = None) -> int:
+        lanes = [lane] if lane else LANES
+        return sum(sum(1 for fut in self.queues[name] if not fut.done()) for name in lanes)
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.service_time * (self.queued() + 1) / self.max_concurrent))
+
+    def _wake(self) -> None:
+        while self.active < self.max_concurrent:
+            for lane in LANES:
+                queue = self.queues[lane]
+                while queue and queue[0].done():
+                    queue.popleft()  # cancelled or timed-out waiters
+                if queue:
+                    self.active += 1
+                    queue.popleft().set_result(True)
+                    break
+            else:
+                return
+
+    def _reject(self, status_code: int, detail: str) -> AdmissionRejected:
+        self.rejected += 1
+        return AdmissionRejected(status_code, detail, self.retry_after())
+
+    async def acquire(self, lane: str, max_wait: Optional[float], bounded: bool) -> AdmissionTicket:
+        if self.active < self.max_concurrent and self.queued() == 0:
+            self.active += 1
+            return self._granted(0.0)
+
+        queue = self.queues[lane]
+        if bounded and self.queued(lane) >= self.queue_limits[lane]:
+            raise self._reject(429, f"Too many queued {lane} requests for this model")
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        start = time.monotonic()
+        try:
+            await asyncio.wait({waiter}, timeout=max_wait)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(0.0)
+            waiter.cancel()
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            raise self._reject(503, f"Timed out after {max_wait:.0f}s waiting for a free generation slot")
+        return self._granted(time.monotonic() - start)
+
+    def _granted(self, wait_time: float) -> AdmissionTicket:
+        self.admitted += 1
+        self.total_wait += wait_time
+        self.max_wait = max(self.max_wait, wait_time)
+        return AdmissionTicket(self, wait_time)
+
+    def release(self, hold_time: float) -> None:
+        self.active -= 1
+        if hold_time > 0:
+            self.service_time = 0.8 * self.service_time + 0.2 * hold_time
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queued": {lane: self.queued(lane) for lane in LANES},
+            "queue_limits": self.queue_limits,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class AdmissionController:
+    """Per-model admission control so overload turns into fast 429/503s instead of slow requests.
+
+    On the huggingface backend an admitted request may still wait on the engine's
+    semaphore (LlamaFactory's ``MAX_CONCURRENT``), so there the limit counts requests
+    in flight rather than parallel generations.
+    """
+
+    def __init__(self, max_concurrent: int = InferenceConfig.ADMISSION_MAX_CONCURRENT,
+                 queue_limits: Optional[Dict[str, int]] = None,
+                 max_wait: float = InferenceConfig.ADMISSION_MAX_WAIT):
+        self.max_concurrent = max_concurrent
+        self.queue_limits = queue_limits or {
+            "interactive": InferenceConfig.ADMISSION_INTERACTIVE_QUEUE,
+            "bulk": InferenceConfig.ADMISSION_BULK_QUEUE,
+        }
+        self.max_wait = max_wait
+        self._models: Dict[str, ModelAdmission] = {}
+
+    def _admission(self, model_key: str, capacity_factor: float = 1.0) -> ModelAdmission:
+        if model_key not in self._models:
+            max_concurrent = max(1, int(self.max_concurrent * capacity_factor))
+            self._models[model_key] = ModelAdmission(max_concurrent, self.queue_limits)
+        return self._models[model_key]
+
+    async def admit(self, model_key: str, lane: str = "interactive", bounded: bool = True,
+                    capacity_factor: float = 1.0) -> AdmissionTicket:
+        """Wait for a generation slot on ``model_key``.
+
+        Args:
+            model_key: Pool key of the model the request runs on
+            lane: ``interactive`` or ``bulk``; interactive waiters are always served first
+            bounded: When False (background jobs) the request waits without queue or time limits
+            capacity_factor: Scales the model's concurrency limit when it is first seen
+                (e.g. models with a quantized KV cache fit more sequences)
+
+        Returns:
+            The granted ticket; call ``release()`` when generation finishes
+
+        Raises:
+            AdmissionRejected: 429 when the lane's queue is full, 503 when the wait times out
+        """
+        if lane not in LANES:
+            raise ValueError(f"Unknown admission lane: {lane}")
+        admission = self._admission(model_key, capacity_factor)
+        return await admission.acquire(lane, self.max_wait if bounded else None, bounded)
+
+    def stats(self) -> Dict[str, Any]:
+        return {key: admission.stats() for key, admission in self._models.items()}
+
+
+admission_controller = AdmissionController()
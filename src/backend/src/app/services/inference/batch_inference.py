@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config.inference_config import InferenceConfig
+from app.services.inference.batching import encode_prompt, generate_batch
+from app.services.inference.admission import admission_controller
+from app.services.inference.kv_cache import admission_capacity_factor
+from app.services.inference.model_pool import model_pool
+
+logger = logging.getLogger(__name__)
+
+
+def _record_messages(record: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Accept either ``{"messages": [...]}`` or ``{"input": "..."}`` records."""
+    if "messages" in record:
+        return record["messages"]
+    if "input" in record:
+        return [{"role": "user", "content": record["input"]}]
+    raise ValueError("Each batch record needs a 'messages' list or an 'input' string")
+
+
+def _read_records(input_path: str) -> List[Dict[str, Any]]:
+    records = []
+    with open(input_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _fingerprint(input_digest: str, model_args: Dict[str, Any], generation_kwargs: Dict[str, Any],
+                 order: List[int]) -> str:
+    """Digest of what decides the output rows and their order, so a resumed job only continues its own."""
+    identity = {
+        "input": input_digest,
+        "model": {k: v for k, v in model_args.items() if v is not None},
+        "generation": generation_kwargs,
+        "order": order,
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _load_checkpoint(checkpoint_path: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("fingerprint") != fingerprint:
+        logger.warning(f"Ignoring checkpoint {checkpoint_path}: written for a different input, model, "
+                       f"generation settings or prompt order; restarting")
+        return None
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint_path: str, checkpoint: Dict[str, Any]) -> None:
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+async def run_batch_inference(job_id: str, params: Dict[str, Any],
+                              on_progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Run offline chat inference over a JSONL file through the pooled model.
+
+    Prompts are sorted by token length so each batch pads as little as possible,
+    results are appended to ``output_path`` as JSONL (with the original ``index``)
+    and a checkpoint next to it records how far the run got, so a restarted job
+    with the same input, model, generation settings and output resumes where it
+    stopped (anything else starts over).
+
+    Args:
+        job_id: Unique identifier for the batch job
+        params: Model arguments, ``input_path``, ``output_path``, ``batch_size``,
+            ``checkpoint_interval``, ``resume`` and ``generation_kwargs``
+        on_progress: Called with ``(completed, total)`` after each batch
+
+    Returns:
+        Dictionary with the job status and output information
+    """
+    input_path = params["input_path"]
+    output_path = params["output_path"]
+    batch_size = params.get("batch_size") or InferenceConfig.BATCH_SIZE
+    checkpoint_interval = params.get("checkpoint_interval") or InferenceConfig.BATCH_CHECKPOINT_INTERVAL
+    generation_kwargs = params.get("generation_kwargs") or {}
+    checkpoint_path = f"{output_path}.ckpt.json"
+
+    records = _read_records(input_path)
+    total = len(records)
+    input_digest = _file_digest(input_path)
+    chat_model = await model_pool.acquire(params["model_args"])
+    model_key = model_pool.make_key(params["model_args"])
+
+    lengths = await asyncio.to_thread(
+        lambda: [len(encode_prompt(chat_model, _record_messages(record))) for record in records]
+    )
+    order = sorted(range(total), key=lambda i: lengths[i])
+    fingerprint = _fingerprint(input_digest, params["model_args"], generation_kwargs, order)
+
+    checkpoint = _load_checkpoint(checkpoint_path, fingerprint) if params.get("resume", True) else None
+    completed = 0
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    if checkpoint:
+        completed = checkpoint["completed"]
+        # Drop anything written after the last checkpoint; it will be regenerated
+        with open(output_path, "a+b") as f:
+            f.truncate(checkpoint["offset"])
+        logger.info(f"Batch job {job_id} resuming at {completed}/{total}")
+    else:
+        open(output_path, "w").close()
+
+    start = time.perf_counter()
+    generated_tokens = 0
+    batches_since_checkpoint = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        for batch_start in range(completed, total, batch_size):
+            indices = order[batch_start:batch_start + batch_size]
+            # Bulk lane: interactive chat traffic on the same model is always served first
+            ticket = await admission_controller.admit(
+                model_key, lane="bulk", bounded=False,
+                capacity_factor=admission_capacity_factor(params["model_args"]))
+            try:
+                results = await generate_batch(
+                    chat_model, [_record_messages(records[i]) for i in indices], **generation_kwargs
+                )
+            finally:
+                ticket.release()
+            for index, result in zip(indices, results):
+                row = {"index": index, **result}
+                if "id" in records[index]:
+                    row["id"] = records[index]["id"]
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                generated_tokens += result["completion_tokens"]
+
+            completed = batch_start + len(indices)
+            batches_since_checkpoint += 1
+            if batches_since_checkpoint >= checkpoint_interval or completed == total:
+                out.flush()
+                os.fsync(out.fileno())
+                _save_checkpoint(checkpoint_path, {
+                    "fingerprint": fingerprint, "completed": completed, "offset": out.tell(),
+                })
+                batches_since_checkpoint = 0
+            if on_progress:
+                on_progress(completed, total)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "status": "COMPLETED",
+        "message": f"Batch inference completed for {total} prompts",
+        "output_path": output_path,
+        "metrics": {
+            "prompts": total,
+            "elapsed_seconds": elapsed,
+            "generated_tokens": generated_tokens,
+            "tokens_per_second": generated_tokens / elapsed if elapsed > 0 else 0.0,
+        },
+    }
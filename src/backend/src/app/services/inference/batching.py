@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from fastapi import Request
+from llamafactory.chat.chat_model import ChatModel
+from llamafactory.chat.hf_engine import HuggingfaceEngine
+from transformers import StoppingCriteriaList
+from transformers.cache_utils import DynamicCache
+
+from app.services.inference.streaming import ControlStoppingCriteria, GenerationControl, watch_disconnect
+
+
+logger = logging.getLogger(__name__)
+
+
+def encode_prompt(chat_model: ChatModel, messages: List[Dict[str, str]], system: Optional[str] = None,
+                  tools: Optional[str] = None) -> List[int]:
+    """Render ``messages`` with the model's template and return the prompt token ids."""
+    engine = chat_model.engine
+    paired_messages = messages + [{"role": "assistant", "content": ""}]
+    prompt_ids, _ = engine.template.encode_oneturn(engine.tokenizer, paired_messages, system, tools)
+    return prompt_ids
+
+
+def left_pad(sequences: List[List[int]], pad_token_id: int, device: Any) -> Dict[str, torch.Tensor]:
+    """Left-pad token id lists into ``input_ids``/``attention_mask`` tensors for decoder-only generation."""
+    max_len = max(len(seq) for seq in sequences)
+    input_ids = [[pad_token_id] * (max_len - len(seq)) + seq for seq in sequences]
+    attention_mask = [[0] * (max_len - len(seq)) + [1] * len(seq) for seq in sequences]
+    return {
+        "input_ids": torch.tensor(input_ids, dtype=torch.long, device=device),
+        "attention_mask": torch.tensor(attention_mask, dtype=torch.long, device=device),
+    }
+
+
+def truncate_at_stop(text: str, stop: Optional[List[str]]) -> Tuple[str, bool]:
+    """Cut ``text`` before the earliest stop string; the flag tells whether one was found."""
+    cut = min((i for i in (text.find(s) for s in stop or []) if i >= 0), default=-1)
+    return (text[:cut], True) if cut >= 0 else (text, False)
+
+
+def _shared_prefill(model: Any, inputs: Dict[str, torch.Tensor], repeats: int) -> Dict[str, Any]:
+    """Run the prompt prefill once per prompt and repeat its KV cache for every sample.
+
+    ``generate`` with ``num_return_sequences`` would copy each prompt ``repeats`` times
+    before the prefill; here all but the last prompt token are prefilled once, the
+    cache is repeated along the batch and ``generate`` only decodes from there.
+    """
+    input_ids, attention_mask = inputs["input_ids"], inputs["attention_mask"]
+    position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+    past_key_values = DynamicCache()
+    with torch.inference_mode():
+        model(input_ids=input_ids[:, :-1], attention_mask=attention_mask[:, :-1],
+              position_ids=position_ids[:, :-1], past_key_values=past_key_values, use_cache=True)
+    past_key_values.batch_repeat_interleave(repeats)
+    return {
+        "input_ids": input_ids.repeat_interleave(repeats, dim=0),
+        "attention_mask": attention_mask.repeat_interleave(repeats, dim=0),
+        "past_key_values": past_key_values,
+    }
+
+
+def hf_generate_batch(engine: HuggingfaceEngine, batch_messages: List[List[Dict[str, str]]],
+                      input_kwargs: Dict[str, Any], control: Optional[GenerationControl] = None) -> List[Dict[str, Any]]:
+    model, tokenizer = engine.model, engine.tokenizer
+    input_kwargs = dict(input_kwargs)
+    system = input_kwargs.pop("system", None)
+    stop = input_kwargs.pop("stop", None)
+    stop = [stop] if isinstance(stop, str) else stop
+    # Reuse the engine's argument handling so sampling defaults match single requests
+    gen_kwargs, _ = HuggingfaceEngine._process_args(
+        model, tokenizer, engine.processor, engine.template, engine.generating_args,
+        list(batch_messages[0]), system=system, input_kwargs=input_kwargs,
+    )
+    generation_config = gen_kwargs["generation_config"]
+    prompts = [
+        engine.template.encode_oneturn(tokenizer, messages + [{"role": "assistant", "content": ""}], system)[0]
+        for messages in batch_messages
+    ]
+    inputs = left_pad(prompts, tokenizer.pad_token_id, model.device)
+    prompt_width = inputs["input_ids"].shape[-1]
+    generate_kwargs: Dict[str, Any] = {}
+    if stop:
+        # The engine ignores ``stop``; stop strings end each row early and are cut below
+        generation_config.stop_strings = stop
+        generate_kwargs["tokenizer"] = tokenizer
+    if control is not None:
+        # Stops every row on cancel or deadline; unfinished rows report the stop reason
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList([ControlStoppingCriteria(control, prompt_width)])
+        control.prompt_tokens = max(len(prompt) for prompt in prompts)
+        control.generate_started = time.perf_counter()
+
+    num_return_sequences = getattr(generation_config, "num_return_sequences", 1) or 1
+    kv_cache_factory = getattr(engine, "kv_cache_factory", None)
+    if kv_cache_factory is not None:
+        # A quantized cache is what lets larger batches fit in memory
+        inputs["past_key_values"] = kv_cache_factory()
+    elif num_return_sequences > 1 and prompt_width > 1:
+        inputs = _shared_prefill(model, inputs, num_return_sequences)
+        generation_config.num_return_sequences = 1
+
+    with torch.inference_mode():
+        output = model.generate(**inputs, generation_config=generation_config, **generate_kwargs)
+
+    stop_ids = set(engine.template.get_stop_token_ids(tokenizer))
+    results = []
+    for row, response_ids in enumerate(output[:, prompt_width:].tolist()):
+        length = len(response_ids)
+        finish_reason = "length"
+        for i, token_id in enumerate(response_ids):
+            if token_id in stop_ids:
+                length, finish_reason = i, "stop"
+                break
+        response = tokenizer.decode(
+            response_ids[:length],
+            skip_special_tokens=getattr(generation_config, "skip_special_tokens", True),
+            clean_up_tokenization_spaces=True,
+        )
+        response, stopped = truncate_at_stop(response, stop)
+        if stopped:
+            finish_reason = "stop"
+            length = len(tokenizer.encode(response, add_special_tokens=False))
+        elif finish_reason == "length" and control is not None and control.stop_reason:
+            finish_reason = control.stop_reason
+        results.append({
+            "response": response,
+            "prompt_tokens": len(prompts[row // num_return_sequences]),
+            "completion_tokens": length,
+            "finish_reason": finish_reason,
+        })
+    return results
+
+
+async def generate_batch(chat_model: ChatModel, batch_messages: List[List[Dict[str, str]]],
+                         control: Optional[GenerationControl] = None, request: Optional[Request] = None,
+                         **input_kwargs) -> List[Dict[str, Any]]:
+    """Generate one response per conversation in a single batched call.
+
+    Dispatches to the engine adapter (:mod:`app.services.inference.engines`): the
+    huggingface engine runs one padded ``generate`` call, vllm/sglang schedule their
+    own continuous batches, so the requests are simply submitted concurrently.
+
+    Args:
+        chat_model: The pooled chat model
+        batch_messages: One message list per prompt
+        control: Cancellation state (deadline, cancel); a stopped batch returns what was
+            generated so far with the stop reason as ``finish_reason``
+        request: The incoming HTTP request, watched for client disconnects (needs ``control``)
+        **input_kwargs: Generation overrides forwarded to the engine, plus ``system``,
+            ``stop`` and ``num_return_sequences`` (samples per prompt, which share
+            one prompt prefill on the huggingface engine)
+
+    Returns:
+        One dict per generated sequence (prompt-major) with ``response``, ``prompt_tokens``,
+        ``completion_tokens`` and ``finish_reason``
+    """
+    if not batch_messages:
+        return []
+
+    from app.services.inference.engines import engine_adapter
+
+    watcher = asyncio.create_task(watch_disconnect(request, control)) \
+        if request is not None and control is not None else None
+    try:
+        return await engine_adapter(chat_model).generate_batch(chat_model, batch_messages, control=control,
+                                                               **input_kwargs)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
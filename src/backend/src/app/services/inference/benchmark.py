@@ -0,0 +1,341 @@
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+from app.services.inference.batching import encode_prompt
+from app.services.inference.kv_cache import kv_bytes_per_token, sequence_perplexity
+from app.services.inference.lora_serving import base_model_args
+from app.services.inference.model_loader import load_chat_model
+from app.services.inference.speculative import DraftStats, check_draft_compatible
+from app.util.util import torch_gc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT = "Explain in a few sentences why the sky is blue."
+
+# Small built-in prompt set for accuracy/speed comparisons between serving variants
+DEFAULT_PROMPT_SET = [
+    DEFAULT_PROMPT,
+    "What is the capital of France?",
+    "Write a Python function that returns the factorial of n.",
+    "Summarize the plot of Romeo and Juliet in two sentences.",
+    "List three advantages of unit testing.",
+    "Translate 'Good morning, how are you?' into German.",
+]
+
+
+def decode_throughput(model: Any, input_ids: torch.Tensor, max_new_tokens: int = 64,
+                      runs: int = 3, **generate_kwargs) -> Dict[str, Any]:
+    """Time greedy decoding of exactly ``max_new_tokens`` tokens after one warm-up run.
+
+    Returns:
+        Dict with ``tokens_per_second`` (best of ``runs``), ``seconds`` per run and the
+        generated ``output_ids`` of the last run
+    """
+    kwargs = {
+        "do_sample": False,
+        "max_new_tokens": max_new_tokens,
+        "min_new_tokens": max_new_tokens,
+        **generate_kwargs,
+    }
+    attention_mask = torch.ones_like(input_ids)
+    with torch.inference_mode():
+        model.generate(input_ids=input_ids, attention_mask=attention_mask, **kwargs)  # warm-up
+        seconds: List[float] = []
+        output = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            output = model.generate(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+            seconds.append(time.perf_counter() - start)
+
+    generated = output.shape[-1] - input_ids.shape[-1]
+    return {
+        "tokens_per_second": generated / min(seconds),
+        "seconds": seconds,
+        "output_ids": output[0, input_ids.shape[-1]:].tolist(),
+    }
+
+
+def benchmark_lora_merge(model_args: Dict[str, Any], prompt: Optional[str] = None,
+                         max_new_tokens: int = 64, runs: int = 3) -> Dict[str, Any]:
+    """Compare decode throughput of a LoRA adapter served unmerged (PEFT) vs merged.
+
+    Loads the base model once, injects the adapter unmerged, times greedy decoding,
+    merges it in place and times it again. Greedy outputs of both runs should match.
+
+    Args:
+        model_args: Inference arguments with ``adapter_name_or_path`` set
+        prompt: User message to decode from
+        max_new_tokens: Tokens decoded per run
+        runs: Timed runs per variant
+
+    Returns:
+        Throughput of both variants, the speedup of merging and whether outputs match
+    """
+    from peft import PeftModel
+
+    if not model_args.get("adapter_name_or_path"):
+        raise ValueError("benchmark_lora_merge needs adapter_name_or_path")
+
+    chat_model, load_stats = load_chat_model({**base_model_args(model_args), "infer_backend": "huggingface"},
+                                             writable=True)
+    try:
+        model = chat_model.engine.model
+        prompt_ids = encode_prompt(chat_model, [{"role": "user", "content": prompt or DEFAULT_PROMPT}])
+        input_ids = torch.tensor([prompt_ids], dtype=torch.long, device=model.device)
+
+        peft_model = PeftModel.from_pretrained(model, model_args["adapter_name_or_path"])
+        peft_model.eval()
+        unmerged = decode_throughput(model, input_ids, max_new_tokens, runs)
+
+        start = time.perf_counter()
+        peft_model.merge_adapter()
+        merge_time = time.perf_counter() - start
+        merged = decode_throughput(model, input_ids, max_new_tokens, runs)
+
+        result = {
+            "device": str(model.device),
+            "dtype": str(model.dtype),
+            "prompt_tokens": len(prompt_ids),
+            "max_new_tokens": max_new_tokens,
+            "runs": runs,
+            "load_time": load_stats["load_time"],
+            "merge_time": merge_time,
+            "unmerged_tokens_per_second": unmerged["tokens_per_second"],
+            "merged_tokens_per_second": merged["tokens_per_second"],
+            "speedup": merged["tokens_per_second"] / unmerged["tokens_per_second"],
+            "outputs_match": merged["output_ids"] == unmerged["output_ids"],
+        }
+        logger.info(
+            f"LoRA merge benchmark on {result['device']}: unmerged {result['unmerged_tokens_per_second']:.1f} tok/s, "
+            f"merged {result['merged_tokens_per_second']:.1f} tok/s ({result['speedup']:.2f}x)"
+        )
+        return result
+    finally:
+        del chat_model
+        torch_gc()
+
+
+def benchmark_speculative(model_args: Dict[str, Any], draft_model_name_or_path: str, prompt: Optional[str] = None,
+                          max_new_tokens: int = 64, runs: int = 3) -> Dict[str, Any]:
+    """Compare greedy decode throughput of normal vs draft-then-verify (speculative) decoding.
+
+    Args:
+        model_args: Inference arguments of the target model
+        draft_model_name_or_path: Small model sharing the target's tokenizer
+        prompt: User message to decode from
+        max_new_tokens: Tokens decoded per run
+        runs: Timed runs per variant
+
+    Returns:
+        Throughput of both variants, the speedup, the draft acceptance rate and
+        whether the outputs are identical
+    """
+    args = {**model_args, "infer_backend": "huggingface"}
+    chat_model, _ = load_chat_model(args)
+    draft_model, _ = load_chat_model({"model_name_or_path": draft_model_name_or_path,
+                                      "template": args.get("template"), "infer_backend": "huggingface"})
+    try:
+        check_draft_compatible(chat_model, draft_model)
+        model, draft = chat_model.engine.model, draft_model.engine.model
+        prompt_ids = encode_prompt(chat_model, [{"role": "user", "content": prompt or DEFAULT_PROMPT}])
+        input_ids = torch.tensor([prompt_ids], dtype=torch.long, device=model.device)
+
+        baseline = decode_throughput(model, input_ids, max_new_tokens, runs)
+        draft_stats = DraftStats().attach(model, draft)
+        try:
+            speculative = decode_throughput(model, input_ids, max_new_tokens, runs, assistant_model=draft)
+        finally:
+            draft_stats.detach()
+
+        # decode_throughput runs one warm-up plus ``runs`` timed generate calls
+        result = {
+            "device": str(model.device),
+            "prompt_tokens": len(prompt_ids),
+            "max_new_tokens": max_new_tokens,
+            "runs": runs,
+            "baseline_tokens_per_second": baseline["tokens_per_second"],
+            "speculative_tokens_per_second": speculative["tokens_per_second"],
+            "speedup": speculative["tokens_per_second"] / baseline["tokens_per_second"],
+            "outputs_match": speculative["output_ids"] == baseline["output_ids"],
+            **draft_stats.report(max_new_tokens * (runs + 1)),
+        }
+        logger.info(
+            f"Speculative decoding benchmark on {result['device']}: {result['speedup']:.2f}x, "
+            f"acceptance rate {result['acceptance_rate']:.2f}, outputs match: {result['outputs_match']}"
+        )
+        return result
+    finally:
+        del chat_model, draft_model
+        torch_gc()
+
+
+def read_reference_text(path: str) -> str:
+    """Reference text from a plain text file, a JSONL file or an alpaca-style JSON list."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            records = [json.loads(line) for line in f if line.strip()]
+        elif path.endswith(".json"):
+            records = json.load(f)
+        else:
+            return f.read()
+    fields = ("text", "instruction", "input", "output")
+    return "\n\n".join(
+        "\n".join(str(record[k]) for k in fields if record.get(k)) if isinstance(record, dict) else str(record)
+        for record in records
+    )
+
+
+def benchmark_kv_cache(model_args: Dict[str, Any], reference_path: str, kv_cache: str = "int8",
+                       chunk_size: int = 64, max_tokens: int = 2048) -> Dict[str, Any]:
+    """Perplexity delta and memory per token of a quantized KV cache vs the full-precision one.
+
+    The reference text is fed in chunks of ``chunk_size`` tokens so every chunk after
+    the first attends to cached (and, beyond the residual window, quantized) keys and values.
+
+    Args:
+        model_args: Inference arguments of the model
+        reference_path: Text, JSONL or JSON file with the reference set
+        kv_cache: Quantized cache type to evaluate
+        chunk_size: Tokens per forward pass
+        max_tokens: Reference tokens evaluated
+
+    Returns:
+        Perplexities, their delta, and analytic and measured bytes per cached token
+    """
+    chat_model, _ = load_chat_model({**model_args, "infer_backend": "huggingface"})
+    try:
+        model, tokenizer = chat_model.engine.model, chat_model.engine.tokenizer
+        token_ids = tokenizer(read_reference_text(reference_path), add_special_tokens=True)["input_ids"][:max_tokens]
+        input_ids = torch.tensor([token_ids], dtype=torch.long, device=model.device)
+
+        start = time.perf_counter()
+        baseline_ppl, _ = sequence_perplexity(model, input_ids, chunk_size)
+        baseline_time = time.perf_counter() - start
+        start = time.perf_counter()
+        quantized_ppl, cache_bytes = sequence_perplexity(model, input_ids, chunk_size, kv_cache)
+        quantized_time = time.perf_counter() - start
+
+        baseline_bytes = kv_bytes_per_token(model.config, model.dtype)
+        quantized_bytes = kv_bytes_per_token(model.config, model.dtype, kv_cache)
+        # The cache holds every token but the last one, which is only ever a target
+        cached_tokens = max(input_ids.shape[-1] - 1, 1)
+        result = {
+            "kv_cache": kv_cache,
+            "dtype": str(model.dtype),
+            "tokens": input_ids.shape[-1],
+            "chunk_size": chunk_size,
+            "baseline_perplexity": baseline_ppl,
+            "quantized_perplexity": quantized_ppl,
+            "perplexity_delta": quantized_ppl - baseline_ppl,
+            "baseline_bytes_per_token": baseline_bytes,
+            "quantized_bytes_per_token": quantized_bytes,
+            "measured_bytes_per_token": cache_bytes / cached_tokens if cache_bytes is not None else None,
+            "compression": baseline_bytes / quantized_bytes,
+            "baseline_seconds": baseline_time,
+            "quantized_seconds": quantized_time,
+        }
+        logger.info(
+            f"{kv_cache} KV cache benchmark: perplexity {baseline_ppl:.3f} -> {quantized_ppl:.3f}, "
+            f"{baseline_bytes} -> {quantized_bytes} bytes/token"
+        )
+        return result
+    finally:
+        del chat_model
+        torch_gc()
+
+
+def _greedy_outputs(chat_model: Any, prompts: List[str], max_new_tokens: int) -> Tuple[List[List[int]], float]:
+    model = chat_model.engine.model
+    outputs, seconds, tokens = [], 0.0, 0
+    with torch.inference_mode():
+        for prompt in prompts:
+            prompt_ids = encode_prompt(chat_model, [{"role": "user", "content": prompt}])
+            input_ids = torch.tensor([prompt_ids], dtype=torch.long, device=model.device)
+            start = time.perf_counter()
+            output = model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                    do_sample=False, max_new_tokens=max_new_tokens)
+            seconds += time.perf_counter() - start
+            outputs.append(output[0, input_ids.shape[-1]:].tolist())
+            tokens += len(outputs[-1])
+    return outputs, tokens / seconds if seconds else 0.0
+
+
+def _teacher_forced_agreement(chat_model: Any, prompts: List[str], references: List[List[int]]) -> float:
+    """Share of reference tokens that are also the model's top-1 prediction given the same prefix."""
+    model = chat_model.engine.model
+    matches, total = 0, 0
+    with torch.inference_mode():
+        for prompt, reference in zip(prompts, references):
+            if not reference:
+                continue
+            prompt_ids = encode_prompt(chat_model, [{"role": "user", "content": prompt}])
+            input_ids = torch.tensor([prompt_ids + reference], dtype=torch.long, device=model.device)
+            logits = model(input_ids=input_ids).logits[0, len(prompt_ids) - 1:-1]
+            predicted = logits.argmax(dim=-1).tolist()
+            matches += sum(p == r for p, r in zip(predicted, reference))
+            total += len(reference)
+    return matches / total if total else 0.0
+
+
+def benchmark_quantized(model_args: Dict[str, Any], quantize: str = "int8", prompts: Optional[List[str]] = None,
+                        max_new_tokens: int = 32) -> Dict[str, Any]:
+    """Compare the dynamically quantized serving tier against bf16 on a small prompt set.
+
+    Accuracy is measured against the bf16 greedy outputs: the share of prompts with an
+    identical completion, and the teacher-forced top-1 agreement of the quantized model
+    on the bf16 completions (robust to a single early divergence).
+
+    Args:
+        model_args: Inference arguments of the model
+        quantize: Quantization mode to evaluate
+        prompts: Prompt set, defaults to ``DEFAULT_PROMPT_SET``
+        max_new_tokens: Tokens decoded per prompt
+
+    Returns:
+        Throughput and model size of both variants, speedup and agreement figures
+    """
+    from app.services.inference.quantization import model_nbytes
+
+    prompts = prompts or DEFAULT_PROMPT_SET
+    args = {**model_args, "infer_backend": "huggingface"}
+
+    reference_model, _ = load_chat_model({**args, "infer_dtype": "bfloat16"})
+    try:
+        reference_outputs, reference_tps = _greedy_outputs(reference_model, prompts, max_new_tokens)
+        reference_bytes = model_nbytes(reference_model.engine.model)
+    finally:
+        del reference_model
+        torch_gc()
+
+    quantized_model, load_stats = load_chat_model({**args, "quantize": quantize})
+    try:
+        quantized_outputs, quantized_tps = _greedy_outputs(quantized_model, prompts, max_new_tokens)
+        agreement = _teacher_forced_agreement(quantized_model, prompts, reference_outputs)
+        quantized_bytes = model_nbytes(quantized_model.engine.model)
+    finally:
+        del quantized_model
+        torch_gc()
+
+    result = {
+        "quantize": quantize,
+        "prompts": len(prompts),
+        "max_new_tokens": max_new_tokens,
+        "bf16_tokens_per_second": reference_tps,
+        "quantized_tokens_per_second": quantized_tps,
+        "speedup": quantized_tps / reference_tps if reference_tps else None,
+        "bf16_model_bytes": reference_bytes,
+        "quantized_model_bytes": quantized_bytes,
+        "exact_match_rate": sum(a == b for a, b in zip(quantized_outputs, reference_outputs)) / len(prompts),
+        "top1_agreement": agreement,
+        "quantize_cache_hit": load_stats["quantize"]["cache_hit"],
+        "convert_time": load_stats["quantize"]["convert_time"],
+    }
+    logger.info(
+        f"{quantize} vs bf16: {result['speedup'] or 0:.2f}x, top-1 agreement {agreement:.3f}, "
+        f"exact matches {result['exact_match_rate']:.2f}"
+    )
+    return result
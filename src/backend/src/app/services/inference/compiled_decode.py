@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import time
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+import torch
+from transformers import GenerationConfig, StaticCache
+
+from app.config.inference_config import InferenceConfig
+
+logger = logging.getLogger(__name__)
+
+_inductor_configured = False
+
+
+def cache_buckets() -> List[int]:
+    return sorted(int(b) for b in InferenceConfig.COMPILE_BUCKETS.split(",") if b.strip())
+
+
+def bucket_for(length: int, buckets: Optional[List[int]] = None) -> int:
+    """Smallest bucket that fits ``length``; longer sequences round up to a multiple of the largest."""
+    buckets = buckets or cache_buckets()
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    largest = buckets[-1]
+    return -(-length // largest) * largest
+
+
+def _configure_inductor() -> None:
+    """Persist compiled kernels on disk so restarts reuse them instead of recompiling."""
+    global _inductor_configured
+    if _inductor_configured:
+        return
+    os.makedirs(InferenceConfig.COMPILE_CACHE_DIR, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(InferenceConfig.COMPILE_CACHE_DIR, "inductor"))
+    import torch._dynamo
+    import torch._inductor.config
+
+    torch._inductor.config.fx_graph_cache = True
+    # One decode graph per cache bucket (and batch size); keep them all instead of falling back to eager
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 4 * len(cache_buckets()))
+    _inductor_configured = True
+
+
+class CompileManifest:
+    """Compile time and measured speedup per (model, dtype, bucket), kept next to the inductor cache."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(InferenceConfig.COMPILE_CACHE_DIR, "manifest.json")
+        self._lock = Lock()
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._read().get(key)
+
+    def update(self, key: str, **entry) -> None:
+        with self._lock:
+            manifest = self._read()
+            manifest[key] = {**manifest.get(key, {}), **entry, "updated_at": time.time()}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+compile_manifest = CompileManifest()
+
+
+class CompiledDecoder:
+    """Runs the decode steps of a huggingface model through ``torch.compile``.
+
+    Decoding with a static KV cache has fixed shapes for a given cache length, so the
+    cache length is rounded up to a bucket and each bucket compiles once. The model's
+    ``forward`` is wrapped to use the compiled graph only for single-token steps over
+    a ``StaticCache``; prefill and every other caller (batched jobs, evaluation) stay
+    eager, so they never trigger recompiles.
+    """
+
+    def __init__(self, model: Any, model_name: str):
+        _configure_inductor()
+        self.model = model
+        self.model_name = model_name
+        self.dtype = str(model.dtype).replace("torch.", "")
+        self.buckets = cache_buckets()
+        self.stats: Dict[str, Any] = {"mode": InferenceConfig.COMPILE_MODE, "buckets": {}}
+
+        eager_forward = model.forward
+        compiled_forward = torch.compile(eager_forward, mode=InferenceConfig.COMPILE_MODE, dynamic=False)
+
+        def forward(*args, **kwargs):
+            input_ids = kwargs.get("input_ids", args[0] if args else None)
+            if (isinstance(kwargs.get("past_key_values"), StaticCache)
+                    and input_ids is not None and input_ids.shape[-1] == 1):
+                return compiled_forward(*args, **kwargs)
+            return eager_forward(*args, **kwargs)
+
+        model.forward = forward
+
+    def manifest_key(self, bucket: int) -> str:
+        return f"{self.model_name}|{self.dtype}|{bucket}"
+
+    def prepare(self, gen_kwargs: Dict[str, Any], prompt_length: int) -> None:
+        """Give a generate call a fresh static KV cache sized to the request's bucket."""
+        generation_config: GenerationConfig = gen_kwargs["generation_config"]
+        batch_size = gen_kwargs["inputs"].shape[0] * (getattr(generation_config, "num_return_sequences", 1) or 1)
+        bucket = bucket_for(prompt_length + (generation_config.max_new_tokens or 0), self.buckets)
+        gen_kwargs["past_key_values"] = StaticCache(
+            config=self.model.config, max_batch_size=batch_size, max_cache_len=bucket,
+            device=self.model.device, dtype=self.model.dtype,
+        )
+        if hasattr(generation_config, "disable_compile"):
+            # Newer transformers would otherwise wrap the forward in its own compiled call
+            generation_config.disable_compile = True
+        self.stats["buckets"].setdefault(str(bucket), {}).setdefault("requests", 0)
+        self.stats["buckets"][str(bucket)]["requests"] += 1
+
+    def _generate(self, input_ids: torch.Tensor, max_new_tokens: int, bucket: Optional[int]) -> float:
+        kwargs: Dict[str, Any] = {"do_sample": False, "max_new_tokens": max_new_tokens,
+                                  "min_new_tokens": max_new_tokens}
+        if bucket is not None:
+            kwargs["past_key_values"] = StaticCache(
+                config=self.model.config, max_batch_size=input_ids.shape[0], max_cache_len=bucket,
+                device=self.model.device, dtype=self.model.dtype,
+            )
+        start = time.perf_counter()
+        with torch.inference_mode():
+            self.model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), **kwargs)
+        return time.perf_counter() - start
+
+    def warm_up(self, prompt_ids: List[int], buckets: Optional[List[int]] = None,
+                decode_tokens: int = InferenceConfig.COMPILE_WARMUP_TOKENS) -> Dict[str, Any]:
+        """Compile the decode graph for each bucket and measure the speedup over eager decoding.
+
+        Args:
+            prompt_ids: Token ids of a representative prompt
+            buckets: Cache lengths to compile (defaults to ``COMPILE_WARMUP_BUCKETS``)
+            decode_tokens: Tokens decoded when timing eager vs compiled
+
+        Returns:
+            Per bucket: ``compile_time`` (first call, includes any cache load),
+            ``eager_tokens_per_second``, ``compiled_tokens_per_second`` and ``speedup``
+        """
+        buckets = buckets or [int(b) for b in InferenceConfig.COMPILE_WARMUP_BUCKETS.split(",") if b.strip()]
+        input_ids = torch.tensor([prompt_ids], dtype=torch.long, device=self.model.device)
+        eager_time = self._generate(input_ids, decode_tokens, None)
+        eager_tps = decode_tokens / eager_time
+        for bucket in buckets:
+            bucket = bucket_for(max(bucket, len(prompt_ids) + decode_tokens), self.buckets)
+            compile_time = self._generate(input_ids, 2, bucket)
+            compiled_tps = decode_tokens / self._generate(input_ids, decode_tokens, bucket)
+            entry = {
+                "compile_time": compile_time,
+                "eager_tokens_per_second": eager_tps,
+                "compiled_tokens_per_second": compiled_tps,
+                "speedup": compiled_tps / eager_tps,
+            }
+            previous = compile_manifest.get(self.manifest_key(bucket))
+            entry["cache_hit"] = previous is not None and compile_time < 0.5 * previous.get("compile_time", 0)
+            compile_manifest.update(self.manifest_key(bucket), **entry)
+            self.stats["buckets"].setdefault(str(bucket), {"requests": 0}).update(entry)
+            logger.info(
+                f"Compiled decode for {self.model_name} ({self.dtype}, bucket {bucket}) in {compile_time:.1f}s: "
+                f"{compiled_tps:.1f} vs {eager_tps:.1f} tok/s eager ({entry['speedup']:.2f}x)"
+            )
+        return self.stats
@@ -0,0 +1,98 @@
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.inference.batching import truncate_at_stop
+
+
+def split_system(messages: List[Dict[str, str]]) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """Separate OpenAI ``system`` messages from the conversation; templates take the system prompt apart."""
+    system = "\n".join(m["content"] for m in messages if m["role"] == "system") or None
+    return system, [m for m in messages if m["role"] != "system"]
+
+
+class StopFilter:
+    """Applies ``stop`` strings to a token stream.
+
+    Text that could still turn out to be the start of a stop string is held back,
+    so nothing after (or part of) a stop string ever reaches the client.
+    """
+
+    def __init__(self, stop: Optional[List[str]]):
+        self.stop = [s for s in stop or [] if s]
+        self.holdback = max((len(s) for s in self.stop), default=1) - 1
+        self.buffer = ""
+        self.stopped = False
+
+    def feed(self, chunk: str) -> str:
+        """Add a streamed chunk and return the text that is safe to emit."""
+        if self.stopped:
+            return ""
+        self.buffer += chunk
+        text, self.stopped = truncate_at_stop(self.buffer, self.stop)
+        if self.stopped:
+            self.buffer = ""
+            return text
+        cut = max(len(self.buffer) - self.holdback, 0)
+        text, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return text
+
+    def flush(self) -> str:
+        text, self.buffer = self.buffer, ""
+        return "" if self.stopped else text
+
+
+def completion_id() -> str:
+    return f"chatcmpl-{uuid.uuid4().hex}"
+
+
+def completion_response(request_id: str, model: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """OpenAI ``chat.completion`` object for the ``n`` results of one prompt."""
+    return {
+        "id": request_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": index,
+                "message": {"role": "assistant", "content": result["response"]},
+                "finish_reason": result["finish_reason"],
+            }
+            for index, result in enumerate(results)
+        ],
+        "usage": usage(results),
+    }
+
+
+def usage(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Token usage as OpenAI reports it: the shared prompt once, every completion summed."""
+    prompt_tokens = results[0]["prompt_tokens"] if results else 0
+    completion_tokens = sum(result["completion_tokens"] for result in results)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def completion_chunk(request_id: str, model: str, index: int = 0, content: Optional[str] = None,
+                     role: Optional[str] = None, finish_reason: Optional[str] = None,
+                     usage: Optional[Dict[str, int]] = None) -> str:
+    """One server-sent event of an OpenAI ``chat.completion.chunk`` stream."""
+    delta: Dict[str, str] = {}
+    if role is not None:
+        delta["role"] = role
+    if content is not None:
+        delta["content"] = content
+    chunk: Dict[str, Any] = {
+        "id": request_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}] if usage is None else [],
+    }
+    if usage is not None:
+        chunk["usage"] = usage
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
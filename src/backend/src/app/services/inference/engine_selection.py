@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from app.config.inference_config import InferenceConfig
+from app.services.inference.engines import default_engine_order, engine_adapter, engine_installed, installed_engines
+from app.services.inference.model_loader import load_chat_model
+from app.util.util import torch_gc
+
+logger = logging.getLogger(__name__)
+
+# Prompts of the calibration batch; short and varied so the run finishes quickly on CPU too
+CALIBRATION_PROMPTS = [
+    "Explain in a few sentences why the sky is blue.",
+    "What is the capital of France?",
+    "Write a Python function that returns the factorial of n.",
+    "List three advantages of unit testing.",
+]
+
+
+def _device() -> str:
+    return f"cuda:{torch.cuda.get_device_name(0)}" if torch.cuda.is_available() else "cpu"
+
+
+async def measure_engine(chat_model: Any, prompts: List[str], max_new_tokens: int, runs: int) -> Dict[str, Any]:
+    """Greedy batched throughput and single-prompt latency of a loaded chat model (best of ``runs``)."""
+    adapter = engine_adapter(chat_model)
+    batch = [[{"role": "user", "content": prompt}] for prompt in prompts]
+    kwargs = {"do_sample": False, "max_new_tokens": max_new_tokens}
+    await adapter.generate_batch(chat_model, batch[:1], **kwargs)  # warm-up
+
+    batch_tps, latencies = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        results = await adapter.generate_batch(chat_model, batch, **kwargs)
+        elapsed = time.perf_counter() - start
+        batch_tps.append(sum(r["completion_tokens"] for r in results) / elapsed if elapsed > 0 else 0.0)
+
+        start = time.perf_counter()
+        await adapter.generate_batch(chat_model, batch[:1], **kwargs)
+        latencies.append(time.perf_counter() - start)
+    return {"tokens_per_second": max(batch_tps), "single_prompt_seconds": min(latencies)}
+
+
+class EngineSelector:
+    """Picks the inference engine for ``infer_backend="auto"`` requests.
+
+    A calibration loads the model on every installed engine, measures batched
+    greedy throughput and keeps the fastest one that loaded. Results are persisted
+    per model and device in ``ENGINE_CALIBRATION_PATH``, so a deployment calibrates
+    once. Until a model is calibrated (or with ``ENGINE_AUTO_CALIBRATE`` off) the
+    first installed engine of :func:`default_engine_order` is used; the calibration
+    itself runs in the background, never on a request's path, and is skipped when
+    only one engine is installed.
+    """
+
+    def __init__(self, path: str = InferenceConfig.ENGINE_CALIBRATION_PATH):
+        self.path = path
+        self._results: Dict[str, Dict[str, Any]] = self._read()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable engine calibration file {self.path}: {str(e)}")
+            return {}
+
+    def _write(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._results, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def calibration_key(model_args: Dict[str, Any]) -> str:
+        identity = {k: model_args.get(k) for k in ("model_name_or_path", "adapter_name_or_path", "finetuning_type")}
+        return json.dumps({**identity, "device": _device()}, sort_keys=True)
+
+    def selected(self, model_args: Dict[str, Any]) -> Optional[str]:
+        """Calibrated engine for the model, None if uncalibrated or that engine is gone."""
+        result = self._results.get(self.calibration_key(model_args))
+        engine = result.get("selected") if result else None
+        return engine if engine and engine_installed(engine) else None
+
+    async def resolve(self, model_args: Dict[str, Any]) -> str:
+        """Concrete engine name for an ``auto`` model."""
+        candidates = default_engine_order()
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else "huggingface"
+        engine = self.selected(model_args)
+        if engine is not None:
+            return engine
+        key = self.calibration_key(model_args)
+        if InferenceConfig.ENGINE_AUTO_CALIBRATE and key not in self._tasks:
+            # Later requests pick up the selection once it is persisted
+            self._tasks[key] = asyncio.create_task(self._calibrate_in_background(model_args))
+        return candidates[0]
+
+    async def _calibrate_in_background(self, model_args: Dict[str, Any]) -> None:
+        try:
+            await self.calibrate(model_args)
+        except Exception as e:
+            logger.error(f"Background engine calibration of {model_args['model_name_or_path']} failed: {str(e)}",
+                         exc_info=True)
+
+    async def calibrate(self, model_args: Dict[str, Any], engines: Optional[List[str]] = None,
+                        prompts: Optional[List[str]] = None, max_new_tokens: int = InferenceConfig.ENGINE_CALIBRATION_TOKENS,
+                        runs: int = 2) -> Dict[str, Any]:
+        """
+        Measure every requested (default: installed) engine on the model and select the fastest.
+
+        Each engine loads the model on its own and releases it before the next one.
+        An engine that is not installed or fails to load (no GPU, unsupported
+        architecture) is reported as unavailable and skipped.
+
+        Returns:
+            Dict with per-engine ``results``, the ``selected`` engine and the ``device``
+        """
+        args = {k: v for k, v in model_args.items() if k not in ("infer_backend", "compile", "kv_cache", "quantize")}
+        prompts = prompts or CALIBRATION_PROMPTS
+        results: Dict[str, Dict[str, Any]] = {}
+        for engine in engines or default_engine_order():
+            if not engine_installed(engine):
+                results[engine] = {"available": False, "error": "not installed"}
+                continue
+            try:
+                chat_model, load_stats = await asyncio.to_thread(load_chat_model, {**args, "infer_backend": engine})
+            except Exception as e:
+                logger.warning(f"Engine {engine} could not load {args['model_name_or_path']}: {str(e)}")
+                results[engine] = {"available": False, "error": str(e)}
+                continue
+            try:
+                results[engine] = {"available": True, "load_time": load_stats["load_time"],
+                                   **await measure_engine(chat_model, prompts, max_new_tokens, runs)}
+            except Exception as e:
+                logger.warning(f"Engine {engine} failed during calibration: {str(e)}")
+                results[engine] = {"available": False, "error": str(e)}
+            finally:
+                del chat_model
+                torch_gc()
+
+        measured = {name: r for name, r in results.items() if r["available"]}
+        selected = max(measured, key=lambda name: measured[name]["tokens_per_second"]) if measured else None
+        report = {"device": _device(), "selected": selected, "results": results, "calibrated_at": time.time()}
+        if selected is not None:
+            self._results[self.calibration_key(model_args)] = report
+            self._write()
+        logger.info(f"Engine calibration for {args['model_name_or_path']} on {report['device']}: selected {selected}")
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "device": _device(),
+            "installed": installed_engines(),
+            "default_order": default_engine_order(),
+            "calibrations": [{"key": key, **report} for key, report in self._results.items()],
+        }
+
+
+engine_selector = EngineSelector()
@@ -0,0 +1,133 @@
+import asyncio
+import importlib.util
+import time
+from abc import ABC, abstractmethod
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+import torch
+from llamafactory.chat.chat_model import ChatModel
+
+from app.config.inference_config import InferenceConfig
+from app.services.inference.batching import encode_prompt, hf_generate_batch
+from app.services.inference.streaming import GenerationControl, hf_stream
+from app.util.util import EngineName
+
+# Python package each engine needs besides LlamaFactory itself
+ENGINE_PACKAGES = {EngineName.HF: "transformers", EngineName.VLLM: "vllm", EngineName.SGLANG: "sglang"}
+
+
+def engine_installed(name: str) -> bool:
+    return importlib.util.find_spec(ENGINE_PACKAGES[EngineName(name)]) is not None
+
+
+def installed_engines() -> List[str]:
+    return [name.value for name in EngineName if engine_installed(name)]
+
+
+def default_engine_order() -> List[str]:
+    """Installed engines, most likely fastest first, used until a calibration says otherwise.
+
+    vllm and sglang only pay off with a GPU; on CPU-only hosts the huggingface
+    engine comes first.
+    """
+    order = [EngineName.VLLM, EngineName.SGLANG, EngineName.HF]
+    if not torch.cuda.is_available():
+        order = [EngineName.HF, EngineName.VLLM, EngineName.SGLANG]
+    return [name.value for name in order if engine_installed(name)]
+
+
+class EngineAdapter(ABC):
+    """Common batch/stream interface over one kind of LlamaFactory engine.
+
+    ``per_token_hook`` tells whether the stream updates ``control.tokens`` and
+    ``control.token_times`` itself; otherwise :func:`stream_chat` counts chunks.
+    """
+
+    name: str
+    per_token_hook = False
+
+    @abstractmethod
+    async def generate_batch(self, chat_model: ChatModel, batch_messages: List[List[Dict[str, str]]],
+                             control: Optional[GenerationControl] = None, **input_kwargs) -> List[Dict[str, Any]]:
+        """One result dict per generated sequence, see :func:`app.services.inference.batching.generate_batch`."""
+
+    @abstractmethod
+    def stream(self, chat_model: ChatModel, messages: List[Dict[str, str]], control: GenerationControl,
+               draft_model: Optional[ChatModel] = None, **input_kwargs) -> AsyncGenerator[str, None]:
+        """Decoded text chunks of one sequence."""
+
+
+class HuggingfaceAdapter(EngineAdapter):
+    """Padded batched ``generate`` calls and a cancellable generate thread per stream."""
+
+    name = EngineName.HF.value
+    per_token_hook = True
+
+    async def generate_batch(self, chat_model: ChatModel, batch_messages: List[List[Dict[str, str]]],
+                             control: Optional[GenerationControl] = None, **input_kwargs) -> List[Dict[str, Any]]:
+        engine = chat_model.engine
+        async with engine.semaphore:
+            activate = getattr(chat_model, "activate", None)
+            if activate is not None:
+                await asyncio.to_thread(activate, engine)
+            return await asyncio.to_thread(hf_generate_batch, engine, batch_messages, input_kwargs, control)
+
+    def stream(self, chat_model: ChatModel, messages: List[Dict[str, str]], control: GenerationControl,
+               draft_model: Optional[ChatModel] = None, **input_kwargs) -> AsyncGenerator[str, None]:
+        return hf_stream(chat_model, messages, control, draft_model=draft_model, **input_kwargs)
+
+
+class AsyncEngineAdapter(EngineAdapter):
+    """vllm and sglang: the engine runs its own continuous batching, requests are submitted concurrently."""
+
+    def __init__(self, name: EngineName):
+        self.name = name.value
+
+    async def generate_batch(self, chat_model: ChatModel, batch_messages: List[List[Dict[str, str]]],
+                             control: Optional[GenerationControl] = None, **input_kwargs) -> List[Dict[str, Any]]:
+        gathered = asyncio.ensure_future(
+            asyncio.gather(*(chat_model.achat(messages, **input_kwargs) for messages in batch_messages)))
+        if control is not None:
+            control.generate_started = time.perf_counter()
+            while not gathered.done():
+                await asyncio.wait({gathered}, timeout=InferenceConfig.DISCONNECT_POLL_INTERVAL)
+                if not gathered.done() and control.should_stop():
+                    # Cancelling the achat calls aborts the requests inside the engine
+                    gathered.cancel()
+                    samples = len(batch_messages) * (input_kwargs.get("num_return_sequences") or 1)
+                    return [{"response": "", "prompt_tokens": 0, "completion_tokens": 0,
+                             "finish_reason": control.stop_reason}] * samples
+        outputs = await gathered
+        return [
+            {
+                "response": response.response_text,
+                "prompt_tokens": response.prompt_length,
+                "completion_tokens": response.response_length,
+                "finish_reason": response.finish_reason,
+            }
+            for responses in outputs
+            for response in responses
+        ]
+
+    def stream(self, chat_model: ChatModel, messages: List[Dict[str, str]], control: GenerationControl,
+               draft_model: Optional[ChatModel] = None, **input_kwargs) -> AsyncGenerator[str, None]:
+        if draft_model is not None:
+            raise ValueError(f"Speculative decoding is not supported on the {self.name} backend")
+        control.generate_started = time.perf_counter()
+        control.prompt_tokens = len(encode_prompt(chat_model, messages, input_kwargs.get("system"),
+                                                  input_kwargs.get("tools")))
+        return chat_model.astream_chat(messages, **input_kwargs)
+
+
+ENGINE_ADAPTERS: Dict[str, EngineAdapter] = {
+    EngineName.HF.value: HuggingfaceAdapter(),
+    EngineName.VLLM.value: AsyncEngineAdapter(EngineName.VLLM),
+    EngineName.SGLANG.value: AsyncEngineAdapter(EngineName.SGLANG),
+}
+
+
+def engine_adapter(chat_model: ChatModel) -> EngineAdapter:
+    """Adapter matching the engine a pooled chat model was loaded with."""
+    # LlamaFactory has its own EngineName enum with the same values
+    name = chat_model.engine.name
+    return ENGINE_ADAPTERS[getattr(name, "value", name)]
@@ -0,0 +1,115 @@
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from transformers.cache_utils import QuantizedCache, QuantizedCacheConfig
+
+from app.config.inference_config import InferenceConfig
+
+logger = logging.getLogger(__name__)
+
+KV_CACHE_DTYPES = ("int8",)
+
+
+class Int8QuantizedCache(QuantizedCache):
+    """KV cache stored as int8 with one absmax scale per token and head.
+
+    Pure torch, so it needs neither quanto nor HQQ. The most recent
+    ``residual_length`` tokens stay in full precision (as in transformers'
+    ``QuantizedCache``) and everything older is kept quantized, which roughly halves
+    the cache of a bf16 model and quarters that of an fp32 one.
+    """
+
+    def __init__(self, residual_length: int, compute_dtype: torch.dtype, device: Any):
+        super().__init__(QuantizedCacheConfig(
+            backend="int8", nbits=8, residual_length=residual_length, compute_dtype=compute_dtype, device=device,
+        ))
+
+    def _quantize(self, tensor: torch.Tensor, axis: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        scale = tensor.abs().amax(dim=-1, keepdim=True).float().clamp(min=1e-8) / 127
+        quantized = torch.round(tensor.float() / scale).clamp_(-127, 127).to(torch.int8)
+        return quantized, scale
+
+    def _dequantize(self, q_tensor: Tuple[torch.Tensor, torch.Tensor]) -> torch.Tensor:
+        quantized, scale = q_tensor
+        return (quantized.float() * scale).to(self.compute_dtype)
+
+    def nbytes(self) -> int:
+        """Bytes currently held by the cache (quantized part, scales and residual)."""
+        total = 0
+        for quantized in self._quantized_key_cache + self._quantized_value_cache:
+            total += sum(t.numel() * t.element_size() for t in quantized)
+        for residual in self.key_cache + self.value_cache:
+            total += residual.numel() * residual.element_size()
+        return total
+
+
+def admission_capacity_factor(model_args: Dict[str, Any]) -> float:
+    """How many times more concurrent generations a model's KV cache setting allows.
+
+    This scales the admission limit; the huggingface engine's own semaphore
+    (LlamaFactory's ``MAX_CONCURRENT``) still decides how many of them generate at once.
+    """
+    return InferenceConfig.KV_CACHE_CONCURRENCY_FACTOR if model_args.get("kv_cache") else 1.0
+
+
+def make_kv_cache(model: Any, kv_cache: str) -> Int8QuantizedCache:
+    if kv_cache not in KV_CACHE_DTYPES:
+        raise ValueError(f"Unsupported kv_cache {kv_cache!r}, expected one of {KV_CACHE_DTYPES}")
+    return Int8QuantizedCache(InferenceConfig.KV_CACHE_RESIDUAL_LENGTH, model.dtype, model.device)
+
+
+def kv_bytes_per_token(config: Any, dtype: torch.dtype, kv_cache: Optional[str] = None) -> int:
+    """Memory one cached token takes across all layers (keys and values)."""
+    text_config = config.get_text_config() if hasattr(config, "get_text_config") else config
+    num_heads = text_config.num_attention_heads
+    kv_heads = getattr(text_config, "num_key_value_heads", None) or num_heads
+    head_dim = getattr(text_config, "head_dim", None) or text_config.hidden_size // num_heads
+    vectors = 2 * text_config.num_hidden_layers * kv_heads
+    if kv_cache == "int8":
+        return vectors * (head_dim + 4)  # int8 values plus one fp32 scale per vector
+    return vectors * head_dim * torch.empty(0, dtype=dtype).element_size()
+
+
+def attach_kv_cache(engine: Any, kv_cache: str) -> Dict[str, Any]:
+    """Make every huggingface generate call on ``engine`` use a quantized KV cache.
+
+    Returns:
+        Memory-per-token figures for the pool stats
+    """
+    model = engine.model
+    engine.kv_cache_factory = lambda: make_kv_cache(model, kv_cache)
+    baseline = kv_bytes_per_token(model.config, model.dtype)
+    quantized = kv_bytes_per_token(model.config, model.dtype, kv_cache)
+    stats = {
+        "dtype": kv_cache,
+        "residual_length": InferenceConfig.KV_CACHE_RESIDUAL_LENGTH,
+        "bytes_per_token": quantized,
+        "baseline_bytes_per_token": baseline,
+        "compression": baseline / quantized,
+    }
+    logger.info(f"{kv_cache} KV cache: {quantized} bytes/token vs {baseline} ({stats['compression']:.2f}x smaller)")
+    return stats
+
+
+def sequence_perplexity(model: Any, input_ids: torch.Tensor, chunk_size: int,
+                        kv_cache: Optional[str] = None) -> Tuple[float, Optional[int]]:
+    """Perplexity of ``input_ids`` fed chunk by chunk, so later chunks attend to the cache.
+
+    Returns:
+        The perplexity and, for quantized caches, the bytes the cache held at the end
+    """
+    past_key_values = make_kv_cache(model, kv_cache) if kv_cache else None
+    total_nll, total_tokens = 0.0, 0
+    with torch.inference_mode():
+        for start in range(0, input_ids.shape[-1] - 1, chunk_size):
+            # One extra token: the chunk's last target is the next chunk's first input
+            chunk = input_ids[:, start:start + chunk_size + 1]
+            outputs = model(input_ids=chunk[:, :-1], past_key_values=past_key_values, use_cache=True)
+            past_key_values = outputs.past_key_values
+            log_probs = torch.log_softmax(outputs.logits.float(), dim=-1)
+            nll = -log_probs.gather(-1, chunk[:, 1:].unsqueeze(-1)).squeeze(-1)
+            total_nll += nll.sum().item()
+            total_tokens += nll.numel()
+    cache_bytes = past_key_values.nbytes() if isinstance(past_key_values, Int8QuantizedCache) else None
+    return float(torch.exp(torch.tensor(total_nll / max(total_tokens, 1)))), cache_bytes
@@ -0,0 +1,296 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from llamafactory.chat.chat_model import ChatModel
+
+from app.config.inference_config import InferenceConfig
+from app.services.inference.model_loader import load_chat_model
+from app.util.util import torch_gc
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_ARGS = ("adapter_name_or_path", "finetuning_type")
+
+
+class RateTracker:
+    """Request rate per key over a sliding time window."""
+
+    def __init__(self, window: float = InferenceConfig.LORA_RATE_WINDOW):
+        self.window = window
+        self._hits: Dict[str, Deque[float]] = {}
+
+    def _trim(self, hits: Deque[float], now: float) -> None:
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+
+    def hit(self, key: str) -> None:
+        now = time.monotonic()
+        hits = self._hits.setdefault(key, deque())
+        hits.append(now)
+        self._trim(hits, now)
+
+    def rate(self, key: str) -> float:
+        hits = self._hits.get(key)
+        if not hits:
+            return 0.0
+        self._trim(hits, time.monotonic())
+        return len(hits) / self.window
+
+    def forget(self, key: str) -> None:
+        self._hits.pop(key, None)
+
+
+def base_model_args(model_args: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in model_args.items() if k not in ADAPTER_ARGS}
+
+
+def serves_unmerged(model_args: Dict[str, Any]) -> bool:
+    """Whether a request's adapter is served through PEFT on a shared base model."""
+    adapter = model_args.get("adapter_name_or_path")
+    return (
+        InferenceConfig.LORA_MODE == "auto"
+        and bool(adapter) and "," not in adapter
+        and not model_args.get("compile") and not model_args.get("quantize")
+        and (model_args.get("finetuning_type") or "lora") == "lora"
+        and (model_args.get("infer_backend") or "huggingface") == "huggingface"
+    )
+
+
+class SharedBase:
+    """One base model with several LoRA adapters injected through PEFT, left unmerged.
+
+    Only one adapter can be active on the injected layers at a time, so every view
+    of the base shares a single-slot semaphore and switches the active adapter once
+    it holds it. When only one adapter is loaded the base belongs to it alone and
+    that adapter may be merged in place.
+    """
+
+    def __init__(self, chat_model: ChatModel):
+        self.chat_model = chat_model
+        self.semaphore = asyncio.Semaphore(1)
+        chat_model.engine.semaphore = self.semaphore
+        self.peft_model = None
+        self.adapters: Dict[str, str] = {}  # adapter path -> PEFT adapter name
+        self.active: Optional[str] = None
+        self.merged: Optional[str] = None
+        self._next_id = 0
+
+    @property
+    def engine(self) -> Any:
+        return self.chat_model.engine
+
+    def load_adapter(self, adapter_path: str) -> None:
+        from peft import PeftModel
+
+        name = f"adapter_{self._next_id}"
+        self._next_id += 1
+        if self.merged is not None:
+            self.unmerge()
+        if self.peft_model is None:
+            # Injects LoRA layers into the engine's model in place; generation keeps using it
+            self.peft_model = PeftModel.from_pretrained(self.engine.model, adapter_path, adapter_name=name)
+            self.peft_model.eval()
+        else:
+            self.peft_model.load_adapter(adapter_path, adapter_name=name)
+        self.adapters[adapter_path] = name
+        self.active = None
+
+    def remove_adapter(self, adapter_path: str) -> None:
+        name = self.adapters.pop(adapter_path)
+        if self.merged == name:
+            self.unmerge()
+        self.peft_model.base_model.delete_adapter(name)
+        self.active = None
+
+    def activate(self, adapter_path: str) -> None:
+        """Make ``adapter_path`` the adapter used by the next generation (semaphore held)."""
+        name = self.adapters[adapter_path]
+        if self.merged is not None and self.merged != name:
+            self.unmerge()
+        if self.active != name:
+            self.peft_model.set_adapter(name)
+            self.active = name
+
+    def merge(self, adapter_path: str) -> None:
+        self.activate(adapter_path)
+        self.peft_model.merge_adapter()
+        self.merged = self.adapters[adapter_path]
+
+    def unmerge(self) -> None:
+        self.peft_model.unmerge_adapter()
+        self.merged = None
+
+
+class AdapterView:
+    """ChatModel stand-in serving one adapter, unmerged on a shared base or from a merged copy.
+
+    The streaming and batching paths call :meth:`activate` with the engine they are
+    about to run once they hold its semaphore.
+    """
+
+    def __init__(self, shared: SharedBase, model_args: Dict[str, Any]):
+        self.shared = shared
+        self.model_args = model_args
+        self.adapter_path = model_args["adapter_name_or_path"]
+        self.dedicated: Optional[ChatModel] = None
+        self.promoting = False
+        self.copying = False  # a dedicated merged copy is being loaded
+
+    @property
+    def engine(self) -> Any:
+        return self.dedicated.engine if self.dedicated is not None else self.shared.engine
+
+    @property
+    def mode(self) -> str:
+        if self.dedicated is not None:
+            return "merged_copy"
+        if self.shared.merged is not None and self.shared.merged == self.shared.adapters.get(self.adapter_path):
+            return "merged_in_place"
+        return "unmerged"
+
+    def activate(self, engine: Any) -> None:
+        if engine is self.shared.engine:
+            self.shared.activate(self.adapter_path)
+
+
+class LoraServing:
+    """Serves LoRA adapters unmerged on shared bases and merges the hot ones.
+
+    An adapter whose request rate reaches ``LORA_HOT_RATE`` is merged: in place when
+    it has its base to itself, otherwise into a dedicated merged copy loaded in the
+    background. Dedicated copies are full models and count against the pool size
+    (:meth:`resident_models`); without a free slot the adapter stays unmerged. Once
+    its rate falls below ``LORA_COOL_RATE`` it is unmerged, or its copy dropped,
+    and it goes back to the shared base.
+    """
+
+    def __init__(self):
+        self._bases: Dict[str, SharedBase] = {}
+        self._views: Dict[str, AdapterView] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tasks = set()
+
+    async def load(self, key: str, model_args: Dict[str, Any], **load_kwargs) -> Tuple[AdapterView, Dict[str, Any]]:
+        """Attach an adapter to its (possibly newly loaded) shared base and return its view."""
+        base_args = base_model_args(model_args)
+        base_key = json.dumps({k: v for k, v in base_args.items() if v is not None}, sort_keys=True)
+        adapter_path = model_args["adapter_name_or_path"]
+        async with self._locks.setdefault(base_key, asyncio.Lock()):
+            stats: Dict[str, Any] = {}
+            shared = self._bases.get(base_key)
+            if shared is None:
+                # Adapters are merged into the shared base in place, so it cannot be memory-mapped
+                chat_model, stats = await asyncio.to_thread(load_chat_model, base_args, writable=True,
+                                                            **load_kwargs)
+                shared = self._bases[base_key] = SharedBase(chat_model)
+
+            start = time.perf_counter()
+            async with shared.semaphore:
+                await asyncio.to_thread(shared.load_adapter, adapter_path)
+            view = self._views[key] = AdapterView(shared, model_args)
+            logger.info(f"Attached adapter {adapter_path} unmerged to shared base {base_key}")
+            return view, {**stats, "adapter_load_time": time.perf_counter() - start, "lora_mode": view.mode}
+
+    def serves(self, key: str) -> bool:
+        return key in self._views
+
+    def resident_models(self) -> int:
+        """Full model copies held here: shared bases plus dedicated merged copies (also those loading)."""
+        copies = sum(1 for view in self._views.values() if view.dedicated is not None or view.copying)
+        return len(self._bases) + copies
+
+    def release(self, key: str) -> None:
+        """Detach an evicted adapter; the base is dropped with its last adapter."""
+        view = self._views.pop(key, None)
+        if view is None:
+            return
+        view.dedicated = None
+        shared = view.shared
+        if not any(other.shared is shared for other in self._views.values()):
+            # Dropped from the accounting right away; the adapter is removed in the background
+            self._bases = {k: v for k, v in self._bases.items() if v is not shared}
+        self._spawn(self._release(view))
+
+    async def _release(self, view: AdapterView) -> None:
+        shared = view.shared
+        async with shared.semaphore:
+            await asyncio.to_thread(shared.remove_adapter, view.adapter_path)
+        torch_gc()
+
+    def _spawn(self, coro: Any) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def rebalance(self, rates: RateTracker, free_slots: Optional[int] = None) -> None:
+        """Merge adapters that turned hot and unmerge those that cooled down.
+
+        ``free_slots`` is how many more full model copies the pool can hold (None:
+        unlimited); a hot adapter that would need a dedicated copy beyond it stays unmerged.
+        """
+        for key, view in self._views.items():
+            if view.promoting:
+                continue
+            rate = rates.rate(key)
+            if view.mode == "unmerged" and rate >= InferenceConfig.LORA_HOT_RATE:
+                if len(view.shared.adapters) > 1:
+                    if free_slots is not None and free_slots <= 0:
+                        continue
+                    view.copying = True
+                    free_slots = None if free_slots is None else free_slots - 1
+                view.promoting = True
+                self._spawn(self._promote(view, rate))
+            elif view.mode != "unmerged" and rate < InferenceConfig.LORA_COOL_RATE:
+                view.promoting = True
+                self._spawn(self._demote(view, rate))
+
+    async def _promote(self, view: AdapterView, rate: float) -> None:
+        shared = view.shared
+        try:
+            start = time.perf_counter()
+            if len(shared.adapters) == 1:
+                async with shared.semaphore:
+                    await asyncio.to_thread(shared.merge, view.adapter_path)
+            else:
+                # The base is shared with other adapters, so merge into a copy of its own
+                view.dedicated, _ = await asyncio.to_thread(load_chat_model, view.model_args)
+            logger.info(f"Adapter {view.adapter_path} is hot ({rate:.2f} req/s): "
+                        f"{view.mode} in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Failed to merge adapter {view.adapter_path}: {str(e)}", exc_info=True)
+        finally:
+            view.promoting = False
+            view.copying = False
+
+    async def _demote(self, view: AdapterView, rate: float) -> None:
+        shared = view.shared
+        try:
+            if view.dedicated is not None:
+                view.dedicated = None
+                torch_gc()
+            elif shared.merged is not None:
+                async with shared.semaphore:
+                    await asyncio.to_thread(shared.unmerge)
+            logger.info(f"Adapter {view.adapter_path} cooled down ({rate:.2f} req/s), serving it unmerged")
+        except Exception as e:
+            logger.error(f"Failed to unmerge adapter {view.adapter_path}: {str(e)}", exc_info=True)
+        finally:
+            view.promoting = False
+
+    def stats(self, rates: RateTracker) -> Dict[str, Any]:
+        return {
+            "mode": InferenceConfig.LORA_MODE,
+            "shared_bases": len(self._bases),
+            "resident_models": self.resident_models(),
+            "adapters": [
+                {"key": key, "adapter": view.adapter_path, "mode": view.mode, "request_rate": rates.rate(key)}
+                for key, view in self._views.items()
+            ],
+        }
+
+
+lora_serving = LoraServing()
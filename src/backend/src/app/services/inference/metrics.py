@@ -0,0 +1,183 @@
+import bisect
+import logging
+import time
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+THROUGHPUT_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# RequestTimer entries that are not durations
+UNITLESS_TIMINGS = ("tokens", "tokens_per_second", "acceptance_rate")
+
+
+class Histogram:
+    """Cumulative bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile as the upper bound of the bucket that contains it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Labelled histograms, counters and gauges rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _labels(labels: Dict[str, Any]) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name: str, value: float, buckets: List[float] = LATENCY_BUCKETS, **labels) -> None:
+        key = (name, self._labels(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[(name, self._labels(labels))] = value
+
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = ((k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(hist.buckets + [float("inf")], hist.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(f"{name}_bucket{self._format_labels(labels, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON view with count, mean and approximate p50/p95/p99 per histogram."""
+        with self._lock:
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": hist.count,
+                    "mean": hist.sum / hist.count if hist.count else 0.0,
+                    "p50": hist.quantile(0.5),
+                    "p95": hist.quantile(0.95),
+                    "p99": hist.quantile(0.99),
+                }
+                for (name, labels), hist in sorted(self._histograms.items())
+            ]
+            counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self._counters.items())]
+        return {"histograms": histograms, "counters": counters}
+
+
+inference_metrics = MetricsRegistry()
+
+
+class RequestTimer:
+    """Collects the latency breakdown of one chat request and records it per model/adapter."""
+
+    def __init__(self, model: str, adapter: Optional[str], endpoint: str, draft: Optional[str] = None):
+        self.labels = {"model": model, "adapter": adapter or "none", "endpoint": endpoint}
+        if draft:
+            # Only speculative requests carry a draft label, so their throughput can be compared
+            self.labels["draft"] = draft
+        self.start = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        self.timings[name] = seconds
+
+    def finish(self, control: Any = None, cached: bool = False) -> Dict[str, float]:
+        """Record the request's timings into the registry.
+
+        Args:
+            control: The request's GenerationControl (None for cache hits)
+            cached: Whether the response came from the response cache
+
+        Returns:
+            The timings in seconds (and ``tokens_per_second``)
+        """
+        end = time.perf_counter()
+        self.timings["total"] = end - self.start
+        inference_metrics.inc("inference_requests_total", cached=str(cached).lower(), **self.labels)
+
+        itl: List[float] = []
+        if control is not None and control.token_times:
+            first = control.token_times[0]
+            if control.generate_started is not None:
+                self.timings["prefill"] = first - control.generate_started
+            # Decode throughput: tokens after the first over the time between first and last,
+            # so neither the prefill nor response finalisation dilutes it
+            decode_time = control.token_times[-1] - first
+            if control.tokens > 1 and decode_time > 0:
+                self.timings["tokens_per_second"] = (control.tokens - 1) / decode_time
+            self.timings["ttft"] = first - self.start
+            itl = [b - a for a, b in zip(control.token_times, control.token_times[1:])]
+            self.timings["tokens"] = control.tokens
+            inference_metrics.inc("inference_output_tokens_total", control.tokens, **self.labels)
+        if control is not None and control.speculative:
+            self.timings["acceptance_rate"] = control.speculative["acceptance_rate"]
+            inference_metrics.inc("inference_draft_tokens_proposed_total", control.speculative["proposed"], **self.labels)
+            inference_metrics.inc("inference_draft_tokens_accepted_total", control.speculative["accepted"], **self.labels)
+
+        for name in ("queue_wait", "model_acquire", "prefill", "ttft", "total"):
+            if name in self.timings:
+                inference_metrics.observe(f"inference_{name}_seconds", self.timings[name], **self.labels)
+        for value in itl:
+            inference_metrics.observe("inference_inter_token_latency_seconds", value, **self.labels)
+        if "tokens_per_second" in self.timings:
+            inference_metrics.observe("inference_output_tokens_per_second", self.timings["tokens_per_second"],
+                                      buckets=THROUGHPUT_BUCKETS, **self.labels)
+        return self.timings
+
+    def header(self) -> str:
+        """Render the timings for the ``X-Timing`` response header (Server-Timing style)."""
+        return ", ".join(
+            f"{name};dur={value * 1000:.1f}" if name not in UNITLESS_TIMINGS else f"{name};val={value:.2f}"
+            for name, value in self.timings.items()
+        )
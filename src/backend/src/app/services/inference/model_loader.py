@@ -0,0 +1,249 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import warnings
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from llamafactory.chat.chat_model import ChatModel
+
+from app.config.inference_config import InferenceConfig
+from app.services.inference.quantization import chat_model_with, load_quantized_chat_model
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes (Linux only)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss() -> Optional[int]:
+    """Peak resident set size of this process in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def weight_format(model_name_or_path: str) -> str:
+    """Return ``safetensors``, ``bin`` or ``unknown`` (hub ids are resolved at load time)."""
+    if not os.path.isdir(model_name_or_path):
+        return "unknown"
+    if glob.glob(os.path.join(model_name_or_path, "*.safetensors")):
+        return "safetensors"
+    if glob.glob(os.path.join(model_name_or_path, "*.bin")):
+        return "bin"
+    return "unknown"
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """Tensors of a safetensors file as views of a read-only memory map, without copying.
+
+    The pages belong to the page cache, so every process mapping the same file
+    shares one copy of the weights and only touched pages are read from disk.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (header_len,) = struct.unpack("<Q", mapped[:8])
+    header = json.loads(mapped[8:8 + header_len])
+    tensors = {}
+    with warnings.catch_warnings():
+        # frombuffer warns that the buffer is not writable; the weights are never written
+        warnings.simplefilter("ignore", UserWarning)
+        for name, info in header.items():
+            if name == "__metadata__":
+                continue
+            dtype = SAFETENSORS_DTYPES[info["dtype"]]
+            start, end = info["data_offsets"]
+            if end == start:
+                tensors[name] = torch.empty(info["shape"], dtype=dtype)
+                continue
+            count = (end - start) // torch.empty((), dtype=dtype).element_size()
+            tensors[name] = torch.frombuffer(mapped, dtype=dtype, count=count,
+                                             offset=8 + header_len + start).view(info["shape"])
+    return tensors
+
+
+def _mmap_blocker(args: Dict[str, Any], writable: bool = False) -> Optional[str]:
+    """Why ``args`` cannot take the mmap path, or None when it can."""
+    if writable:
+        return "the weights are modified in place (e.g. adapters merged), a private copy is needed"
+    if not args.get("low_cpu_mem_usage", True):
+        return "low_cpu_mem_usage is off"
+    if (args.get("infer_backend") or "huggingface") != "huggingface":
+        return "not the huggingface backend"
+    if weight_format(args["model_name_or_path"]) != "safetensors":
+        return "no local safetensors shards"
+    if args.get("adapter_name_or_path"):
+        return "adapters are merged into the weights, which must then be writable"
+    if args.get("quantization_bit") or args.get("rope_scaling"):
+        return "the weights are transformed at load time"
+    if torch.cuda.is_available():
+        return "weights are moved to the GPU"
+    return None
+
+
+def _mmap_model(model_args: Any, files: List[str]) -> Any:
+    """Build the model on the meta device and point its parameters at the memory-mapped tensors."""
+    from accelerate import init_empty_weights
+    from llamafactory.model import load_config
+    from transformers import AutoModelForCausalLM
+
+    state_dict: Dict[str, torch.Tensor] = {}
+    for path in files:
+        state_dict.update(mmap_safetensors(path))
+    dtype = next(t.dtype for t in state_dict.values() if t.is_floating_point())
+    requested = model_args.infer_dtype
+    if requested not in (None, "auto") and getattr(torch, requested) != dtype:
+        raise ValueError(f"infer_dtype {requested} differs from the {dtype} weights on disk, a copy is needed")
+
+    # Parameters on meta, buffers (e.g. rotary frequencies) created for real
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(load_config(model_args), torch_dtype=dtype,
+                                                 trust_remote_code=model_args.trust_remote_code)
+    if not set(model.state_dict()) & set(state_dict):
+        # Checkpoints saved from the bare base model lack its prefix
+        state_dict = {f"{model.base_model_prefix}.{k}": v for k, v in state_dict.items()}
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+    still_meta = [name for name, p in model.named_parameters() if p.is_meta]
+    if still_meta:
+        raise ValueError(f"{len(still_meta)} parameters missing from the safetensors shards, e.g. {still_meta[0]}")
+    return model
+
+
+def _load_mmap(args: Dict[str, Any]) -> ChatModel:
+    files = sorted(glob.glob(os.path.join(args["model_name_or_path"], "*.safetensors")))
+    return chat_model_with(args, lambda model_args: _mmap_model(model_args, files))
+
+
+def load_chat_model(model_args: Dict[str, Any], **load_kwargs) -> Tuple[ChatModel, Dict[str, Any]]:
+    """
+    Load a chat model through the fast path and report what the load cost.
+
+    With ``FAST_LOAD``, a local safetensors model served from CPU memory is built on
+    the meta device and its parameters become views of the memory-mapped shards
+    (:func:`mmap_safetensors`): nothing is initialised or copied, pages are read
+    when first touched, and worker processes loading the same files share them
+    through the page cache. The model runs in the files' dtype; adapters,
+    load-time quantization or rope scaling and GPU placement fall back to LlamaFactory's
+    loader with ``low_cpu_mem_usage`` (meta init, then a private copy of the weights).
+    The mapped views are read-only: callers that modify the weights in place (e.g.
+    merging a LoRA adapter into a shared base) must pass ``writable=True``.
+
+    Args:
+        model_args: LlamaFactory inference arguments
+        **load_kwargs: Extra load-only arguments; ``writable=True`` or an explicit
+            ``low_cpu_mem_usage=False`` forces a private copy of the weights
+
+    Returns:
+        The ChatModel and a dict with ``load_time``, ``rss_delta``, ``peak_rss_delta``,
+        ``weight_format``, ``low_cpu_mem_usage`` and ``mmap`` (whether weights are shared)
+    """
+    args = {**model_args, **load_kwargs}
+    compile_decode = args.pop("compile", False)
+    kv_cache = args.pop("kv_cache", None)
+    quantize = args.pop("quantize", None)
+    writable = args.pop("writable", False)
+    if compile_decode and kv_cache:
+        raise ValueError("compile and kv_cache cannot be combined: compiled decode needs a static KV cache")
+    if compile_decode and quantize:
+        raise ValueError("compile and quantize cannot be combined")
+    blocker = ("FAST_LOAD is off" if not InferenceConfig.FAST_LOAD else "quantize" if quantize
+               else _mmap_blocker(args, writable))
+    args.setdefault("low_cpu_mem_usage", InferenceConfig.FAST_LOAD)
+
+    fmt = weight_format(model_args["model_name_or_path"])
+    if fmt == "bin":
+        logger.warning(f"{model_args['model_name_or_path']} has no safetensors shards; "
+                       f"pickle checkpoints cannot be memory-mapped and are read fully into RAM")
+
+    rss_before, peak_before = current_rss(), peak_rss()
+    start = time.perf_counter()
+    if quantize:
+        chat_model, quantize_stats = load_quantized_chat_model(args, quantize)
+    elif blocker is None:
+        try:
+            chat_model = _load_mmap(args)
+        except ValueError as e:
+            blocker = str(e)
+            chat_model = ChatModel(args)
+    else:
+        chat_model = ChatModel(args)
+    load_time = time.perf_counter() - start
+    rss_after, peak_after = current_rss(), peak_rss()
+
+    stats = {
+        "load_time": load_time,
+        "low_cpu_mem_usage": args["low_cpu_mem_usage"],
+        "mmap": blocker is None,
+        "weight_format": fmt,
+        "rss_delta": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+        # ru_maxrss is a high-water mark, so this is only non-zero when the load raised it
+        "peak_rss_delta": peak_after - peak_before if peak_before is not None else None,
+        "peak_rss": peak_after,
+    }
+    logger.info(
+        f"Loaded {model_args['model_name_or_path']} in {load_time:.2f}s "
+        f"(rss delta {_mib(stats['rss_delta'])}, peak rss {_mib(peak_after)}, weights {fmt}, "
+        f"{'memory-mapped' if blocker is None else f'copied: {blocker}'})"
+    )
+    if quantize:
+        stats["quantize"] = quantize_stats
+    if compile_decode:
+        stats["compile"] = _compile_decode(chat_model, model_args)
+    if kv_cache:
+        stats["kv_cache"] = _quantize_kv_cache(chat_model, kv_cache)
+    return chat_model, stats
+
+
+def _compile_decode(chat_model: ChatModel, model_args: Dict[str, Any]) -> Dict[str, Any]:
+    """Attach a compiled decoder to a huggingface chat model and warm it up."""
+    from app.services.inference.batching import encode_prompt
+    from app.services.inference.compiled_decode import CompiledDecoder
+    from app.util.util import EngineName
+
+    if chat_model.engine.name != EngineName.HF:
+        logger.warning("compile is only supported on the huggingface backend, ignoring it")
+        return {"enabled": False}
+
+    decoder = CompiledDecoder(chat_model.engine.model, model_args["model_name_or_path"])
+    prompt_ids = encode_prompt(chat_model, [{"role": "user", "content": "Hello, who are you?"}])
+    decoder.warm_up(prompt_ids)
+    chat_model.compiled_decoder = decoder
+    return decoder.stats
+
+
+def _quantize_kv_cache(chat_model: ChatModel, kv_cache: str) -> Dict[str, Any]:
+    from app.services.inference.kv_cache import attach_kv_cache
+    from app.util.util import EngineName
+
+    if chat_model.engine.name != EngineName.HF:
+        logger.warning("kv_cache is only supported on the huggingface backend, ignoring it")
+        return {"dtype": None}
+    return attach_kv_cache(chat_model.engine, kv_cache)
+
+
+def _mib(value: Optional[int]) -> str:
+    return "n/a" if value is None else f"{value / (1 << 20):.0f} MiB"
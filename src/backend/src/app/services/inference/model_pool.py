@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from llamafactory.chat.chat_model import ChatModel
+
+from app.config.inference_config import InferenceConfig
+from app.services.inference.engine_selection import engine_selector
+from app.services.inference.lora_serving import RateTracker, lora_serving, serves_unmerged
+from app.services.inference.model_loader import load_chat_model
+from app.util.util import torch_gc
+
+logger = logging.getLogger(__name__)
+
+# Request fields that identify a pooled model
+MODEL_ARG_KEYS = ("model_name_or_path", "adapter_name_or_path", "template", "finetuning_type", "infer_backend",
+                  "compile", "kv_cache", "quantize")
+
+
+def normalize_model_args(fields: Dict[str, Any], draft: bool = False) -> Dict[str, Any]:
+    """Pool arguments from a request's (or preload entry's) model fields.
+
+    Every entry point builds its pool key here, so the same model always lands on
+    the same pool entry: ``auto`` is pinned to huggingface when a huggingface-only
+    option is set (``draft``: the request uses a speculative draft model), and models
+    listed in ``QUANTIZE_MODELS`` are served int8 on the huggingface backend.
+
+    Raises:
+        ValueError: For option combinations that cannot be served
+    """
+    model = fields["model_name_or_path"]
+    quantize = fields.get("quantize")
+    hf_only = quantize or fields.get("kv_cache") or fields.get("compile") or draft \
+        or model in InferenceConfig.QUANTIZE_MODELS
+    infer_backend = fields.get("infer_backend") or "huggingface"
+    if infer_backend == "auto" and hf_only:
+        infer_backend = "huggingface"
+    if quantize and infer_backend != "huggingface":
+        raise ValueError("quantize requires the huggingface backend")
+    if infer_backend == "huggingface" and model in InferenceConfig.QUANTIZE_MODELS:
+        quantize = quantize or "int8"
+    if fields.get("compile") and (fields.get("kv_cache") or quantize):
+        raise ValueError("compile cannot be combined with kv_cache or quantize")
+    return {
+        "model_name_or_path": model,
+        "adapter_name_or_path": fields.get("adapter_name_or_path"),
+        "template": fields.get("template"),
+        "finetuning_type": fields.get("finetuning_type"),
+        "infer_backend": infer_backend,
+        "compile": fields.get("compile") or None,
+        "kv_cache": fields.get("kv_cache"),
+        "quantize": quantize
+    }
+
+
+class ModelPool:
+    """LRU pool of loaded chat models shared by every inference endpoint.
+
+    Models are keyed by the arguments that change the weights or the prompt format
+    (model, adapter, template, finetuning type, backend). ``auto`` backends are pooled
+    under the engine they resolve to. Load-only options such as
+    ``low_cpu_mem_usage`` are passed to the first load but are not part of the key.
+
+    Request rates are tracked per entry; with ``LORA_MODE=auto`` LoRA adapters on the
+    huggingface backend are served through :mod:`app.services.inference.lora_serving`,
+    which merges the hot ones. ``max_models`` bounds the full model copies in memory,
+    so adapter views sharing a base count once and merged adapter copies count too.
+    """
+
+    def __init__(self, max_models: int = InferenceConfig.MODEL_POOL_SIZE):
+        self.max_models = max_models
+        self._models: "OrderedDict[str, ChatModel]" = OrderedDict()
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        self._info: Dict[str, Dict[str, Any]] = {}
+        self._rates = RateTracker()
+        self._routes: Dict[str, Set[str]] = {}  # routing key -> pool keys acquired for it
+
+    @staticmethod
+    def make_key(model_args: Dict[str, Any]) -> str:
+        return json.dumps({k: v for k, v in model_args.items() if v is not None}, sort_keys=True)
+
+    def get(self, model_args: Dict[str, Any]) -> Optional[ChatModel]:
+        """Return the pooled model without loading it."""
+        key = self.make_key(model_args)
+        chat_model = self._models.get(key)
+        if chat_model is not None:
+            self._models.move_to_end(key)
+            self._info[key]["requests"] += 1
+            self._rates.hit(key)
+        return chat_model
+
+    async def acquire(self, model_args: Dict[str, Any], route_key: Optional[str] = None, **load_kwargs) -> ChatModel:
+        """Return a loaded chat model, loading it (once) if it is not pooled yet.
+
+        Args:
+            model_args: LlamaFactory inference arguments identifying the model;
+                ``infer_backend="auto"`` is resolved to the calibrated engine first
+            route_key: Key the request was routed to this process by; :meth:`unload_route`
+                unloads every model acquired under it
+            **load_kwargs: Extra arguments only used if the model has to be loaded
+
+        Returns:
+            The pooled ChatModel
+        """
+        if model_args.get("infer_backend") == "auto":
+            model_args = {**model_args, "infer_backend": await engine_selector.resolve(model_args)}
+        if route_key is not None:
+            self._routes.setdefault(route_key, set()).add(self.make_key(model_args))
+        chat_model = self.get(model_args)
+        if chat_model is not None:
+            lora_serving.rebalance(self._rates, self._free_slots())
+            return chat_model
+
+        key = self.make_key(model_args)
+        lock = self._load_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Another request may have loaded it while we were waiting for the lock
+            chat_model = self.get(model_args)
+            if chat_model is not None:
+                return chat_model
+
+            logger.info(f"Loading model into pool: {key}")
+            if serves_unmerged(model_args):
+                chat_model, load_stats = await lora_serving.load(key, model_args, **load_kwargs)
+            else:
+                chat_model, load_stats = await asyncio.to_thread(load_chat_model, model_args, **load_kwargs)
+            self._models[key] = chat_model
+            self._info[key] = {**load_stats, "loaded_at": time.time(), "requests": 1}
+            self._rates.hit(key)
+            self._evict()
+            return chat_model
+
+    def resident_models(self) -> int:
+        """Full model copies in memory: plain entries, shared LoRA bases and merged adapter copies."""
+        plain = sum(1 for key in self._models if not lora_serving.serves(key))
+        return plain + lora_serving.resident_models()
+
+    def _free_slots(self) -> Optional[int]:
+        return self.max_models - self.resident_models() if self.max_models > 0 else None
+
+    def _evict(self) -> None:
+        # The entry just loaded (most recent) is never evicted
+        while self.max_models > 0 and len(self._models) > 1 and self.resident_models() > self.max_models:
+            key, _ = self._models.popitem(last=False)
+            self._info.pop(key, None)
+            self._load_locks.pop(key, None)
+            self._rates.forget(key)
+            lora_serving.release(key)
+            logger.info(f"Evicted model from pool: {key}")
+            torch_gc()
+
+    def unload(self, model_args: Dict[str, Any]) -> bool:
+        key = self.make_key(model_args)
+        if self._models.pop(key, None) is None:
+            return False
+        self._info.pop(key, None)
+        self._rates.forget(key)
+        lora_serving.release(key)
+        torch_gc()
+        return True
+
+    def unload_route(self, route_key: str) -> List[str]:
+        """Unload the models acquired under ``route_key`` that no other route still uses."""
+        keys = self._routes.pop(route_key, set())
+        still_used = set().union(*self._routes.values())
+        return [key for key in sorted(keys - still_used) if self.unload(json.loads(key))]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_models": self.max_models,
+            "resident_models": self.resident_models(),
+            "models": [
+                {"key": key, **self._info.get(key, {}), "request_rate": self._rates.rate(key)}
+                for key in self._models
+            ],
+            "lora": lora_serving.stats(self._rates),
+        }
+
+
+model_pool = ModelPool()
@@ -0,0 +1,194 @@
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+from threading import Thread
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import torch
+import transformers
+from llamafactory.chat.chat_model import ChatModel, _start_background_loop
+from llamafactory.chat.hf_engine import HuggingfaceEngine
+from llamafactory.data import get_template_and_fix_tokenizer
+from llamafactory.extras.constants import EngineName
+from llamafactory.hparams import get_infer_args
+from llamafactory.model import load_config, load_tokenizer
+from transformers import AutoModelForCausalLM, GenerationConfig
+from transformers.modeling_utils import no_init_weights
+
+from app.config.inference_config import InferenceConfig
+
+logger = logging.getLogger(__name__)
+
+QUANTIZE_MODES = ("int8",)
+
+
+def _weight_files(path: str) -> list:
+    """(name, size, mtime) of the weight files of a local model/adapter directory."""
+    if not path or not os.path.isdir(path):
+        return []
+    patterns = ("*.safetensors", "*.bin", "*.json")
+    files = sorted(f for pattern in patterns for f in glob.glob(os.path.join(path, pattern)))
+    return [(os.path.basename(f), os.path.getsize(f), int(os.path.getmtime(f))) for f in files]
+
+
+def _hub_revision(model_args: Dict[str, Any]) -> Optional[str]:
+    """Commit sha a hub model id resolves to (the cached snapshot when offline), None for local paths."""
+    repo_id = model_args["model_name_or_path"]
+    if os.path.isdir(repo_id):
+        return None
+    from huggingface_hub import HfApi, snapshot_download
+
+    revision = model_args.get("model_revision") or "main"
+    try:
+        return HfApi().model_info(repo_id, revision=revision, token=model_args.get("hf_hub_token")).sha
+    except Exception:
+        try:
+            # Snapshot directories are named after their commit sha
+            return os.path.basename(snapshot_download(repo_id, revision=revision, local_files_only=True))
+        except Exception:
+            logger.warning(f"Cannot resolve the revision of {repo_id}; its quantized cache key ignores hub updates")
+            return revision
+
+
+def quantized_cache_path(model_args: Dict[str, Any], mode: str) -> str:
+    """On-disk location of a quantized variant, keyed by the source weights and library versions."""
+    identity = {
+        "mode": mode,
+        "model": model_args["model_name_or_path"],
+        "adapter": model_args.get("adapter_name_or_path"),
+        "finetuning_type": model_args.get("finetuning_type"),
+        "template": model_args.get("template"),
+        "model_files": _weight_files(model_args["model_name_or_path"]),
+        "model_revision": _hub_revision(model_args),
+        "adapter_files": _weight_files(model_args.get("adapter_name_or_path")),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+    }
+    digest = hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+    return os.path.join(InferenceConfig.QUANTIZE_CACHE_DIR, f"{mode}-{digest}.state.pt")
+
+
+def quantize_dynamic_int8(model: Any) -> Any:
+    """Replace every ``nn.Linear`` with a dynamically quantized int8 Linear (CPU only).
+
+    Weights are quantized once per output channel; activations are quantized on the
+    fly per batch, so no calibration data is needed.
+    """
+    model = model.to("cpu").float()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def model_nbytes(model: Any) -> int:
+    """Bytes held by parameters, buffers and packed quantized weights."""
+    total = sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+    for module in model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            weight, bias = module.weight(), module.bias()
+            total += weight.numel() * weight.element_size()
+            total += bias.numel() * bias.element_size() if bias is not None else 0
+    return total
+
+
+def _quantized_skeleton(model_args: Any, state_dict: Dict[str, Any]) -> Any:
+    """The model architecture with dynamically quantized Linear layers, ready for ``state_dict``.
+
+    The float weights are never read: the module is built from the config without
+    initialising its parameters, then converted so the quantized parameters exist.
+    """
+    config = load_config(model_args)
+    with no_init_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32,
+                                                 trust_remote_code=model_args.trust_remote_code)
+    embeddings = model.get_input_embeddings().weight
+    name = next(n for n, p in model.named_parameters() if p is embeddings)
+    if name in state_dict and state_dict[name].shape[0] != embeddings.shape[0]:
+        model.resize_token_embeddings(state_dict[name].shape[0])
+    return quantize_dynamic_int8(model)
+
+
+def _load_quantized(model_args: Any, state_dict: Dict[str, Any]) -> Any:
+    model = _quantized_skeleton(model_args, state_dict)
+    model.load_state_dict(state_dict, strict=True)
+    return model
+
+
+def chat_model_with(args: Dict[str, Any], build_model: Callable[[Any], Any]) -> ChatModel:
+    """A ChatModel whose huggingface engine holds the model returned by ``build_model(model_args)``.
+
+    Mirrors ``ChatModel.__init__`` and ``HuggingfaceEngine.__init__`` but sets the
+    engine's ``model`` directly, so no global loader is patched and concurrent
+    plain loads are unaffected.
+    """
+    model_args, data_args, finetuning_args, generating_args = get_infer_args(args)
+    engine = HuggingfaceEngine.__new__(HuggingfaceEngine)
+    engine.name = EngineName.HF
+    engine.can_generate = finetuning_args.stage == "sft"
+    tokenizer_module = load_tokenizer(model_args)
+    engine.tokenizer = tokenizer_module["tokenizer"]
+    engine.processor = tokenizer_module["processor"]
+    engine.tokenizer.padding_side = "left" if engine.can_generate else "right"
+    engine.template = get_template_and_fix_tokenizer(engine.tokenizer, data_args)
+    model = build_model(model_args)
+    try:
+        model.generation_config = GenerationConfig.from_pretrained(model_args.model_name_or_path)
+    except OSError:
+        pass  # no generation_config.json, keep the one derived from the config
+    engine.model = model.eval()
+    engine.generating_args = generating_args.to_dict()
+    engine.semaphore = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT", "1")))
+
+    chat_model = ChatModel.__new__(ChatModel)
+    chat_model.engine = engine
+    chat_model._loop = asyncio.new_event_loop()
+    chat_model._thread = Thread(target=_start_background_loop, args=(chat_model._loop,), daemon=True)
+    chat_model._thread.start()
+    return chat_model
+
+
+def load_quantized_chat_model(args: Dict[str, Any], mode: str) -> Tuple[ChatModel, Dict[str, Any]]:
+    """
+    Load a chat model with dynamically quantized Linear layers, reusing a cached variant.
+
+    The first load converts the full-precision model and saves the quantized state
+    dict to ``QUANTIZE_CACHE_DIR``. Later loads with the same source weights load it
+    weights-only into a quantized skeleton of the architecture and skip both the
+    float load and the conversion.
+
+    Args:
+        args: LlamaFactory inference arguments (huggingface backend)
+        mode: Quantization mode, currently only ``int8``
+
+    Returns:
+        The ChatModel and a dict with ``mode``, ``cache_hit``, ``convert_time``,
+        ``model_bytes`` and ``cache_path``
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"Unsupported quantize mode {mode!r}, expected one of {QUANTIZE_MODES}")
+    if (args.get("infer_backend") or "huggingface") != "huggingface":
+        raise ValueError("Dynamic int8 quantization is only supported on the huggingface backend")
+
+    path = quantized_cache_path(args, mode)
+    args = {**args, "infer_dtype": "float32"}  # dynamic int8 Linear layers take float32 activations
+    stats: Dict[str, Any] = {"mode": mode, "cache_path": path, "convert_time": 0.0}
+    if os.path.isfile(path):
+        state_dict = torch.load(path, map_location="cpu", weights_only=True)
+        chat_model = chat_model_with(args, lambda model_args: _load_quantized(model_args, state_dict))
+        stats["cache_hit"] = True
+    else:
+        chat_model = ChatModel(args)
+        start = time.perf_counter()
+        chat_model.engine.model = quantize_dynamic_int8(chat_model.engine.model)
+        stats["convert_time"] = time.perf_counter() - start
+        os.makedirs(InferenceConfig.QUANTIZE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        torch.save(chat_model.engine.model.state_dict(), tmp_path)
+        os.replace(tmp_path, path)
+        stats["cache_hit"] = False
+        logger.info(f"Quantized {args['model_name_or_path']} to {mode} in {stats['convert_time']:.1f}s, cached at {path}")
+
+    stats["model_bytes"] = model_nbytes(chat_model.engine.model)
+    return chat_model, stats
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config.inference_config import InferenceConfig
+
+logger = logging.getLogger(__name__)
+
+
+def is_deterministic(generation_kwargs: Dict[str, Any]) -> bool:
+    """Return True when the sampling parameters make generation greedy."""
+    if generation_kwargs.get("do_sample") is False:
+        return True
+    temperature = generation_kwargs.get("temperature")
+    return temperature is not None and temperature == 0
+
+
+class ResponseCache:
+    """Exact-match LRU cache for deterministic chat responses with single-flight coalescing.
+
+    Concurrent identical requests share one generation: the first caller becomes the
+    leader and generates, the others wait on its future and reuse the result.
+    """
+
+    def __init__(self, max_entries: int = InferenceConfig.RESPONSE_CACHE_SIZE,
+                 ttl: float = InferenceConfig.RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(model: Dict[str, Any], messages: List[Dict[str, str]], generation_kwargs: Dict[str, Any]) -> str:
+        """Hash (model, adapter, template, messages, sampling params) into a cache key."""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "generation": generation_kwargs},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created, value = entry
+        if self.ttl and time.monotonic() - created > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pending(self, key: str) -> Optional[asyncio.Future]:
+        """Return the in-flight generation for ``key``, if any."""
+        return self._inflight.get(key)
+
+    def begin(self, key: str) -> None:
+        """Register the caller as the leader generating ``key``."""
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+
+    def complete(self, key: str, value: Dict[str, Any]) -> None:
+        self.put(key, value)
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    def abort(self, key: str) -> None:
+        """Release waiters of a generation that did not finish (error, disconnect, deadline)."""
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached or coalesced result, or None if the caller has to generate."""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        pending = self.pending(key)
+        if pending is not None:
+            value = await asyncio.shield(pending)
+            if value is not None:
+                self.coalesced += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def get_or_generate(self, key: str,
+                              generate: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """Return ``(value, cached)``, running ``generate`` only when no result can be reused.
+
+        ``generate`` returns the value to cache, or a value with ``"cacheable": False``
+        when the generation was cut short and must not be shared.
+        """
+        value = await self.lookup(key)
+        if value is not None:
+            return value, True
+
+        self.begin(key)
+        try:
+            value = await generate()
+        except BaseException:
+            self.abort(key)
+            raise
+        if value.pop("cacheable", True):
+            self.complete(key, value)
+        else:
+            self.abort(key)
+        return value, False
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+response_cache = ResponseCache()
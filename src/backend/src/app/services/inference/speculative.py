@@ -0,0 +1,56 @@
+import logging
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def check_draft_compatible(target: Any, draft: Any) -> None:
+    """Raise ValueError unless the draft model can propose tokens for the target.
+
+    Draft-then-verify compares token ids directly, so both models must share the
+    tokenizer vocabulary.
+    """
+    target_vocab = target.engine.tokenizer.get_vocab()
+    draft_vocab = draft.engine.tokenizer.get_vocab()
+    if target_vocab != draft_vocab:
+        raise ValueError("The draft model must use the same tokenizer as the target model")
+
+
+class DraftStats:
+    """Counts draft proposals and target verification passes of assisted generate calls.
+
+    Every draft forward pass proposes one token and every target forward pass
+    verifies a block of proposals and adds one token of its own, so the number of
+    accepted draft tokens is ``generated - verify_steps``. Hooks are attached for one
+    generate call at a time; the engine semaphore serialises calls on a model.
+    """
+
+    def __init__(self):
+        self.proposed = 0
+        self.verify_steps = 0
+        self._handles: List[Any] = []
+
+    def attach(self, target_model: Any, draft_model: Any) -> "DraftStats":
+        self._handles = [
+            target_model.register_forward_hook(lambda *_: self._count("verify_steps")),
+            draft_model.register_forward_hook(lambda *_: self._count("proposed")),
+        ]
+        return self
+
+    def _count(self, name: str) -> None:
+        setattr(self, name, getattr(self, name) + 1)
+
+    def detach(self) -> None:
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def report(self, generated: int) -> Dict[str, Any]:
+        accepted = max(generated - self.verify_steps, 0)
+        return {
+            "proposed": self.proposed,
+            "accepted": accepted,
+            "verify_steps": self.verify_steps,
+            "acceptance_rate": accepted / self.proposed if self.proposed else 0.0,
+            "tokens_per_verify_step": generated / self.verify_steps if self.verify_steps else 0.0,
+        }
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import time
+from threading import Event, Thread
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+import torch
+from fastapi import Request
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from llamafactory.chat.chat_model import ChatModel
+from llamafactory.chat.hf_engine import HuggingfaceEngine
+
+from app.config.inference_config import InferenceConfig
+from app.services.inference.speculative import DraftStats, check_draft_compatible
+from app.util.util import EngineName
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationControl:
+    """Cancellation state shared between a chat request and its generation thread.
+
+    The request side cancels it (client disconnect, shutdown), the generation side
+    polls it once per decoded token so an abandoned sequence stops right away
+    instead of running until ``max_new_tokens``.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, max_new_tokens: Optional[int] = None):
+        timeout = timeout or InferenceConfig.REQUEST_TIMEOUT
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.max_new_tokens = max_new_tokens
+        self.tokens = 0
+        self.prompt_tokens: Optional[int] = None
+        self.stop_reason: Optional[str] = None
+        # Timing marks for latency metrics (time.perf_counter values)
+        self.generate_started: Optional[float] = None
+        self.token_times: List[float] = []
+        # Draft/verify counters when the request used speculative decoding
+        self.speculative: Optional[Dict[str, Any]] = None
+        self._cancelled = Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def finish_reason(self) -> str:
+        """OpenAI-style finish reason: stop, length, deadline, disconnected or cancelled."""
+        if self.stop_reason:
+            return self.stop_reason
+        if self.max_new_tokens and self.tokens >= self.max_new_tokens:
+            return "length"
+        return "stop"
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        if self.stop_reason is None:
+            self.stop_reason = reason
+        self._cancelled.set()
+
+    def should_stop(self) -> bool:
+        if self.cancelled:
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+            return True
+        return False
+
+
+class ControlStoppingCriteria(StoppingCriteria):
+    """Stops ``model.generate`` as soon as the attached control is cancelled or expired."""
+
+    def __init__(self, control: GenerationControl, prompt_length: int):
+        self.control = control
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.control.tokens = input_ids.shape[-1] - self.prompt_length
+        self.control.token_times.append(time.perf_counter())
+        stop = self.control.should_stop()
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+
+async def watch_disconnect(request: Request, control: GenerationControl,
+                           interval: float = InferenceConfig.DISCONNECT_POLL_INTERVAL) -> None:
+    """Cancel the control once the HTTP client goes away."""
+    while not control.cancelled:
+        if await request.is_disconnected():
+            logger.info("Client disconnected, cancelling generation")
+            control.cancel("disconnected")
+            return
+        await asyncio.sleep(interval)
+
+
+def _next_chunk(streamer: TextIteratorStreamer) -> Optional[str]:
+    try:
+        return next(streamer)
+    except StopIteration:
+        return None
+
+
+async def hf_stream(chat_model: ChatModel, messages: List[Dict[str, str]], control: GenerationControl,
+                    system: Optional[str] = None, tools: Optional[str] = None,
+                    draft_model: Optional[ChatModel] = None, **input_kwargs) -> AsyncGenerator[str, None]:
+    """Token stream for the huggingface engine with a cancellable generate thread."""
+    engine = chat_model.engine
+    if not engine.can_generate:
+        raise ValueError("The current model does not support `stream_chat`.")
+
+    async with engine.semaphore:
+        activate = getattr(chat_model, "activate", None)
+        if activate is not None:
+            # Adapter views of a shared LoRA base switch the active adapter here
+            await asyncio.to_thread(activate, engine)
+        gen_kwargs, prompt_length = HuggingfaceEngine._process_args(
+            engine.model, engine.tokenizer, engine.processor, engine.template, engine.generating_args,
+            messages, system=system, tools=tools, input_kwargs=input_kwargs,
+        )
+        control.prompt_tokens = prompt_length
+        draft_stats = None
+        if draft_model is not None:
+            # Draft-then-verify (assisted generation); greedy output is identical to normal decoding
+            gen_kwargs["assistant_model"] = draft_model.engine.model
+            draft_stats = DraftStats()
+        else:
+            decoder = getattr(chat_model, "compiled_decoder", None)
+            kv_cache_factory = getattr(engine, "kv_cache_factory", None)
+            if decoder is not None:
+                decoder.prepare(gen_kwargs, prompt_length)
+            elif kv_cache_factory is not None:
+                gen_kwargs["past_key_values"] = kv_cache_factory()
+        streamer = TextIteratorStreamer(
+            engine.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=getattr(gen_kwargs["generation_config"], "skip_special_tokens", True),
+        )
+        gen_kwargs["streamer"] = streamer
+        gen_kwargs["stopping_criteria"] = StoppingCriteriaList([ControlStoppingCriteria(control, prompt_length)])
+        errors: List[BaseException] = []
+
+        def _generate():
+            try:
+                if draft_stats is not None:
+                    draft_stats.attach(engine.model, draft_model.engine.model)
+                with torch.inference_mode():
+                    engine.model.generate(**gen_kwargs)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+            finally:
+                if draft_stats is not None:
+                    draft_stats.detach()
+                    control.speculative = draft_stats.report(control.tokens)
+
+        thread = Thread(target=_generate, daemon=True)
+        control.generate_started = time.perf_counter()
+        thread.start()
+        try:
+            while not control.cancelled:
+                chunk = await asyncio.to_thread(_next_chunk, streamer)
+                if chunk is None:
+                    break
+                if chunk:
+                    yield chunk
+            if draft_stats is not None and not control.cancelled:
+                # The draft counters are reported once generate has returned
+                await asyncio.to_thread(thread.join, 1.0)
+            if errors:
+                raise errors[0]
+        finally:
+            # Leaving early (disconnect, deadline, caller break) must also stop the generate thread
+            if thread.is_alive():
+                control.cancel()
+
+
+async def stream_chat(chat_model: ChatModel, messages: List[Dict[str, str]], control: GenerationControl,
+                      request: Optional[Request] = None, draft_model: Optional[ChatModel] = None,
+                      **input_kwargs) -> AsyncGenerator[str, None]:
+    """Stream a chat completion that honours client disconnects, deadlines and token limits.
+
+    Args:
+        chat_model: The loaded LlamaFactory chat model
+        messages: Conversation history in OpenAI message format
+        control: Cancellation state for this request
+        request: The incoming HTTP request, watched for client disconnects
+        draft_model: Small model sharing the tokenizer, used for speculative decoding
+            (huggingface engine only)
+        **input_kwargs: Generation overrides forwarded to the engine
+
+    Yields:
+        Decoded text chunks
+    """
+    if control.max_new_tokens:
+        input_kwargs.setdefault("max_new_tokens", control.max_new_tokens)
+
+    if draft_model is not None:
+        if chat_model.engine.name != EngineName.HF:
+            raise ValueError("Speculative decoding is only supported on the huggingface backend")
+        check_draft_compatible(chat_model, draft_model)
+
+    from app.services.inference.engines import engine_adapter
+
+    adapter = engine_adapter(chat_model)
+    watcher = asyncio.create_task(watch_disconnect(request, control)) if request is not None else None
+    stream = adapter.stream(chat_model, messages, control, draft_model=draft_model, **input_kwargs)
+
+    try:
+        async for chunk in stream:
+            if control.should_stop():
+                break
+            if not adapter.per_token_hook:
+                # Engines without a per-token hook are timed per streamed chunk
+                control.tokens += 1
+                control.token_times.append(time.perf_counter())
+            yield chunk
+    except (asyncio.CancelledError, GeneratorExit):
+        control.cancel("disconnected")
+        raise
+    finally:
+        # Closing the engine stream aborts the request inside vllm/sglang as well
+        await stream.aclose()
+        if watcher is not None:
+            watcher.cancel()
+        if control.stop_reason:
+            logger.info(f"Generation stopped early ({control.stop_reason}) after {control.tokens} tokens")
+
+
+async def collect_chat(chat_model: ChatModel, messages: List[Dict[str, str]], control: GenerationControl,
+                       request: Optional[Request] = None, **input_kwargs: Any) -> str:
+    """Run :func:`stream_chat` to completion and return the full response text."""
+    chunks = []
+    async for chunk in stream_chat(chat_model, messages, control, request=request, **input_kwargs):
+        chunks.append(chunk)
+    return "".join(chunks)
@@ -0,0 +1,141 @@
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+from app.config.inference_config import InferenceConfig
+from app.services.inference.streaming import GenerationControl
+
+logger = logging.getLogger(__name__)
+
+def load_preload_config(path: str) -> List[Dict[str, Any]]:
+    """Read the list of models to preload from a YAML or JSON file.
+
+    Accepts either a top-level list or a mapping with a ``models`` list; every entry
+    needs ``model_name_or_path`` and may set the other ChatRequest model fields. The
+    pool arguments are normalised like a request's, so requests hit the preloaded entries.
+    """
+    from app.services.inference.model_pool import MODEL_ARG_KEYS, normalize_model_args
+
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f) if path.endswith(".json") else yaml.safe_load(f)
+    entries = config.get("models", []) if isinstance(config, dict) else (config or [])
+    models = []
+    for entry in entries:
+        if "model_name_or_path" not in entry:
+            raise ValueError(f"Preload entry without model_name_or_path: {entry}")
+        models.append(normalize_model_args({key: entry.get(key) for key in MODEL_ARG_KEYS}))
+    return models
+
+
+def check_pool_capacity(models: List[Dict[str, Any]]) -> None:
+    """Refuse a preload list that would evict its own entries before the server is ready."""
+    from app.services.inference.model_pool import model_pool
+    from app.services.inference.workers import worker_router
+
+    if model_pool.max_models <= 0:
+        return
+    per_pool: Dict[Any, int] = {}
+    for model_args in models:
+        # With workers each one has its own pool and gets the models it owns on the ring
+        owner = worker_router.route(model_pool.make_key(model_args)) if worker_router.enabled else None
+        per_pool[owner] = per_pool.get(owner, 0) + 1
+    owner, count = max(per_pool.items(), key=lambda item: item[1])
+    if count > model_pool.max_models:
+        where = f"worker {owner}" if owner is not None else "the model pool"
+        raise ValueError(f"Preload puts {count} models in {where}, more than MODEL_POOL_SIZE={model_pool.max_models}; "
+                         f"they would evict each other before the server is ready")
+
+
+class Readiness:
+    """Startup state reported by the readiness probe: ``starting``, ``warming``, ``ready`` or ``failed``."""
+
+    def __init__(self):
+        self.state = "starting"
+        self.models: List[Dict[str, Any]] = []
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "status": self.state,
+            "models": self.models,
+            "warmup_seconds": self.finished_at - self.started_at if self.finished_at and self.started_at else None,
+            "error": self.error,
+        }
+
+
+readiness = Readiness()
+
+
+async def _open_warmup_stream(model_args: Dict[str, Any], messages: List[Dict[str, str]],
+                              control: GenerationControl):
+    """Warm-up generations take the same path as requests, so the owning worker loads the model."""
+    from app.services.inference.model_pool import model_pool
+    from app.services.inference.streaming import stream_chat
+    from app.services.inference.workers import worker_router
+
+    if worker_router.enabled:
+        return worker_router.stream_chat(model_args, model_pool.make_key(model_args), messages, control,
+                                         max_new_tokens=control.max_new_tokens)
+    chat_model = await model_pool.acquire(model_args)
+    return stream_chat(chat_model, messages, control)
+
+
+async def warm_up_model(model_args: Dict[str, Any], lengths: List[int],
+                        max_new_tokens: int = InferenceConfig.WARMUP_NEW_TOKENS) -> Dict[str, Any]:
+    """Load one model into the pool and run a short generation per prompt length.
+
+    Returns:
+        The duration of each warm-up generation; the first one includes the model load
+    """
+    status: Dict[str, Any] = {"model": model_args["model_name_or_path"],
+                              "adapter": model_args.get("adapter_name_or_path"), "warmup": []}
+    for length in lengths:
+        # Roughly one token per repetition with common BPE tokenizers
+        messages = [{"role": "user", "content": " ".join(["hello"] * length)}]
+        control = GenerationControl(max_new_tokens=max_new_tokens)
+        start = time.perf_counter()
+        stream = await _open_warmup_stream(model_args, messages, control)
+        async for _ in stream:
+            pass
+        status["warmup"].append({"prompt_length": length, "seconds": time.perf_counter() - start,
+                                 "tokens": control.tokens})
+    logger.info(f"Warmed up {status['model']} (adapter {status['adapter']}) at lengths {lengths}")
+    return status
+
+
+async def preload_and_warm_up(path: Optional[str] = InferenceConfig.PRELOAD_CONFIG) -> None:
+    """Startup task: preload the configured models and flip readiness once all are warm.
+
+    Without a preload config the server is ready immediately. A model that fails to
+    load leaves the server ``failed`` (not ready) so it is never put into rotation.
+    """
+    readiness.started_at = time.time()
+    if not path:
+        readiness.state, readiness.finished_at = "ready", time.time()
+        return
+
+    readiness.state = "warming"
+    lengths = [int(n) for n in InferenceConfig.WARMUP_LENGTHS.split(",") if n.strip()]
+    try:
+        models = load_preload_config(path)
+        check_pool_capacity(models)
+        logger.info(f"Preloading {len(models)} models from {path}")
+        for model_args in models:
+            readiness.models.append(await warm_up_model(model_args, lengths))
+    except Exception as e:
+        logger.error(f"Model preload failed: {str(e)}", exc_info=True)
+        readiness.state, readiness.error = "failed", str(e)
+        return
+    finally:
+        readiness.finished_at = time.time()
+    readiness.state = "ready"
+    logger.info(f"Warm-up finished in {readiness.finished_at - readiness.started_at:.1f}s, server is ready")
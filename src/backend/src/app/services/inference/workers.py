@@ -0,0 +1,440 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, List, Optional, Set, Tuple
+
+from fastapi import Request
+
+from app.config.inference_config import InferenceConfig
+from app.services.inference.streaming import GenerationControl, watch_disconnect
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------
+# Worker process side
+# ---------------------------------------------------------------------------
+
+def _worker_main(worker_id: int, requests: "multiprocessing.Queue", responses: "multiprocessing.Queue") -> None:
+    """Entry point of an inference worker process; owns its own model pool."""
+    from app.utils.logging_config import configure_logger
+
+    configure_logger(f"inference_worker_{worker_id}")
+    asyncio.run(_serve(worker_id, requests, responses))
+
+
+async def _serve(worker_id: int, requests: "multiprocessing.Queue", responses: "multiprocessing.Queue") -> None:
+    from app.services.inference.model_pool import model_pool
+
+    controls: Dict[str, GenerationControl] = {}
+    tasks = set()
+    logger.info(f"Inference worker {worker_id} ready")
+    while True:
+        message = await asyncio.to_thread(requests.get)
+        op = message["op"]
+        if op == "shutdown":
+            break
+        if op == "ping":
+            responses.put({"id": message["id"], "type": "pong", "pool": model_pool.stats()})
+        elif op == "cancel":
+            control = controls.get(message["id"])
+            if control is not None:
+                control.cancel("cancelled")
+        elif op == "unload":
+            # The ring moved this routing key to another worker
+            for key in model_pool.unload_route(message["model_key"]):
+                logger.info(f"Worker {worker_id} unloaded {key} after a rebalance")
+        elif op in ("chat", "batch"):
+            runner = _run_chat if op == "chat" else _run_batch
+            task = asyncio.create_task(runner(message, responses, controls))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    for control in controls.values():
+        control.cancel("shutdown")
+    logger.info(f"Inference worker {worker_id} stopped")
+
+
+async def _run_chat(message: Dict[str, Any], responses: "multiprocessing.Queue",
+                    controls: Dict[str, GenerationControl]) -> None:
+    from app.services.inference.model_pool import model_pool
+    from app.services.inference.streaming import stream_chat
+
+    request_id = message["id"]
+    control = GenerationControl(timeout=message.get("timeout"), max_new_tokens=message.get("max_new_tokens"))
+    controls[request_id] = control
+    try:
+        chat_model = await model_pool.acquire(message["model_args"], route_key=message["model_key"])
+        draft_args = message.get("draft_args")
+        draft_model = await model_pool.acquire(draft_args, route_key=message["model_key"]) if draft_args else None
+        async for chunk in stream_chat(chat_model, message["messages"], control, draft_model=draft_model,
+                                       **message["gen_kwargs"]):
+            responses.put({"id": request_id, "type": "chunk", "text": chunk})
+        responses.put({"id": request_id, "type": "done", "finish_reason": control.finish_reason,
+                       "tokens": control.tokens, "prompt_tokens": control.prompt_tokens,
+                       "speculative": control.speculative})
+    except Exception as e:
+        logger.error(f"Worker request {request_id} failed: {str(e)}", exc_info=True)
+        responses.put({"id": request_id, "type": "error", "error": str(e)})
+    finally:
+        controls.pop(request_id, None)
+
+
+async def _run_batch(message: Dict[str, Any], responses: "multiprocessing.Queue",
+                     controls: Dict[str, GenerationControl]) -> None:
+    from app.services.inference.batching import generate_batch
+    from app.services.inference.model_pool import model_pool
+
+    request_id = message["id"]
+    control = GenerationControl(timeout=message.get("timeout"), max_new_tokens=message.get("max_new_tokens"))
+    controls[request_id] = control
+    try:
+        chat_model = await model_pool.acquire(message["model_args"], route_key=message["model_key"])
+        results = await generate_batch(chat_model, message["batch_messages"], control=control,
+                                       **message["gen_kwargs"])
+        responses.put({"id": request_id, "type": "result", "results": results, "stop_reason": control.stop_reason})
+    except Exception as e:
+        logger.error(f"Worker request {request_id} failed: {str(e)}", exc_info=True)
+        responses.put({"id": request_id, "type": "error", "error": str(e)})
+    finally:
+        controls.pop(request_id, None)
+
+
+# ---------------------------------------------------------------------------
+# Front-end side
+# ---------------------------------------------------------------------------
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring so adding/removing a worker only moves ~1/N of the models."""
+
+    def __init__(self, replicas: int = InferenceConfig.WORKER_HASH_REPLICAS):
+        self.replicas = replicas
+        self._points: List[Tuple[int, int]] = []
+
+    def rebuild(self, worker_ids: List[int]) -> None:
+        self._points = sorted(
+            (_hash(f"worker-{worker_id}-{replica}"), worker_id)
+            for worker_id in worker_ids
+            for replica in range(self.replicas)
+        )
+
+    def lookup(self, key: str) -> Optional[int]:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, (_hash(key), -1)) % len(self._points)
+        return self._points[index][1]
+
+
+class WorkerHandle:
+    """Front-end view of one worker process."""
+
+    def __init__(self, worker_id: int, ctx: Any):
+        self.worker_id = worker_id
+        self.requests = ctx.Queue()
+        self.responses = ctx.Queue()
+        self.process = ctx.Process(
+            target=_worker_main, args=(worker_id, self.requests, self.responses),
+            name=f"inference-worker-{worker_id}", daemon=True,
+        )
+        self.healthy = True
+        self.last_pong: Optional[float] = None
+        self.pool: Dict[str, Any] = {}
+        self.routed_keys: Set[str] = set()  # routing keys sent to this process since it started
+        self.restarts = 0
+
+
+class WorkerRouter:
+    """Routes chat requests to inference worker processes.
+
+    Requests go to the worker owning the model on a consistent hash ring, so each
+    model is loaded by one worker instead of all of them; a session keeps going to
+    the worker that served its previous turn on the same model, until the session is
+    idle for ``WORKER_SESSION_TTL`` or pushed out of the ``WORKER_MAX_SESSIONS`` LRU.
+    A health loop pings the workers, takes unresponsive ones out of the ring and
+    restarts dead ones; after a rebalance, workers unload the models they no longer own.
+    """
+
+    def __init__(self, num_workers: int = InferenceConfig.WORKERS):
+        self.num_workers = num_workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers: Dict[int, WorkerHandle] = {}
+        self._ring = HashRing()
+        # session id -> (worker id, model key, last used), least recently used first
+        self._sessions: "OrderedDict[str, Tuple[int, str, float]]" = OrderedDict()
+        self._pending: Dict[str, Tuple[int, asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.num_workers > 0
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+        self._rebalance()
+        self._health_task = asyncio.create_task(self._health_loop())
+        logger.info(f"Started {self.num_workers} inference worker processes")
+
+    async def stop(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for worker in self._workers.values():
+            worker.requests.put({"op": "shutdown"})
+        for worker in self._workers.values():
+            await asyncio.to_thread(worker.process.join, 10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.responses.put(None)  # stop the reader thread
+        self._workers.clear()
+
+    def _spawn(self, worker_id: int) -> None:
+        worker = WorkerHandle(worker_id, self._ctx)
+        if worker_id in self._workers:
+            worker.restarts = self._workers[worker_id].restarts + 1
+        worker.process.start()
+        self._workers[worker_id] = worker
+        threading.Thread(target=self._read_responses, args=(worker,), daemon=True).start()
+
+    def _read_responses(self, worker: WorkerHandle) -> None:
+        while True:
+            try:
+                message = worker.responses.get()
+            except (EOFError, OSError):
+                return
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self._dispatch, worker, message)
+
+    def _dispatch(self, worker: WorkerHandle, message: Dict[str, Any]) -> None:
+        if message["type"] == "pong":
+            worker.last_pong = time.monotonic()
+            worker.pool = message.get("pool", {})
+        pending = self._pending.get(message["id"])
+        if pending is not None:
+            pending[1].put_nowait(message)
+
+    def _rebalance(self) -> None:
+        self._ring.rebuild([wid for wid, w in self._workers.items() if w.healthy and w.process.is_alive()])
+        self._unload_moved()
+
+    def _unload_moved(self) -> None:
+        """Tell healthy workers to unload the models of routing keys whose ring owner is now another worker.
+
+        The comparison uses the keys requests were routed by (the front end's unresolved
+        model arguments), not the worker's pool keys, which are resolved after ``auto``
+        and include draft models.
+        """
+        for worker_id, worker in self._workers.items():
+            if not worker.healthy or not worker.process.is_alive():
+                continue
+            for model_key in list(worker.routed_keys):
+                if self._ring.lookup(model_key) in (worker_id, None):
+                    continue
+                worker.requests.put({"op": "unload", "model_key": model_key})
+                worker.routed_keys.discard(model_key)
+                # Sessions pinned to the old copy follow the model to its new owner
+                for session_id, (owner, session_model, _) in list(self._sessions.items()):
+                    if owner == worker_id and session_model == model_key:
+                        del self._sessions[session_id]
+
+    def _expire_sessions(self, now: float) -> None:
+        while self._sessions:
+            session_id, (_, _, last_used) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= InferenceConfig.WORKER_MAX_SESSIONS \
+                    and now - last_used < InferenceConfig.WORKER_SESSION_TTL:
+                break
+            del self._sessions[session_id]
+
+    def route(self, model_key: str, session_id: Optional[str] = None) -> int:
+        """Pick the worker for a request: session affinity first, then the model's ring owner."""
+        now = time.monotonic()
+        self._expire_sessions(now)
+        if session_id is not None and session_id in self._sessions:
+            worker_id, session_model, _ = self._sessions[session_id]
+            worker = self._workers.get(worker_id)
+            if session_model == model_key and worker is not None and worker.healthy:
+                self._sessions[session_id] = (worker_id, model_key, now)
+                self._sessions.move_to_end(session_id)
+                worker.routed_keys.add(model_key)
+                return worker_id
+        worker_id = self._ring.lookup(model_key)
+        if worker_id is None:
+            raise RuntimeError("No healthy inference worker available")
+        if session_id is not None:
+            self._sessions[session_id] = (worker_id, model_key, now)
+            self._sessions.move_to_end(session_id)
+            self._expire_sessions(now)
+        self._workers[worker_id].routed_keys.add(model_key)
+        return worker_id
+
+    async def _ping(self, worker: WorkerHandle, timeout: float) -> bool:
+        ping_id = uuid.uuid4().hex
+        queue: asyncio.Queue = asyncio.Queue()
+        self._pending[ping_id] = (worker.worker_id, queue)
+        try:
+            worker.requests.put({"op": "ping", "id": ping_id})
+            await asyncio.wait_for(queue.get(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._pending.pop(ping_id, None)
+
+    async def _health_loop(self, interval: float = InferenceConfig.WORKER_HEALTH_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            changed = False
+            for worker_id, worker in list(self._workers.items()):
+                if not worker.process.is_alive():
+                    logger.error(f"Inference worker {worker_id} died (exit code {worker.process.exitcode}), restarting")
+                    self._fail_pending(worker_id, "Inference worker died")
+                    worker.responses.put(None)
+                    self._spawn(worker_id)
+                    changed = True
+                    continue
+                healthy = await self._ping(worker, timeout=interval)
+                if healthy != worker.healthy:
+                    logger.warning(f"Inference worker {worker_id} is {'healthy' if healthy else 'unresponsive'}")
+                    worker.healthy = healthy
+                    changed = True
+            if changed:
+                self._rebalance()
+
+    def _fail_pending(self, worker_id: int, error: str) -> None:
+        for request_id, (owner, queue) in list(self._pending.items()):
+            if owner == worker_id:
+                queue.put_nowait({"id": request_id, "type": "error", "error": error})
+
+    async def stream_chat(self, model_args: Dict[str, Any], model_key: str, messages: List[Dict[str, str]],
+                          control: GenerationControl, request: Optional[Request] = None,
+                          session_id: Optional[str] = None, draft_args: Optional[Dict[str, Any]] = None,
+                          **gen_kwargs) -> AsyncGenerator[str, None]:
+        """Stream a chat completion from the worker that owns the model.
+
+        Mirrors :func:`app.services.inference.streaming.stream_chat`: disconnects,
+        deadlines and early exits send a cancel to the worker so the sequence stops there.
+        """
+        worker = self._workers[self.route(model_key, session_id)]
+        request_id = uuid.uuid4().hex
+        queue: asyncio.Queue = asyncio.Queue()
+        self._pending[request_id] = (worker.worker_id, queue)
+        remaining = control.deadline - time.monotonic() if control.deadline is not None else None
+        worker.requests.put({
+            "op": "chat", "id": request_id, "model_args": model_args, "model_key": model_key, "messages": messages,
+            "gen_kwargs": gen_kwargs, "timeout": remaining, "max_new_tokens": control.max_new_tokens,
+            "draft_args": draft_args,
+        })
+        control.generate_started = time.perf_counter()
+        watcher = asyncio.create_task(watch_disconnect(request, control)) if request is not None else None
+        finished = False
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), InferenceConfig.DISCONNECT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    if control.should_stop():
+                        break
+                    continue
+                if message["type"] == "chunk":
+                    control.tokens += 1
+                    control.token_times.append(time.perf_counter())
+                    yield message["text"]
+                elif message["type"] == "done":
+                    control.tokens = message.get("tokens", control.tokens)
+                    control.prompt_tokens = message.get("prompt_tokens")
+                    control.speculative = message.get("speculative")
+                    finished = True
+                    break
+                else:
+                    finished = True
+                    raise RuntimeError(message.get("error", "Inference worker error"))
+                if control.should_stop():
+                    break
+        except (asyncio.CancelledError, GeneratorExit):
+            control.cancel("disconnected")
+            raise
+        finally:
+            if not finished:
+                worker.requests.put({"op": "cancel", "id": request_id})
+            self._pending.pop(request_id, None)
+            if watcher is not None:
+                watcher.cancel()
+
+    async def generate_batch(self, model_args: Dict[str, Any], model_key: str,
+                             batch_messages: List[List[Dict[str, str]]], control: GenerationControl,
+                             request: Optional[Request] = None, **gen_kwargs) -> List[Dict[str, Any]]:
+        """Run a batched generation on the worker that owns the model.
+
+        Mirrors :func:`app.services.inference.batching.generate_batch`: on disconnect or
+        deadline the worker is told to cancel and returns what the batch generated so far.
+        """
+        worker = self._workers[self.route(model_key)]
+        request_id = uuid.uuid4().hex
+        queue: asyncio.Queue = asyncio.Queue()
+        self._pending[request_id] = (worker.worker_id, queue)
+        remaining = control.deadline - time.monotonic() if control.deadline is not None else None
+        worker.requests.put({
+            "op": "batch", "id": request_id, "model_args": model_args, "model_key": model_key,
+            "batch_messages": batch_messages,
+            "gen_kwargs": gen_kwargs, "timeout": remaining, "max_new_tokens": control.max_new_tokens,
+        })
+        control.generate_started = time.perf_counter()
+        watcher = asyncio.create_task(watch_disconnect(request, control)) if request is not None else None
+        finished = cancel_sent = False
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), InferenceConfig.DISCONNECT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    if not cancel_sent and control.should_stop():
+                        worker.requests.put({"op": "cancel", "id": request_id})
+                        cancel_sent = True
+                    continue
+                finished = True
+                if message["type"] != "result":
+                    raise RuntimeError(message.get("error", "Inference worker error"))
+                if message.get("stop_reason"):
+                    control.cancel(message["stop_reason"])
+                return message["results"]
+        except asyncio.CancelledError:
+            control.cancel("disconnected")
+            raise
+        finally:
+            if not finished:
+                worker.requests.put({"op": "cancel", "id": request_id})
+            self._pending.pop(request_id, None)
+            if watcher is not None:
+                watcher.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": [
+                {
+                    "worker_id": worker_id,
+                    "pid": worker.process.pid,
+                    "alive": worker.process.is_alive(),
+                    "healthy": worker.healthy,
+                    "restarts": worker.restarts,
+                    "last_pong": worker.last_pong,
+                    "pool": worker.pool,
+                    "inflight": sum(1 for owner, _ in self._pending.values() if owner == worker_id),
+                }
+                for worker_id, worker in self._workers.items()
+            ],
+            "sessions": len(self._sessions),
+        }
+
+
+worker_router = WorkerRouter()
@@ -0,0 +1,220 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PATTERN = re.compile(r"^checkpoint-(\d+)$")
+# The trainer writes trainer_state.json after weights, optimizer and scheduler
+CHECKPOINT_COMPLETE_MARKER = "trainer_state.json"
+TIMELINE_FILE = "checkpoint_evals.jsonl"
+# Training arguments the checkpoint evaluation inherits
+INHERITED_KEYS = ("template", "cutoff_len", "trust_remote_code", "dataset_dir")
+
+
+def find_checkpoints(output_dir: str) -> List[Tuple[int, str]]:
+    """Fully written ``checkpoint-<step>`` directories under ``output_dir``, by step."""
+    if not os.path.isdir(output_dir):
+        return []
+    checkpoints = []
+    for name in os.listdir(output_dir):
+        match = CHECKPOINT_PATTERN.match(name)
+        path = os.path.join(output_dir, name)
+        if match and os.path.isfile(os.path.join(path, CHECKPOINT_COMPLETE_MARKER)):
+            checkpoints.append((int(match.group(1)), path))
+    return sorted(checkpoints)
+
+
+def _model_args(checkpoint: str, train_params: Dict[str, Any]) -> Dict[str, Any]:
+    """Base model plus the checkpoint as adapter for LoRA, the checkpoint itself otherwise."""
+    finetuning_type = train_params.get("finetuning_type", "lora")
+    if finetuning_type == "lora":
+        return {"model_name_or_path": train_params["model_name_or_path"], "adapter_name_or_path": checkpoint,
+                "finetuning_type": finetuning_type}
+    return {"model_name_or_path": checkpoint, "finetuning_type": finetuning_type}
+
+
+def evaluate_checkpoint(checkpoint: str, config: Dict[str, Any], train_params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Evaluate one checkpoint on the configured benchmark task or eval dataset.
+
+    Returns:
+        Dict with the selection ``score`` (``config["metric"]``, default the benchmark
+        ``Average`` or ``eval_rouge-l``) and all ``metrics``
+    """
+    model_args = _model_args(checkpoint, train_params)
+    if config.get("task"):
+        from app.services.evaluate.benchmark_evaluation import _run_benchmark
+
+        params = {
+            **model_args,
+            "task": config["task"],
+            "task_dir": config.get("task_dir", "evaluation"),
+            "template": config.get("template", "fewshot"),
+            "n_shot": config.get("n_shot", 5),
+            "lang": config.get("lang", "en"),
+            "batch_size": config.get("batch_size", 4),
+            "trust_remote_code": train_params.get("trust_remote_code", True),
+            "num_workers": 1,
+        }
+        summary = _run_benchmark(params)
+        return {"score": summary["scores"].get(config.get("metric") or "Average"), "metrics": summary["scores"]}
+
+    from app.services.evaluate.generation_evaluation import run_generation_evaluation
+
+    args = {
+        **{k: train_params[k] for k in INHERITED_KEYS if k in train_params},
+        **model_args,
+        "stage": "sft",
+        "do_eval": True,
+        "predict_with_generate": True,
+        "eval_dataset": config["eval_dataset"],
+        "dataset_dir": config.get("dataset_details") or train_params.get("dataset_dir"),
+        "max_samples": config.get("max_samples"),
+        "per_device_eval_batch_size": config.get("batch_size", 8),
+        "max_new_tokens": config.get("max_new_tokens", 512),
+        "output_dir": os.path.join(checkpoint, "eval"),
+    }
+    if config.get("template"):
+        args["template"] = config["template"]
+    metrics = run_generation_evaluation({k: v for k, v in args.items() if v is not None}, resume=False)
+    return {"score": (metrics or {}).get(config.get("metric") or "eval_rouge-l"), "metrics": metrics}
+
+
+def _prune(output_dir: str, records: List[Dict[str, Any]], keep_best_k: int, greater_is_better: bool,
+           protected: Optional[str] = None) -> List[str]:
+    """Delete evaluated checkpoints outside the best ``keep_best_k``; unscored ones and ``protected`` are kept."""
+    scored = [r for r in records
+              if r.get("score") is not None and r["checkpoint"] != protected and os.path.isdir(r["checkpoint"])]
+    ranked = sorted(scored, key=lambda r: r["score"], reverse=greater_is_better)
+    removed = []
+    for record in ranked[keep_best_k:]:
+        shutil.rmtree(record["checkpoint"], ignore_errors=True)
+        removed.append(record["checkpoint"])
+    if removed:
+        logger.info(f"Removed {len(removed)} checkpoints outside the best {keep_best_k} in {output_dir}")
+    return removed
+
+
+def _sidecar_main(output_dir: str, config: Dict[str, Any], train_params: Dict[str, Any],
+                  results: multiprocessing.Queue, stop: multiprocessing.Event) -> None:
+    """Sidecar process: evaluate each new checkpoint until training stops, then the remaining ones."""
+    if config.get("device") is not None:
+        # Before anything imports torch
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(config["device"])
+    try:
+        os.nice(config.get("nice", 10))
+    except (AttributeError, OSError):
+        pass
+
+    timeline_path = os.path.join(output_dir, TIMELINE_FILE)
+    records: List[Dict[str, Any]] = []
+    evaluated = set()
+    while True:
+        stopping = stop.is_set()
+        for step, checkpoint in find_checkpoints(output_dir):
+            if step in evaluated:
+                continue
+            evaluated.add(step)
+            start = time.perf_counter()
+            record = {"step": step, "checkpoint": checkpoint, "evaluated_at": time.time()}
+            try:
+                record.update(evaluate_checkpoint(checkpoint, config, train_params))
+            except Exception as e:
+                logger.warning(f"Sidecar evaluation of {checkpoint} failed: {str(e)}")
+                record.update({"score": None, "error": str(e)})
+            record["seconds"] = time.perf_counter() - start
+            records.append(record)
+            with open(timeline_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            # While training runs, the newest checkpoint is what resume_from_checkpoint needs,
+            # and the trainer's own save_total_limit rotation must not race with ours
+            if config.get("keep_best_k") and not stopping and not train_params.get("save_total_limit"):
+                checkpoints = find_checkpoints(output_dir)
+                record["removed"] = _prune(output_dir, records, config["keep_best_k"],
+                                           config.get("greater_is_better", True),
+                                           protected=checkpoints[-1][1] if checkpoints else checkpoint)
+            results.put(record)
+        if stopping:
+            if config.get("keep_best_k"):
+                # Training is over: the latest checkpoint competes like the others
+                _prune(output_dir, records, config["keep_best_k"], config.get("greater_is_better", True))
+            break
+        stop.wait(config.get("poll_interval", 30))
+
+
+class CheckpointSidecar:
+    """Evaluates checkpoints in a separate, lower-priority process while training runs.
+
+    The sidecar polls ``output_dir`` for completed ``checkpoint-<step>`` directories
+    and scores each one on a benchmark ``task`` or an ``eval_dataset``; every result
+    is appended to ``checkpoint_evals.jsonl`` and handed to ``on_result`` (from a
+    reader thread) so it can join the job's metrics timeline. With ``keep_best_k``
+    only the best scored checkpoints stay on disk; while training runs the newest
+    checkpoint is never removed, and with ``save_total_limit`` pruning waits for
+    the end of training so it does not race with the trainer's rotation. :meth:`stop` lets the sidecar
+    evaluate what training wrote last before it exits.
+    """
+
+    def __init__(self, output_dir: str, config: Dict[str, Any], train_params: Dict[str, Any],
+                 on_result: Optional[Callable[[Dict[str, Any]], None]] = None):
+        if not config.get("task") and not config.get("eval_dataset"):
+            raise ValueError("Checkpoint evaluation needs a benchmark `task` or an `eval_dataset`")
+        self.output_dir = output_dir
+        self.config = config
+        self.train_params = train_params
+        self.on_result = on_result
+        self.timeline: List[Dict[str, Any]] = []
+        # spawn: the sidecar may pick its own GPU and must not inherit the trainer's CUDA state
+        context = multiprocessing.get_context("spawn")
+        self._results = context.Queue()
+        self._stop = context.Event()
+        self._process = context.Process(target=_sidecar_main, daemon=True,
+                                        args=(output_dir, config, train_params, self._results, self._stop))
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._started = False
+
+    def start(self) -> None:
+        self._process.start()
+        self._started = True
+        self._reader.start()
+        logger.info(f"Checkpoint evaluation sidecar watching {self.output_dir} (pid {self._process.pid})")
+
+    def _read_results(self) -> None:
+        while self._process.is_alive() or not self._results.empty():
+            try:
+                record = self._results.get(timeout=1)
+            except queue.Empty:
+                continue
+            self.timeline.append(record)
+            if self.on_result is not None:
+                self.on_result(record)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Signal the end of training and wait for the final checkpoint evaluations (idempotent)."""
+        if not self._started:
+            return
+        self._started = False
+        self._stop.set()
+        self._process.join(timeout)
+        if self._process.is_alive():
+            logger.warning("Checkpoint evaluation sidecar did not finish in time, terminating it")
+            self._process.terminate()
+        self._reader.join()
+
+    def summary(self) -> Dict[str, Any]:
+        greater_is_better = self.config.get("greater_is_better", True)
+        scored = [r for r in self.timeline if r.get("score") is not None]
+        best = (max if greater_is_better else min)(scored, key=lambda r: r["score"]) if scored else None
+        return {
+            "checkpoint_evals": self.timeline,
+            "best_checkpoint": best["checkpoint"] if best else None,
+            "best_score": best["score"] if best else None,
+        }
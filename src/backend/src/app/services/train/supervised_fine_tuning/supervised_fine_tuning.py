@@ -1,9 +1,10 @@
 import os
-from typing import Optional, Any, Dict, List
+from typing import Optional, Any, Callable, Dict, List
 import logging
 import json
 
 from app.util.util import is_ray_available
+from app.services.train.checkpoint_sidecar import CheckpointSidecar
 from llamafactory.train.callbacks import TrainerCallback
 from llamafactory.hparams import get_ray_args, get_train_args, read_args
 from llamafactory.train.trainer_utils import get_ray_trainer
@@ -18,13 +19,18 @@ if is_ray_available():
 
 logger = logging.getLogger(__name__)
 
-async def run_training_job(job_id: str, train_args: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+async def run_training_job(job_id: str, train_args: Optional[Dict[str, Any]] = None,
+                           runner: Optional[Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]] = None,
+                           on_checkpoint_eval: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
     """
     Run a training job with the specified parameters.
     
     Args:
         job_id: Unique identifier for the training job
         train_args: Dictionary of training arguments
+        runner: Runs the prepared arguments instead of the LlamaFactory workflow and may
+            return metrics (used by generation evaluation)
+        on_checkpoint_eval: Receives each sidecar checkpoint evaluation (``checkpoint_eval`` set)
         
     Returns:
         Dict containing job status information
@@ -33,6 +39,8 @@ async def run_training_job(job_id: str, train_args: Optional[Dict[str, Any]] = N
     train_args = _prepare_training_arguments(train_args or {})
     
     result = {"status": "success", "job_id": job_id}
+    checkpoint_eval = train_args.pop("checkpoint_eval", None)
+    sidecar = None
     
     try:
         # Extract and process dataset information
@@ -52,12 +60,22 @@ async def run_training_job(job_id: str, train_args: Optional[Dict[str, Any]] = N
         if train_args['stage'] == 'rlhf':
             train_args['stage'] = 'ppo'
 
+        if checkpoint_eval:
+            sidecar = CheckpointSidecar(train_args["output_dir"], checkpoint_eval, train_args,
+                                        on_result=on_checkpoint_eval)
+            sidecar.start()
+
         # Run the training
         logger.info(f"Starting training job {job_id}")
-        _run_training(train_args)
+        metrics = (runner or _run_training)(train_args)
         logger.info(f"Finished training job {job_id}")
         
         result["message"] = "Training completed successfully"
+        if metrics:
+            result["metrics"] = metrics
+        if sidecar is not None:
+            sidecar.stop()
+            result.setdefault("metrics", {}).update(sidecar.summary())
         return result
         
     except Exception as e:
@@ -67,6 +85,9 @@ async def run_training_job(job_id: str, train_args: Optional[Dict[str, Any]] = N
         result["status"] = "error"
         result["message"] = str(e)
         return result
+    finally:
+        if sidecar is not None:
+            sidecar.stop()
 
 def get_task_category(config: dict) -> str:
     """
@@ -146,5 +167,6 @@ def _run_training(args: Dict[str, Any], callbacks: Optional[List[TrainerCallback
 
 
 # Update the alias for backward compatibility
-async def simulate_training(job_id: str, train_args: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    return await run_training_job(job_id, train_args)
\ No newline at end of file
+async def simulate_training(job_id: str, train_args: Optional[Dict[str, Any]] = None,
+                            on_checkpoint_eval: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    return await run_training_job(job_id, train_args, on_checkpoint_eval=on_checkpoint_eval)
\ No newline at end of file
@@ -4,6 +4,8 @@ import asyncio
 from fastapi import FastAPI
 
 from app.util.util import torch_gc
+from app.services.inference.workers import worker_router
+from app.services.inference.warmup import preload_and_warm_up
 class APIConfig:
     """Configuration settings for the API server."""
     MEMORY_CLEANUP_INTERVAL = int(os.getenv("MEMORY_CLEANUP_INTERVAL", "300"))  # seconds
@@ -33,11 +35,24 @@ async def lifespan(app: FastAPI):
     # Create task for memory cleanup
     print("API server starting up...")
     cleanup_task = asyncio.create_task(sweeper())
+    if worker_router.enabled:
+        await worker_router.start()
+    # Runs in the background so the liveness probe answers while models load;
+    # /v1/health/ready stays 503 until it finishes
+    warmup_task = asyncio.create_task(preload_and_warm_up())
 
     try:
         yield
     finally:
         print("API server shutting down...")
+        if not warmup_task.done():
+            warmup_task.cancel()
+            try:
+                await warmup_task
+            except asyncio.CancelledError:
+                print("Model warm-up task cancelled")
+        if worker_router.enabled:
+            await worker_router.stop()
 
         # Cancel the cleanup task when shutting down
         cleanup_task.cancel()
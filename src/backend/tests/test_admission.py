@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from app.services.inference.admission import AdmissionController, AdmissionRejected
+
+
+def _controller(max_concurrent=1, interactive=1, bulk=1, max_wait=5.0):
+    return AdmissionController(max_concurrent=max_concurrent,
+                               queue_limits={"interactive": interactive, "bulk": bulk}, max_wait=max_wait)
+
+
+def test_free_slot_is_granted_immediately():
+    async def run():
+        controller = _controller(max_concurrent=2)
+        first = await controller.admit("m")
+        second = await controller.admit("m")
+        assert first.wait_time == second.wait_time == 0.0
+        assert controller.stats()["m"]["active"] == 2
+        first.release()
+        first.release()  # idempotent
+        assert controller.stats()["m"]["active"] == 1
+
+    asyncio.run(run())
+
+
+def test_interactive_lane_is_served_before_bulk():
+    async def run():
+        controller = _controller(interactive=2, bulk=2)
+        holder = await controller.admit("m")
+        order = []
+
+        async def wait(lane, name):
+            ticket = await controller.admit("m", lane=lane)
+            order.append(name)
+            ticket.release()
+
+        bulk = asyncio.create_task(wait("bulk", "bulk"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(wait("interactive", "interactive"))
+        await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(bulk, interactive)
+        assert order == ["interactive", "bulk"]
+
+    asyncio.run(run())
+
+
+def test_full_lane_is_rejected_with_429():
+    async def run():
+        controller = _controller(interactive=1)
+        holder = await controller.admit("m")
+        queued = asyncio.create_task(controller.admit("m"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("m")
+        assert rejected.value.status_code == 429
+        assert rejected.value.retry_after >= 1
+        # An unbounded (background) request still queues on the other lane
+        background = asyncio.create_task(controller.admit("m", lane="bulk", bounded=False))
+        await asyncio.sleep(0)
+        assert controller.stats()["m"]["queued"] == {"interactive": 1, "bulk": 1}
+        holder.release()
+        (await queued).release()
+        (await background).release()
+        assert controller.stats()["m"]["rejected"] == 1
+
+    asyncio.run(run())
+
+
+def test_wait_timeout_is_rejected_with_503():
+    async def run():
+        controller = _controller(max_wait=0.01)
+        holder = await controller.admit("m")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("m")
+        assert rejected.value.status_code == 503
+        holder.release()
+        assert controller.stats()["m"]["active"] == 0
+        assert controller.stats()["m"]["queued"]["interactive"] == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def run():
+        controller = _controller()
+        holder = await controller.admit("m")
+        waiter = asyncio.create_task(controller.admit("m"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        holder.release()
+        assert controller.stats()["m"]["active"] == 0
+        (await controller.admit("m")).release()
+
+    asyncio.run(run())
+
+
+def test_models_have_separate_limits_scaled_by_capacity_factor():
+    async def run():
+        controller = _controller(max_concurrent=2)
+        tickets = [await controller.admit("big", capacity_factor=2.0) for _ in range(4)]
+        assert controller.stats()["big"]["max_concurrent"] == 4
+        other = await controller.admit("small", capacity_factor=0.1)
+        assert controller.stats()["small"]["max_concurrent"] == 1
+        for ticket in [*tickets, other]:
+            ticket.release()
+
+    asyncio.run(run())
+
+
+def test_unknown_lane_is_an_error():
+    with pytest.raises(ValueError):
+        asyncio.run(_controller().admit("m", lane="batch"))
@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip("datasets")
+pytest.importorskip("torch")
+pytest.importorskip("llamafactory")
+
+import numpy as np  # noqa: E402
+
+from app.services.evaluate.benchmark_evaluation import plan_shards  # noqa: E402
+from app.services.evaluate.benchmark_evaluator import merge_units, subject_result  # noqa: E402
+
+COUNTS = {"algebra": 11, "law": 97, "biology": 30, "history": 1}
+CATEGORYS = {
+    "algebra": {"category": "STEM"},
+    "law": {"category": "Humanities"},
+    "biology": {"category": "STEM"},
+    "history": {"category": "Humanities"},
+}
+
+
+def _evaluate(subject, start, end):
+    """Deterministic stand-in for a model answering questions ``start:end`` of a subject."""
+    labels = ["ABCD"[(len(subject) + i) % 4] for i in range(start, end)]
+    outputs = [label if (i * 7 + len(subject)) % 3 else "A" for i, label in zip(range(start, end), labels)]
+    return {"subject": subject, "start": start, "outputs": outputs, "labels": labels}
+
+
+@pytest.mark.parametrize("num_workers", [1, 2, 3, 8])
+def test_shards_cover_every_question_once_and_balance_load(num_workers):
+    shards = plan_shards(COUNTS, num_workers)
+    assert len(shards) <= num_workers
+    for subject, count in COUNTS.items():
+        covered = sorted((u["start"], u["end"]) for shard in shards for u in shard if u["subject"] == subject)
+        assert covered[0][0] == 0 and covered[-1][1] == count
+        assert all(prev[1] == nxt[0] for prev, nxt in zip(covered, covered[1:]))
+
+    loads = [sum(u["end"] - u["start"] for u in shard) for shard in shards]
+    share = -(-sum(COUNTS.values()) // num_workers)
+    assert max(loads) <= 2 * share
+
+
+def test_single_subject_spreads_over_all_workers():
+    assert len(plan_shards({"law": 100}, 4)) == 4
+
+
+@pytest.mark.parametrize("num_workers", [2, 3, 8])
+def test_sharded_results_equal_a_serial_run(num_workers):
+    serial = [_evaluate(subject, 0, count) for subject, count in COUNTS.items()]
+    units = [_evaluate(u["subject"], u["start"], u["end"])
+             for shard in reversed(plan_shards(COUNTS, num_workers)) for u in shard]
+
+    serial_corrects, serial_results = merge_units(CATEGORYS, serial)
+    sharded_corrects, sharded_results = merge_units(CATEGORYS, units)
+    assert sharded_results == serial_results
+    assert list(sharded_results) == list(CATEGORYS)
+    assert serial_corrects.keys() == sharded_corrects.keys()
+    for category in serial_corrects:
+        np.testing.assert_array_equal(sharded_corrects[category], serial_corrects[category])
+
+    for subject in COUNTS:
+        joined = subject_result([unit for unit in units if unit["subject"] == subject])
+        expected = next(unit for unit in serial if unit["subject"] == subject)
+        assert joined["outputs"] == expected["outputs"] and joined["labels"] == expected["labels"]
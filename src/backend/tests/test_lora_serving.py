@@ -0,0 +1,48 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+peft = pytest.importorskip("peft")
+pytest.importorskip("llamafactory")
+
+from transformers import AutoModelForCausalLM  # noqa: E402
+
+from app.services.inference.lora_serving import SharedBase  # noqa: E402
+from app.services.inference.model_loader import load_chat_model  # noqa: E402
+
+
+@pytest.fixture
+def adapter(tiny_llama, tmp_path):
+    """A LoRA adapter with non-zero weights, so merging it changes the logits."""
+    torch.manual_seed(1)
+    config = peft.LoraConfig(r=4, lora_alpha=8, target_modules=["q_proj", "v_proj"], init_lora_weights=False)
+    model = peft.get_peft_model(AutoModelForCausalLM.from_pretrained(tiny_llama), config)
+    model.save_pretrained(tmp_path / "adapter")
+    return str(tmp_path / "adapter")
+
+
+def _logits(model, input_ids):
+    with torch.inference_mode():
+        return model(input_ids=input_ids).logits.float().clone()
+
+
+def test_merge_and_unmerge_on_loaded_base_restores_logits(tiny_llama, adapter):
+    chat_model, stats = load_chat_model(
+        {"model_name_or_path": tiny_llama, "template": "empty", "infer_backend": "huggingface"}, writable=True
+    )
+    assert not stats["mmap"]
+
+    model = chat_model.engine.model
+    input_ids = torch.tensor([[1, 3, 4, 5, 6]], device=model.device)
+    baseline = _logits(model, input_ids)
+
+    shared = SharedBase(chat_model)
+    shared.load_adapter(adapter)
+    shared.merge(adapter)
+    merged = _logits(model, input_ids)
+    assert not torch.allclose(merged, baseline, atol=1e-4)
+
+    shared.unmerge()
+    # The adapter applied unmerged matches the merged weights, and without it the base is untouched
+    torch.testing.assert_close(_logits(model, input_ids), merged, atol=1e-4, rtol=1e-4)
+    with shared.peft_model.disable_adapter():
+        torch.testing.assert_close(_logits(model, input_ids), baseline, atol=1e-4, rtol=1e-4)
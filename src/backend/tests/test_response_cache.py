@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from app.services.inference.response_cache import ResponseCache, is_deterministic
+
+
+def test_is_deterministic():
+    assert is_deterministic({"do_sample": False})
+    assert is_deterministic({"temperature": 0})
+    assert not is_deterministic({"temperature": 0.7})
+    assert not is_deterministic({})
+
+
+def test_make_key_covers_model_messages_and_generation():
+    messages = [{"role": "user", "content": "hi"}]
+    key = ResponseCache.make_key({"model": "a"}, messages, {"temperature": 0})
+    assert key == ResponseCache.make_key({"model": "a"}, list(messages), {"temperature": 0})
+    assert key != ResponseCache.make_key({"model": "b"}, messages, {"temperature": 0})
+    assert key != ResponseCache.make_key({"model": "a"}, [{"role": "user", "content": "ho"}], {"temperature": 0})
+    assert key != ResponseCache.make_key({"model": "a"}, messages, {"temperature": 0, "max_new_tokens": 8})
+
+
+def test_concurrent_identical_requests_generate_once():
+    async def run():
+        cache = ResponseCache(max_entries=8, ttl=0)
+        release = asyncio.Event()
+        calls = 0
+
+        async def generate():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return {"text": "hello"}
+
+        tasks = [asyncio.create_task(cache.get_or_generate("k", generate)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        assert calls == 1
+        assert [value for value, _ in results] == [{"text": "hello"}] * 3
+        assert sorted(cached for _, cached in results) == [False, True, True]
+        assert cache.stats()["coalesced"] == 2
+        assert cache.stats()["inflight"] == 0
+        assert await cache.get_or_generate("k", generate) == ({"text": "hello"}, True)
+        assert calls == 1
+
+    asyncio.run(run())
+
+
+def test_failed_leader_releases_waiters_to_generate_themselves():
+    async def run():
+        cache = ResponseCache(max_entries=8, ttl=0)
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError("boom")
+
+        async def succeeding():
+            return {"text": "retry"}
+
+        leader = asyncio.create_task(cache.get_or_generate("k", failing))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_generate("k", succeeding))
+        await asyncio.sleep(0)
+        release.set()
+
+        with pytest.raises(RuntimeError):
+            await leader
+        assert await follower == ({"text": "retry"}, False)
+        assert cache.stats()["coalesced"] == 0
+
+    asyncio.run(run())
+
+
+def test_uncacheable_result_is_not_shared():
+    async def run():
+        cache = ResponseCache(max_entries=8, ttl=0)
+        release = asyncio.Event()
+
+        async def truncated():
+            await release.wait()
+            return {"text": "cut", "cacheable": False}
+
+        leader = asyncio.create_task(cache.get_or_generate("k", truncated))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_generate("k", truncated))
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await leader == ({"text": "cut"}, False)
+        # The follower was released without a value and generated on its own
+        assert await follower == ({"text": "cut"}, False)
+        assert cache.get("k") is None
+
+    asyncio.run(run())
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2, ttl=0)
+    cache.put("a", {"text": "a"})
+    cache.put("b", {"text": "b"})
+    cache.get("a")
+    cache.put("c", {"text": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"text": "a"}
+    assert cache.get("c") == {"text": "c"}
@@ -0,0 +1,75 @@
+import pytest
+
+from app.services.evaluate.result_store import BenchmarkResultStore
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+@pytest.fixture
+def setup(tmp_path):
+    _write(tmp_path / "model" / "model.safetensors", "weights")
+    _write(tmp_path / "model" / "config.json", "{}")
+    _write(tmp_path / "adapter" / "adapter_model.safetensors", "lora")
+    _write(tmp_path / "tasks" / "mmlu" / "mmlu.py", "data")
+    params = {
+        "model_name_or_path": str(tmp_path / "model"),
+        "adapter_name_or_path": str(tmp_path / "adapter"),
+        "finetuning_type": "lora",
+        "task": "mmlu_test",
+        "task_dir": str(tmp_path / "tasks"),
+        "template": "default",
+        "n_shot": 5,
+        "lang": "en",
+        "seed": 42,
+    }
+    return BenchmarkResultStore(str(tmp_path / "store")), params, tmp_path
+
+
+@pytest.mark.parametrize("field, value", [
+    ("model_name_or_path", "org/other-model"),
+    ("adapter_name_or_path", None),
+    ("finetuning_type", "full"),
+    ("task", "mmlu_validation"),
+    ("template", "llama3"),
+    ("n_shot", 0),
+    ("lang", "zh"),
+    ("seed", 7),
+])
+def test_key_changes_with_each_identity_field(setup, field, value):
+    store, params, _ = setup
+    assert store.make_key({**params, field: value}) != store.make_key(params)
+
+
+def test_key_changes_with_few_shot_and_scoring_mode(setup):
+    store, params, _ = setup
+    key = store.make_key(params)
+    assert store.make_key(params, reuse_prefix=True) != key
+    assert store.make_key(params, scoring="choice_logprob") != key
+    assert store.make_key(dict(params)) == key
+
+
+@pytest.mark.parametrize("path", ["model/model.safetensors", "model/config.json",
+                                  "adapter/adapter_model.safetensors", "tasks/mmlu/mmlu.py"])
+def test_key_changes_when_weights_config_or_data_change(setup, path):
+    store, params, root = setup
+    key = store.make_key(params)
+    _write(root / path, "changed content")
+    assert store.make_key(params) != key
+
+
+def test_trainer_state_does_not_change_the_key(setup):
+    store, params, root = setup
+    key = store.make_key(params)
+    _write(root / "adapter" / "trainer_state.json", '{"global_step": 10}')
+    _write(root / "adapter" / "optimizer.pt", "state")
+    assert store.make_key(params) == key
+
+
+def test_results_round_trip(setup):
+    store, params, _ = setup
+    key = store.make_key(params)
+    store.put(key, "algebra", {"outputs": ["A"]})
+    assert store.get_many(key, ["algebra", "law"]) == {"algebra": {"outputs": ["A"]}}
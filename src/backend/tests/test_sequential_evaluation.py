@@ -0,0 +1,87 @@
+import math
+from collections import Counter
+from statistics import NormalDist
+
+import pytest
+
+pytest.importorskip("datasets")
+pytest.importorskip("torch")
+pytest.importorskip("llamafactory")
+
+from app.services.evaluate.sequential_evaluation import StratifiedEstimate, stratified_order  # noqa: E402
+
+COUNTS = {"algebra": 100, "law": 1534, "biology": 310, "history": 7}
+
+
+def test_order_is_a_seeded_permutation_of_every_question():
+    order = stratified_order(COUNTS, seed=0)
+    assert sorted(order) == sorted((s, i) for s, count in COUNTS.items() for i in range(count))
+    assert stratified_order(COUNTS, seed=0) == order
+    assert stratified_order(COUNTS, seed=1) != order
+
+
+def test_every_prefix_is_stratified_by_subject():
+    order = stratified_order(COUNTS, seed=3)
+    total = sum(COUNTS.values())
+    bound = max(1, len(COUNTS) - 1)
+    seen = Counter()
+    for used, (subject, _) in enumerate(order, start=1):
+        seen[subject] += 1
+        for name, count in COUNTS.items():
+            assert abs(seen[name] - used * count / total) < bound
+
+
+def test_two_subjects_stay_within_one_question_of_their_share():
+    counts = {"a": 37, "b": 500}
+    seen = Counter()
+    for used, (subject, _) in enumerate(stratified_order(counts, seed=5), start=1):
+        seen[subject] += 1
+        assert abs(seen["a"] - used * 37 / 537) < 1
+
+
+def test_fully_evaluated_task_has_the_exact_score_and_no_width():
+    estimate = StratifiedEstimate({"a": 10, "b": 30}, confidence=0.95)
+    for i in range(10):
+        estimate.update("a", i < 7)
+    for i in range(30):
+        estimate.update("b", i < 12)
+    mean, lower, upper = estimate.interval()
+    assert mean == pytest.approx(100 * 19 / 40)
+    assert lower == pytest.approx(mean) and upper == pytest.approx(mean)
+
+
+def test_interval_uses_the_finite_population_correction():
+    population, n, k = 200, 50, 30
+    estimate = StratifiedEstimate({"a": population}, confidence=0.9)
+    for i in range(n):
+        estimate.update("a", i < k)
+    mean, lower, upper = estimate.interval()
+
+    smoothed = (k + 1) / (n + 2)
+    half_width = NormalDist().inv_cdf(0.95) * math.sqrt(
+        smoothed * (1 - smoothed) / n * (population - n) / (population - 1))
+    assert mean == pytest.approx(100 * k / n)
+    assert lower == pytest.approx(100 * (k / n - half_width))
+    assert upper == pytest.approx(100 * (k / n + half_width))
+
+
+def test_unseen_strata_count_with_pooled_rate_and_maximal_variance():
+    estimate = StratifiedEstimate({"a": 50, "b": 50})
+    for i in range(10):
+        estimate.update("a", i < 8)
+    mean, lower, upper = estimate.interval()
+    assert mean == pytest.approx(80.0)
+    # The unseen half alone contributes a standard error of 0.5 * 0.5
+    assert lower < mean - 100 * 1.95 * 0.5 * 0.5
+    assert upper == 100.0
+
+
+def test_more_planned_looks_widen_the_interval():
+    widths = []
+    for looks in (1, 5, 20):
+        estimate = StratifiedEstimate(COUNTS, looks=looks)
+        for subject, index in stratified_order(COUNTS, seed=0)[:300]:
+            estimate.update(subject, index % 3 != 0)
+        _, lower, upper = estimate.interval()
+        widths.append(upper - lower)
+    assert widths[0] < widths[1] < widths[2]
@@ -0,0 +1,112 @@
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("torch")
+pytest.importorskip("llamafactory")
+
+from app.config.inference_config import InferenceConfig  # noqa: E402
+from app.services.inference import workers  # noqa: E402
+from app.services.inference.workers import HashRing, WorkerRouter  # noqa: E402
+
+KEYS = [f"model-{i}" for i in range(1000)]
+
+
+def _worker(worker_id):
+    return SimpleNamespace(worker_id=worker_id, healthy=True, process=SimpleNamespace(is_alive=lambda: True),
+                           requests=queue.Queue(), routed_keys=set(), pool={})
+
+
+def _router(num_workers):
+    router = WorkerRouter(num_workers=num_workers)
+    router._workers = {worker_id: _worker(worker_id) for worker_id in range(num_workers)}
+    router._ring.rebuild(list(router._workers))
+    return router
+
+
+def test_ring_moves_only_the_removed_workers_keys():
+    ring = HashRing(replicas=64)
+    ring.rebuild([0, 1, 2, 3])
+    before = {key: ring.lookup(key) for key in KEYS}
+    assert set(before.values()) == {0, 1, 2, 3}
+
+    ring.rebuild([0, 1, 3])
+    after = {key: ring.lookup(key) for key in KEYS}
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved and all(before[key] == 2 for key in moved)
+    assert all(after[key] != 2 for key in KEYS)
+
+
+def test_ring_moves_about_one_nth_of_the_keys_when_a_worker_joins():
+    ring = HashRing(replicas=64)
+    ring.rebuild([0, 1, 2])
+    before = {key: ring.lookup(key) for key in KEYS}
+    ring.rebuild([0, 1, 2, 3])
+    moved = [key for key in KEYS if before[key] != ring.lookup(key)]
+    assert all(ring.lookup(key) == 3 for key in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.4
+
+
+def test_empty_ring_has_no_owner():
+    assert HashRing().lookup("model") is None
+
+
+def test_session_sticks_to_its_worker_until_the_ttl_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(workers.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(InferenceConfig, "WORKER_SESSION_TTL", 60)
+    router = _router(2)
+    owner = router.route("model-0", session_id="s")
+    other = 1 - owner
+    router._sessions["s"] = (other, "model-0", now[0])
+
+    now[0] += 30
+    assert router.route("model-0", session_id="s") == other  # refreshes last use
+    now[0] += 59
+    assert router.route("model-0", session_id="s") == other
+    now[0] += 61
+    assert router.route("model-0", session_id="s") == owner
+
+
+def test_sessions_are_bounded_least_recently_used_first(monkeypatch):
+    monkeypatch.setattr(InferenceConfig, "WORKER_MAX_SESSIONS", 2)
+    router = _router(2)
+    router.route("model-0", session_id="a")
+    router.route("model-0", session_id="b")
+    router.route("model-0", session_id="a")
+    router.route("model-0", session_id="c")
+    assert list(router._sessions) == ["a", "c"]
+
+
+def _sent(worker):
+    messages = []
+    while not worker.requests.empty():
+        messages.append(worker.requests.get())
+    return messages
+
+
+def test_rebalance_unloads_routing_keys_the_worker_no_longer_owns():
+    router = _router(3)
+    owners = {key: router.route(key) for key in KEYS[:100]}
+    moved = {key for key, owner in owners.items() if owner == 2}
+    assert moved
+
+    router._workers[2].healthy = False
+    router._rebalance()
+    # Losing a worker only hands its keys to the others, nothing moves between them
+    assert _sent(router._workers[0]) == _sent(router._workers[1]) == []
+    for key in moved:
+        router.route(key)
+
+    router._workers[2].healthy = True
+    router._rebalance()
+    unloaded = {}
+    for worker_id in (0, 1):
+        for message in _sent(router._workers[worker_id]):
+            assert message["op"] == "unload"
+            unloaded[message["model_key"]] = worker_id
+        assert not router._workers[worker_id].routed_keys & moved
+    assert set(unloaded) == moved
+    assert all(router.route(key) == 2 for key in moved)